@@ -0,0 +1,229 @@
+"""
+Admission control for HTTP requests.
+
+Each request path maps to a route class by longest prefix. A class caps
+how many of its requests run at once. Requests past the cap wait in a
+bounded FIFO queue, and a finished request hands its slot straight to
+the next waiter.
+
+Requests are shed instead of queued when:
+
+- the class's own queue is full: 429, since this client traffic is the
+  problem;
+- the queue depth summed over all classes has reached the class's
+  ``shed_at``: 503. Classes with a lower ``shed_at`` give way first, so
+  under overload search, admin and exports are refused while chat keeps
+  flowing;
+- a request waits longer than ``queue_timeout``: 503.
+
+Shed responses carry the class's ``Retry-After``. Paths that match no
+prefix, such as health checks, are never limited.
+"""
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class Shed(Exception):
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RouteClass:
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        max_queue: int,
+        shed_at: Optional[int] = None,
+        retry_after: int = 1,
+    ):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.shed_at = shed_at
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0}
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            **self.counters,
+        }
+
+
+# (name, limit, max_queue, shed_at, retry_after). Chat is never shed for
+# load elsewhere; the rest give way in order of their shed_at.
+DEFAULT_CLASSES: List[Tuple[str, int, int, Optional[int], int]] = [
+    ("chat", 64, 256, None, 1),
+    ("default", 32, 128, 256, 1),
+    ("auth", 4, 64, 128, 2),
+    ("search", 4, 16, 32, 5),
+    ("admin", 4, 16, 32, 5),
+    ("export", 2, 4, 16, 30),
+    ("transfer", 16, 32, 64, 10),
+]
+
+DEFAULT_ROUTES = {
+    "/api/conversations": "chat",
+    "/api/messages": "chat",
+    "/api/messages/search": "search",
+    "/api/presence": "chat",
+    "/api/auth": "auth",
+    "/api/search": "search",
+    "/api/admin": "admin",
+    "/api/users/me/export": "export",
+    "/api/schedules/export.ics": "export",
+    "/api/attachments": "transfer",
+    "/api": "default",
+}
+
+
+def _pairs(spec: str):
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = entry.partition("=")
+        yield key.strip(), value.strip()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        classes: Optional[List[RouteClass]] = None,
+        routes: Optional[Dict[str, str]] = None,
+        queue_timeout: float = 10.0,
+    ):
+        if classes is None:
+            classes = [RouteClass(*spec) for spec in DEFAULT_CLASSES]
+        self.classes = {route_class.name: route_class for route_class in classes}
+        routes = routes if routes is not None else DEFAULT_ROUTES
+        unknown = set(routes.values()) - set(self.classes)
+        if unknown:
+            raise ValueError(f"Unknown route classes: {sorted(unknown)}")
+        # Longest prefix first
+        self.routes = sorted(routes.items(), key=lambda item: len(item[0]), reverse=True)
+        self.queue_timeout = queue_timeout
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Defaults, adjusted by ``ADMISSION_LIMITS`` (``class=limit:queue,...``)
+        and ``ADMISSION_ROUTES`` (``/api/prefix=class,...``)."""
+        classes = [RouteClass(*spec) for spec in DEFAULT_CLASSES]
+        by_name = {route_class.name: route_class for route_class in classes}
+        for name, setting in _pairs(os.environ.get("ADMISSION_LIMITS", "")):
+            if name not in by_name:
+                raise ValueError(f"Unknown route class in ADMISSION_LIMITS: {name!r}")
+            limit, _, max_queue = setting.partition(":")
+            by_name[name].limit = int(limit)
+            if max_queue:
+                by_name[name].max_queue = int(max_queue)
+        routes = {**DEFAULT_ROUTES, **dict(_pairs(os.environ.get("ADMISSION_ROUTES", "")))}
+        return cls(
+            classes,
+            routes,
+            queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "10")),
+        )
+
+    def classify(self, path: str) -> Optional[RouteClass]:
+        for prefix, name in self.routes:
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return self.classes[name]
+        return None
+
+    def queue_depth(self) -> int:
+        return sum(route_class.waiting for route_class in self.classes.values())
+
+    def _shed(self, route_class: RouteClass, status_code: int, reason: str) -> Shed:
+        route_class.counters["shed"] += 1
+        return Shed(status_code, route_class.retry_after, reason)
+
+    async def acquire(self, route_class: RouteClass):
+        """Wait for a slot in ``route_class`` or raise ``Shed``."""
+        if route_class.shed_at is not None and self.queue_depth() >= route_class.shed_at:
+            raise self._shed(route_class, 503, "Server is busy")
+        if route_class.active < route_class.limit and not route_class.waiting:
+            route_class.active += 1
+            route_class.counters["admitted"] += 1
+            return
+        if route_class.waiting >= route_class.max_queue:
+            raise self._shed(route_class, 429, "Too many requests")
+
+        waiter = asyncio.get_running_loop().create_future()
+        route_class._waiters.append(waiter)
+        route_class.waiting += 1
+        route_class.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                route_class.counters["timed_out"] += 1
+                raise self._shed(route_class, 503, "Server is busy")
+        except asyncio.CancelledError:
+            # The client went away; pass on a slot handed over meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self.release(route_class)
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            route_class.waiting -= 1
+        route_class.counters["admitted"] += 1
+
+    def release(self, route_class: RouteClass):
+        while route_class._waiters:
+            waiter = route_class._waiters.popleft()
+            if not waiter.done():
+                # The slot passes to the waiter, so ``active`` is unchanged
+                waiter.set_result(None)
+                return
+        route_class.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "classes": {name: route_class.stats() for name, route_class in self.classes.items()},
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an ``AdmissionController`` to HTTP requests."""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.controller.classify(scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.controller.acquire(route_class)
+        except Shed as shed:
+            body = json.dumps({"detail": shed.reason}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": shed.status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(shed.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
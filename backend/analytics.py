@@ -0,0 +1,179 @@
+"""
+Incrementally maintained analytics rollups.
+
+Counted writes (messages, bookings, sign-ups) add to a counter for their
+hour and their day in ``analytics_rollups``. The admin dashboard then
+reads a handful of small documents instead of scanning ``messages``,
+``schedules`` or ``users``. A counter is keyed by metric, granularity,
+bucket start and an optional dimension: the mentor for bookings, the role
+for sign-ups. Weekly figures are summed from the daily buckets on read.
+
+Recording happens in memory and costs the write path nothing. Pending
+increments are flushed as one unordered bulk upsert per interval.
+Increments still pending when a worker dies are lost, and
+``analytics_backfill.py`` rebuilds the counters from the source data.
+
+Every flush has an id that is kept on the counters it updated, and an
+update only applies to a counter that does not carry its id yet. A flush
+whose outcome is unknown (a timeout, a lost connection) is retried under
+the same id, so increments that did land are not counted twice: the
+upsert then hits the unique index instead, which means "already done".
+"""
+import asyncio
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Metric -> (source collection, field used as the dimension key)
+METRICS = {
+    "messages": ("messages", None),
+    "bookings": ("schedules", "mentor_id"),
+    "signups": ("users", "role"),
+}
+GRANULARITIES = ("hour", "day")
+BUCKET_LENGTHS = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}
+# Flush ids remembered per counter; a retry comes well within this many flushes
+FLUSH_IDS_KEPT = 16
+DUPLICATE_KEY = 11000
+
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    day = at.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        # Weeks start on Monday
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def rollup_key(metric: str, granularity: str, bucket: datetime, key: str) -> dict:
+    return {"metric": metric, "granularity": granularity, "bucket": bucket, "key": key}
+
+
+class Rollups:
+    def __init__(self, get_db: Callable[[], object], flush_interval: float = 1.0):
+        self._get_db = get_db
+        self.flush_interval = flush_interval
+        # (metric, granularity, bucket, key) -> increment not yet written
+        self._pending: Counter = Counter()
+        # (flush id, increments) of flushes that may or may not have landed
+        self._unsettled: List[Tuple[str, Counter]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def record(self, metric: str, at: datetime, key: Optional[str] = None):
+        self.record_many(metric, [(at, key)])
+
+    def record_many(self, metric: str, events: Iterable[Tuple[datetime, Optional[str]]]):
+        for at, key in events:
+            if isinstance(key, Enum):
+                key = key.value
+            for granularity in GRANULARITIES:
+                self._pending[(metric, granularity, bucket_start(at, granularity), key or "")] += 1
+
+    async def flush(self) -> int:
+        """Write pending increments. Returns how many counters were updated."""
+        flushes, self._unsettled = self._unsettled, []
+        if self._pending:
+            flushes.append((uuid.uuid4().hex, self._pending))
+            self._pending = Counter()
+        written = 0
+        for i, (flush_id, pending) in enumerate(flushes):
+            try:
+                written += await self._write(flush_id, pending)
+            except PyMongoError:
+                # Retried with the next flush; only a worker exit loses them
+                self._unsettled += flushes[i:]
+                raise
+        return written
+
+    async def _write(self, flush_id: str, pending: Counter) -> int:
+        counters = list(pending.items())
+        try:
+            await self._get_db().analytics_rollups.bulk_write(
+                [
+                    UpdateOne(
+                        {**rollup_key(*counter), "flushes": {"$ne": flush_id}},
+                        {
+                            "$inc": {"count": increment},
+                            "$push": {"flushes": {"$each": [flush_id], "$slice": -FLUSH_IDS_KEPT}},
+                        },
+                        upsert=True,
+                    )
+                    for counter, increment in counters
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as exc:
+            if exc.details.get("writeConcernErrors"):
+                raise
+            # The other updates were applied. A duplicate key means this
+            # flush already reached the counter; anything else did not apply.
+            failed = [
+                error for error in exc.details["writeErrors"] if error["code"] != DUPLICATE_KEY
+            ]
+            if failed:
+                logger.warning("Analytics flush failed for %d of %d counters", len(failed), len(counters))
+                self._pending.update({counters[error["index"]][0]: counters[error["index"]][1] for error in failed})
+            return len(counters) - len(failed)
+        return len(counters)
+
+    async def series(
+        self,
+        metric: str,
+        granularity: str,
+        start: datetime,
+        end: datetime,
+        key: Optional[str] = None,
+    ) -> List[dict]:
+        """Counts per bucket and key for buckets starting in ``[start, end)``, oldest first."""
+        stored = "day" if granularity == "week" else granularity
+        query = {
+            "metric": metric,
+            "granularity": stored,
+            "bucket": {"$gte": bucket_start(start, granularity), "$lt": end},
+        }
+        if key is not None:
+            query["key"] = key
+        counters = await self._get_db().analytics_rollups.find(
+            query, {"_id": 0, "bucket": 1, "key": 1, "count": 1}
+        ).to_list(None)
+        totals: Counter = Counter()
+        for counter in counters:
+            totals[(bucket_start(counter["bucket"], granularity), counter["key"])] += counter["count"]
+        return [
+            {"bucket": bucket, "key": key, "count": count}
+            for (bucket, key), count in sorted(totals.items())
+        ]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Analytics flush failed")
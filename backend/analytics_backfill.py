@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Rebuild the analytics rollups from existing data.
+
+    python analytics_backfill.py [--metric messages] [--batch-size 50000] [--before 2024-06-01T00:00]
+
+Source documents are read in batches. Each batch's timestamps are floored
+to hours and days with NumPy and counted per bucket and key with pandas.
+Once every batch is in, the totals overwrite the counters. Messages
+include those moved to the archive.
+
+Only buckets that closed before ``--before`` (default: now) are written.
+Open buckets are left to the live counters, so the backfill can run
+while the API serves traffic, and running it again changes nothing. A
+bucket that was already open when live counting was deployed is only
+partly counted until a backfill runs after it closes.
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from analytics import BUCKET_LENGTHS, GRANULARITIES, METRICS, bucket_start, rollup_key
+from database import get_database
+from message_archive import unpack_segment
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+WRITE_BATCH = 1000
+NUMPY_UNITS = {"hour": "datetime64[h]", "day": "datetime64[D]"}
+
+
+class BucketCounts:
+    """Running per-granularity totals, indexed by (bucket, key)."""
+
+    def __init__(self):
+        self.totals = {granularity: None for granularity in GRANULARITIES}
+
+    def add(self, times: list, keys: list):
+        if not times:
+            return
+        stamps = np.array(times, dtype="datetime64[us]")
+        for granularity in GRANULARITIES:
+            frame = pd.DataFrame({"bucket": stamps.astype(NUMPY_UNITS[granularity]), "key": keys})
+            counts = frame.value_counts(["bucket", "key"])
+            totals = self.totals[granularity]
+            self.totals[granularity] = counts if totals is None else totals.add(counts, fill_value=0)
+
+    def counters(self, metric: str, before: datetime):
+        for granularity, totals in self.totals.items():
+            if totals is None:
+                continue
+            for (bucket, key), count in totals.items():
+                bucket = pd.Timestamp(bucket).to_pydatetime()
+                if bucket + BUCKET_LENGTHS[granularity] <= before:
+                    yield rollup_key(metric, granularity, bucket, key), int(count)
+
+
+async def documents(db, metric: str, before: datetime):
+    """Yield ``(created_at, key)`` of every source document before ``before``."""
+    collection, key_field = METRICS[metric]
+    projection = {"_id": 0, "created_at": 1}
+    if key_field:
+        projection[key_field] = 1
+    async for doc in db[collection].find({"created_at": {"$lt": before}}, projection):
+        yield doc["created_at"], str(doc.get(key_field) or "") if key_field else ""
+    if metric == "messages":
+        segments = db.message_archive.find(
+            {"first_created_at": {"$lt": before}}, {"_id": 0, "data": 1}
+        )
+        async for segment in segments:
+            for message in unpack_segment(segment["data"]):
+                if message["created_at"] < before:
+                    yield message["created_at"], ""
+
+
+async def backfill(db, metric: str, before: datetime, batch_size: int = 50000) -> int:
+    """Recount ``metric`` and overwrite its closed buckets. Returns counters written."""
+    counts = BucketCounts()
+    times, keys = [], []
+    async for created_at, key in documents(db, metric, bucket_start(before, "hour")):
+        times.append(created_at)
+        keys.append(key)
+        if len(times) >= batch_size:
+            counts.add(times, keys)
+            times, keys = [], []
+    counts.add(times, keys)
+
+    written = 0
+    requests = []
+    for counter, count in counts.counters(metric, before):
+        requests.append(UpdateOne(counter, {"$set": {"count": count}}, upsert=True))
+        if len(requests) >= WRITE_BATCH:
+            await db.analytics_rollups.bulk_write(requests, ordered=False)
+            written += len(requests)
+            requests = []
+    if requests:
+        await db.analytics_rollups.bulk_write(requests, ordered=False)
+        written += len(requests)
+    return written
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--metric", choices=sorted(METRICS), action="append")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--before", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    database = get_database()
+    before = args.before or datetime.utcnow()
+    try:
+        for metric in args.metric or sorted(METRICS):
+            written = await backfill(database.db, metric, before, args.batch_size)
+            print(f"{metric}: {written} counters written")
+    finally:
+        database.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
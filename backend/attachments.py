@@ -0,0 +1,434 @@
+"""
+Chat attachments: resumable chunked uploads into a content-addressed blob store.
+
+An upload starts as an ``attachments`` document in state ``uploading``
+with its declared size. The client sends the bytes in one or more chunks,
+each tagged with the offset it starts at. Every chunk is streamed to its
+own part file. The part is then appended to the upload's staging file
+under a short claim on the offset, so of two requests racing for one
+offset only one touches the staging file. Whatever arrived before a
+dropped connection is kept, so the client asks for the stored offset and
+carries on from there. With the last byte the staging file is hashed, handed to the blob
+store under its SHA-256 and the attachment becomes ``ready``. Identical
+files share one blob.
+
+Messages store only attachment metadata. Downloads go to the blob: the
+local store serves the file, or one byte range of it, from disk; the S3
+store hands out presigned URLs and S3 answers range requests itself. No
+more than one chunk of a file is ever held in memory.
+
+Staging files live on the local disk of the worker taking the upload, so
+with several workers an upload's chunks must reach the same one, or the
+staging directory must be shared.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional, Tuple
+from urllib.parse import quote
+
+from pymongo import ReturnDocument
+from starlette.responses import FileResponse, RedirectResponse, Response
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+# Held while one part is copied into the staging file, a local disk copy
+APPEND_LEASE = timedelta(minutes=5)
+BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class OffsetMismatch(Exception):
+    """A chunk does not start where the stored upload ends."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload continues at offset {offset}")
+        self.offset = offset
+
+
+def content_disposition(filename: str) -> str:
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive ``(start, end)`` of a single byte range.
+
+    Returns ``None`` when the header should be ignored and the whole file
+    sent (other units, several ranges, bad syntax), and raises
+    ``ValueError`` when the range lies outside the file.
+    """
+    match = BYTE_RANGE.match(header.replace(" ", ""))
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+class FileRangeResponse(FileResponse):
+    """A 206 response carrying bytes ``start``-``end`` of a file.
+
+    Uses the ASGI zero-copy extension when the server offers it.
+    """
+
+    def __init__(self, path, start: int, end: int, size: int, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.start = start
+        self.length = end - start + 1
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        file = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                })
+                return
+            await asyncio.to_thread(file.seek, self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await asyncio.to_thread(file.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        finally:
+            await asyncio.to_thread(file.close)
+
+
+class LocalBlobStore:
+    """Blobs as files under ``root``, fanned out by digest prefix."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        # On the same filesystem, so finished uploads are renamed into place
+        self.staging_dir = self.root / ".staging"
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    async def put(self, digest: str, staged: Path):
+        """Take ownership of ``staged``, whose contents hash to ``digest``."""
+        def move():
+            target = self.path(digest)
+            if target.exists():
+                staged.unlink()
+                return
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staged, target)
+
+        await asyncio.to_thread(move)
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        return self.path(digest)
+
+    async def url(self, digest: str, filename: str, content_type: str) -> Optional[str]:
+        return None
+
+
+class S3BlobStore:
+    """Blobs as objects in an S3-compatible bucket, downloaded via presigned URLs."""
+
+    def __init__(
+        self,
+        bucket: str,
+        staging_dir: Path,
+        prefix: str = "attachments/",
+        endpoint_url: Optional[str] = None,
+        url_ttl: int = 3600,
+        client=None,
+    ):
+        self.bucket = bucket
+        self.staging_dir = Path(staging_dir)
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.url_ttl = url_ttl
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    def key(self, digest: str) -> str:
+        return f"{self.prefix}{digest}"
+
+    async def exists(self, digest: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self.key(digest))
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def fetch(self, digest: str, target: Path):
+        """Download the blob into the local file ``target``."""
+        await asyncio.to_thread(self.client.download_file, self.bucket, self.key(digest), str(target))
+
+    async def put(self, digest: str, staged: Path):
+        if not await self.exists(digest):
+            # upload_file streams the file from disk in multipart parts
+            await asyncio.to_thread(self.client.upload_file, str(staged), self.bucket, self.key(digest))
+        await asyncio.to_thread(staged.unlink)
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        return None
+
+    async def url(self, digest: str, filename: str, content_type: str) -> Optional[str]:
+        params = {
+            "Bucket": self.bucket,
+            "Key": self.key(digest),
+            "ResponseContentType": content_type,
+            "ResponseContentDisposition": content_disposition(filename),
+        }
+        return await asyncio.to_thread(
+            self.client.generate_presigned_url, "get_object", Params=params, ExpiresIn=self.url_ttl
+        )
+
+
+def blob_store_from_env(default_root: Path):
+    """``ATTACHMENT_STORE=local`` (files under ``ATTACHMENT_DIR``) or ``s3``
+    (``ATTACHMENT_S3_BUCKET``, ``ATTACHMENT_S3_PREFIX``, ``ATTACHMENT_S3_ENDPOINT``)."""
+    root = Path(os.environ.get("ATTACHMENT_DIR", str(default_root)))
+    kind = os.environ.get("ATTACHMENT_STORE", "local")
+    if kind == "local":
+        return LocalBlobStore(root)
+    if kind == "s3":
+        return S3BlobStore(
+            bucket=os.environ["ATTACHMENT_S3_BUCKET"],
+            staging_dir=root / ".staging",
+            prefix=os.environ.get("ATTACHMENT_S3_PREFIX", "attachments/"),
+            endpoint_url=os.environ.get("ATTACHMENT_S3_ENDPOINT") or None,
+        )
+    raise ValueError(f"Unknown ATTACHMENT_STORE: {kind!r}")
+
+
+def _open_part(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path, "wb")
+
+
+def _append_at(path: Path, offset: int, part: Path):
+    with open(path, "r+b" if path.exists() else "w+b") as file, open(part, "rb") as source:
+        # Drop anything past the stored offset, left by an append that was never recorded
+        file.truncate(offset)
+        file.seek(offset)
+        shutil.copyfileobj(source, file, READ_SIZE)
+
+
+class AttachmentService:
+    def __init__(
+        self,
+        get_db: Callable[[], object],
+        store,
+        max_size: int = 100 * 1024 * 1024,
+        upload_ttl: timedelta = timedelta(days=1),
+        interval: float = 3600.0,
+    ):
+        self._get_db = get_db
+        self.store = store
+        self.max_size = max_size
+        self.upload_ttl = upload_ttl
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def staged_path(self, upload_id: str) -> Path:
+        return self.store.staging_dir / upload_id
+
+    async def create_upload(
+        self, owner_id: str, conversation_id: str, filename: str, content_type: str, size: int
+    ) -> dict:
+        """Raises ``ValueError`` if ``size`` is over ``max_size``."""
+        if size > self.max_size:
+            raise ValueError(f"Attachments are limited to {self.max_size} bytes")
+        now = datetime.utcnow()
+        upload = {
+            "id": str(uuid.uuid4()),
+            "owner_id": owner_id,
+            "conversation_id": conversation_id,
+            "filename": filename,
+            "content_type": content_type,
+            "size": size,
+            "received": 0,
+            "status": "uploading",
+            "sha256": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self._get_db().attachments.insert_one(dict(upload))
+        return upload
+
+    async def write_chunk(self, upload: dict, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+        """Append ``chunks`` at ``offset`` and return the updated upload.
+
+        Raises ``OffsetMismatch`` unless ``offset`` is where the upload
+        stands, and ``ValueError`` if the chunk runs past the declared size.
+        Bytes written before an error or disconnect are kept.
+        """
+        if upload["status"] != "uploading" or offset != upload["received"]:
+            raise OffsetMismatch(upload["received"])
+        part = self.staged_path(f"{upload['id']}.{uuid.uuid4().hex}.part")
+        file = await asyncio.to_thread(_open_part, part)
+        written = offset
+        try:
+            async for chunk in chunks:
+                if written + len(chunk) > upload["size"]:
+                    raise ValueError("Chunk runs past the declared size")
+                await asyncio.to_thread(file.write, chunk)
+                written += len(chunk)
+        finally:
+            await asyncio.to_thread(file.close)
+            try:
+                if written > offset:
+                    upload = await self._append(upload, offset, written, part)
+            finally:
+                await asyncio.to_thread(part.unlink, missing_ok=True)
+        if upload["received"] == upload["size"]:
+            upload = await self._finish(upload, self.staged_path(upload["id"]))
+        return upload
+
+    async def _append(self, upload: dict, offset: int, received: int, part: Path) -> dict:
+        db = self._get_db()
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        # Claim the offset first: of two chunks racing for the same offset
+        # only one is appended, the other gets the mismatch
+        claimed = await db.attachments.find_one_and_update(
+            {
+                "id": upload["id"], "status": "uploading", "received": offset,
+                "$or": [{"appending_until": None}, {"appending_until": {"$lt": now}}],
+            },
+            {"$set": {"appending": token, "appending_until": now + APPEND_LEASE}},
+        )
+        if claimed is None:
+            raise await self._mismatch(upload["id"], offset)
+        await asyncio.to_thread(_append_at, self.staged_path(upload["id"]), offset, part)
+        updated = await db.attachments.find_one_and_update(
+            {"id": upload["id"], "appending": token},
+            {"$set": {
+                "received": received, "appending": None, "appending_until": None,
+                "updated_at": datetime.utcnow(),
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is None:
+            raise await self._mismatch(upload["id"], offset)
+        return updated
+
+    async def _mismatch(self, upload_id: str, offset: int) -> OffsetMismatch:
+        current = await self._get_db().attachments.find_one({"id": upload_id}, {"received": 1})
+        return OffsetMismatch(current["received"] if current else offset)
+
+    async def _finish(self, upload: dict, staged: Path) -> dict:
+        digest = await asyncio.to_thread(file_sha256, staged)
+        await self.store.put(digest, staged)
+        return await self._get_db().attachments.find_one_and_update(
+            {"id": upload["id"]},
+            {"$set": {"status": "ready", "sha256": digest, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def download(self, attachment: dict, range_header: Optional[str] = None) -> Response:
+        """Response for a ready attachment, honouring a single byte ``Range``."""
+        digest, size = attachment["sha256"], attachment["size"]
+        url = await self.store.url(digest, attachment["filename"], attachment["content_type"])
+        if url is not None:
+            return RedirectResponse(url, status_code=307)
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": f'"{digest}"',
+            # Content-addressed, so a given attachment never changes
+            "cache-control": "private, max-age=31536000, immutable",
+            "content-disposition": content_disposition(attachment["filename"]),
+        }
+        path = self.store.local_path(digest)
+        try:
+            byte_range = parse_range(range_header, size) if range_header else None
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+        if byte_range is None:
+            return FileResponse(path, media_type=attachment["content_type"], headers=headers)
+        return FileRangeResponse(
+            path, *byte_range, size, media_type=attachment["content_type"], headers=headers
+        )
+
+    async def purge_stale(self, now: Optional[datetime] = None) -> int:
+        """Drop uploads left unfinished for longer than ``upload_ttl``."""
+        db = self._get_db()
+        cutoff = (now or datetime.utcnow()) - self.upload_ttl
+        stale = await db.attachments.find(
+            {"status": "uploading", "updated_at": {"$lt": cutoff}}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        for upload in stale:
+            await asyncio.to_thread(self._remove_staged, upload["id"])
+        if stale:
+            await db.attachments.delete_many({"id": {"$in": [upload["id"] for upload in stale]}})
+        return len(stale)
+
+    def _remove_staged(self, upload_id: str):
+        self.staged_path(upload_id).unlink(missing_ok=True)
+        # Parts left by a worker that died mid-chunk
+        for part in self.store.staging_dir.glob(f"{upload_id}.*.part"):
+            part.unlink(missing_ok=True)
+
+    async def _run(self):
+        while True:
+            try:
+                purged = await self.purge_stale()
+                if purged:
+                    logger.info("Purged %d unfinished uploads", purged)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Upload purge failed")
+            await asyncio.sleep(self.interval)
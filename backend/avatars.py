@@ -0,0 +1,289 @@
+"""
+Avatar uploads and their thumbnail pipeline.
+
+An uploaded image is stored once, unmodified, in the shared blob store
+under its SHA-256, so whichever worker claims the job can read it. A job
+in ``avatar_jobs`` then renders it into the fixed square ``VARIANTS``.
+The worker claims jobs with a lease, like the cascade cleanup, so a job
+survives a worker dying midway. Each claim counts as an attempt, and a
+job that keeps taking its worker down is failed after ``max_attempts``;
+any error while rendering fails it at once. Thumbnails are stored next to
+each other under the original's digest in ``root``, which every worker
+serving them must share. An image that was already rendered, for example
+the same file uploaded by two users, is not rendered again.
+
+Jobs can finish out of order, so the profile records the creation time
+of the job its avatar came from, and an older job never overwrites the
+avatar of a newer one.
+
+Thumbnail URLs contain the digest, so their contents never change and
+they can be cached forever. The profile's ``avatar_url`` points at the
+large variant. ``avatar_variant`` maps it to any other size, which is how
+list responses such as search results reference the small one. Profile
+changes are announced through ``publish``, so cached search results pick
+up the new avatar.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Edge length in pixels of each square thumbnail, largest first
+VARIANTS = {"large": 400, "medium": 160, "small": 64}
+MAX_PIXELS = 40_000_000
+READ_SIZE = 1024 * 1024
+DIGEST = re.compile(r"[0-9a-f]{64}")
+AVATAR_URL = re.compile(rf"^/api/avatars/(?P<digest>{DIGEST.pattern})/(?P<variant>\w+)\.webp$")
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def avatar_url(digest: str, variant: str = "large") -> str:
+    return f"/api/avatars/{digest}/{variant}.webp"
+
+
+def avatar_variant(url: str, variant: str) -> str:
+    """The ``variant`` of an uploaded avatar's URL; other URLs pass through."""
+    match = AVATAR_URL.match(url or "")
+    return avatar_url(match["digest"], variant) if match else url
+
+
+def check_image(path: Path):
+    """Raises ``InvalidImage`` unless ``path`` holds an image Pillow can read."""
+    from PIL import Image, UnidentifiedImageError
+    try:
+        with Image.open(path) as image:
+            if image.width * image.height > MAX_PIXELS:
+                raise InvalidImage("Image is too large")
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as exc:
+        raise InvalidImage("Not a supported image") from exc
+
+
+def render_thumbnails(source: Path, target_dir: Path):
+    """Write every variant of ``source`` into ``target_dir`` as WebP."""
+    from PIL import Image, ImageOps
+    target_dir.mkdir(parents=True, exist_ok=True)
+    largest = max(VARIANTS.values())
+    with Image.open(source) as image:
+        # Lets JPEG decode straight at a reduced scale
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        # Each size is scaled from the previous one, not the full original
+        for variant, edge in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+            image = ImageOps.fit(image, (edge, edge), Image.LANCZOS)
+            partial = target_dir / f".{variant}.webp.{uuid.uuid4().hex}"
+            image.save(partial, "WEBP", quality=82, method=4)
+            os.replace(partial, target_dir / f"{variant}.webp")
+
+
+class AvatarPipeline:
+    def __init__(
+        self,
+        get_db: Callable[[], object],
+        root: Path,
+        store,
+        profile_defaults: Callable[[str], dict],
+        publish: Optional[Callable[[str, List[str]], Awaitable[None]]] = None,
+        max_size: int = 5 * 1024 * 1024,
+        lease: timedelta = timedelta(minutes=5),
+        max_attempts: int = 3,
+        idle_poll: float = 60.0,
+    ):
+        self._get_db = get_db
+        self.root = Path(root)
+        # Blob store for originals, shared with chat attachments
+        self.store = store
+        # Fields of a new empty profile, for users without one yet
+        self.profile_defaults = profile_defaults
+        # Cache invalidation, ``InvalidationBus.publish`` in the app
+        self._publish = publish
+        self.max_size = max_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.idle_poll = idle_poll
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def thumbnail_path(self, digest: str, variant: str) -> Path:
+        return self.root / digest[:2] / digest / f"{variant}.webp"
+
+    async def store_original(self, upload) -> str:
+        """Copy ``upload`` (anything with an async ``read``) into the store.
+
+        Returns its digest. Raises ``ValueError`` past ``max_size`` and
+        ``InvalidImage`` if it is not an image.
+        """
+        staged = self.store.staging_dir / f"avatar-{uuid.uuid4().hex}"
+        await asyncio.to_thread(staged.parent.mkdir, parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(staged, "wb") as file:
+                while True:
+                    chunk = await upload.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise ValueError(f"Avatars are limited to {self.max_size} bytes")
+                    digest.update(chunk)
+                    await asyncio.to_thread(file.write, chunk)
+            await asyncio.to_thread(check_image, staged)
+            await self.store.put(digest.hexdigest(), staged)
+        finally:
+            await asyncio.to_thread(staged.unlink, missing_ok=True)
+        return digest.hexdigest()
+
+    async def enqueue(self, user_id: str, digest: str) -> dict:
+        """Persist a render job for ``user_id``'s new avatar and wake the worker.
+
+        Pending jobs for an earlier avatar of the same user are dropped.
+        """
+        db = self._get_db()
+        now = datetime.utcnow()
+        await db.avatar_jobs.update_many(
+            {"user_id": user_id, "status": "pending"},
+            {"$set": {"status": "superseded", "updated_at": now}},
+        )
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "digest": digest,
+            "status": "pending",
+            "error": None,
+            "attempts": 0,
+            "lease_until": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await db.avatar_jobs.insert_one(dict(job))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self._get_db().avatar_jobs.find_one_and_update(
+            {"$or": [
+                {"status": "pending"},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {
+                "$set": {"status": "running", "lease_until": now + self.lease, "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _finish(self, job: dict, status: str, error: Optional[str] = None):
+        await self._get_db().avatar_jobs.update_one(
+            {"id": job["id"]},
+            {"$set": {"status": status, "error": error, "lease_until": None, "updated_at": datetime.utcnow()}},
+        )
+
+    async def _render(self, digest: str):
+        source = self.store.local_path(digest)
+        fetched = None
+        if source is None:
+            fetched = source = self.store.staging_dir / f"avatar-{uuid.uuid4().hex}"
+            await asyncio.to_thread(fetched.parent.mkdir, parents=True, exist_ok=True)
+            await self.store.fetch(digest, fetched)
+        try:
+            await asyncio.to_thread(render_thumbnails, source, self.thumbnail_path(digest, "large").parent)
+        finally:
+            if fetched is not None:
+                await asyncio.to_thread(fetched.unlink, missing_ok=True)
+
+    async def process(self, job: dict):
+        digest = job["digest"]
+        if job.get("attempts", 1) > self.max_attempts:
+            # Earlier claims died without finishing, most likely in the render
+            logger.warning("Avatar %s failed %d times, giving up", digest, self.max_attempts)
+            await self._finish(job, "failed", "Could not be rendered")
+            return
+        if not all(self.thumbnail_path(digest, variant).exists() for variant in VARIANTS):
+            try:
+                await self._render(digest)
+            except Exception as exc:
+                logger.exception("Avatar %s could not be rendered", digest)
+                await self._finish(job, "failed", str(exc) or type(exc).__name__)
+                return
+        now = datetime.utcnow()
+        url = avatar_url(digest)
+        try:
+            await self._get_db().profiles.update_one(
+                # Only over an avatar from an older job; a newer one wins
+                {"user_id": job["user_id"], "$or": [
+                    {"avatar_job_at": {"$exists": False}},
+                    {"avatar_job_at": {"$lt": job["created_at"]}},
+                ]},
+                {
+                    "$set": {"avatar_url": url, "avatar_job_at": job["created_at"], "updated_at": now},
+                    "$inc": {"version": 1},
+                    "$setOnInsert": {
+                        k: v for k, v in self.profile_defaults(job["user_id"]).items()
+                        if k not in ("avatar_url", "updated_at")
+                    },
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The profile exists and carries a newer job's avatar
+            await self._finish(job, "superseded")
+            return
+        if self._publish is not None:
+            await self._publish("profiles", [job["user_id"]])
+        await self._finish(job, "completed")
+
+    async def run_pending(self) -> int:
+        """Process jobs until none are claimable. Returns how many ran."""
+        processed = 0
+        while True:
+            job = await self._claim()
+            if job is None:
+                return processed
+            await self.process(job)
+            processed += 1
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.run_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Avatar pipeline iteration failed")
+            try:
+                # Also wakes periodically to pick up jobs whose lease expired
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_poll)
+            except asyncio.TimeoutError:
+                pass
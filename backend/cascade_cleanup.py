@@ -0,0 +1,262 @@
+"""
+Background cascade cleanup for deleted users.
+
+Deleting a mentor removes only the ``users`` and ``profiles`` documents
+inline. Everything that references the user is handled afterwards by this
+worker. Schedules are deleted. The user then leaves each conversation.
+A conversation that still has other members keeps its history for them,
+and the user is recorded in its ``former_members``; these are left in
+batches. A conversation left with no members is deleted: first its
+messages and archived message segments, then the conversation itself.
+
+Each deletion is a persisted job in ``cleanup_jobs``. Jobs advance in
+throttled batches, with a pause between batches to cap the extra load on
+Mongo. The job's phase and counters are checkpointed after every batch,
+and jobs are claimed with a renewable lease. A worker that dies midway
+therefore leaves a job that another worker, or the next start, resumes.
+Every phase deletes what it has processed, so resuming never repeats
+work. A checkpoint only succeeds while the worker still holds the lease.
+A worker whose lease expired stops, leaving the job to its new owner.
+
+Conversation changes are announced through ``publish``, so other
+workers drop their cached membership of the conversation.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+PHASES = ["schedules", "conversations", "done"]
+
+
+class LeaseLost(Exception):
+    """Another worker claimed the job after this worker's lease expired."""
+
+
+class CascadeCleanup:
+    def __init__(
+        self,
+        get_db: Callable[[], object],
+        publish: Optional[Callable[[str, List[str]], Awaitable[None]]] = None,
+        batch_size: int = 500,
+        batch_pause: float = 0.05,
+        lease: timedelta = timedelta(minutes=5),
+        idle_poll: float = 60.0,
+    ):
+        self._get_db = get_db
+        # Cache invalidation, ``InvalidationBus.publish`` in the app
+        self._publish = publish
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.lease = lease
+        self.idle_poll = idle_poll
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def enqueue(self, user_ids: List[str]) -> List[str]:
+        """Persist one cleanup job per deleted user and wake the worker."""
+        if not user_ids:
+            return []
+        now = datetime.utcnow()
+        jobs = [
+            {
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "status": "pending",
+                "phase": PHASES[0],
+                "removed": {"schedules": 0, "conversations": 0, "messages": 0, "archive_segments": 0},
+                "conversations_left": 0,
+                "lease_owner": None,
+                "lease_until": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for user_id in user_ids
+        ]
+        await self._get_db().cleanup_jobs.insert_many(jobs)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return [job["id"] for job in jobs]
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self._get_db().cleanup_jobs.find_one_and_update(
+            {"$or": [
+                {"status": "pending"},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {
+                "status": "running",
+                "lease_owner": uuid.uuid4().hex,
+                "lease_until": now + self.lease,
+                "updated_at": now,
+            }},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _checkpoint(self, job: dict, **changes):
+        now = datetime.utcnow()
+        changes = {"lease_until": now + self.lease, "updated_at": now, **changes}
+        result = await self._get_db().cleanup_jobs.update_one(
+            {"id": job["id"], "lease_owner": job["lease_owner"]}, {"$set": changes}
+        )
+        if result.matched_count == 0:
+            raise LeaseLost(job["id"])
+        job.update(changes)
+
+    async def _delete_batch(self, collection, query: dict) -> int:
+        docs = await collection.find(query, {"_id": 1}).limit(self.batch_size).to_list(self.batch_size)
+        if not docs:
+            return 0
+        await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        await asyncio.sleep(self.batch_pause)
+        return len(docs)
+
+    async def _remove_schedules(self, job: dict):
+        db = self._get_db()
+        user_id = job["user_id"]
+        query = {"$or": [{"mentor_id": user_id}, {"seeker_id": user_id}]}
+        while True:
+            removed = await self._delete_batch(db.schedules, query)
+            if not removed:
+                break
+            job["removed"]["schedules"] += removed
+            await self._checkpoint(job, removed=job["removed"])
+
+    async def _announce(self, conversation_ids: List[str]):
+        if self._publish is not None:
+            await self._publish("conversations", conversation_ids)
+
+    async def _leave_shared(self, job: dict):
+        db = self._get_db()
+        user_id = job["user_id"]
+        # Conversations with at least one other member
+        query = {"members": user_id, "members.1": {"$exists": True}}
+        while True:
+            docs = await db.conversations.find(query, {"_id": 0, "id": 1}).limit(self.batch_size).to_list(self.batch_size)
+            if not docs:
+                break
+            ids = [doc["id"] for doc in docs]
+            result = await db.conversations.update_many(
+                {"id": {"$in": ids}, "members": user_id},
+                {
+                    "$pull": {"members": user_id},
+                    "$addToSet": {"former_members": user_id},
+                    "$set": {"updated_at": datetime.utcnow()},
+                },
+            )
+            await self._announce(ids)
+            await self._checkpoint(
+                job, conversations_left=job.get("conversations_left", 0) + result.modified_count
+            )
+            await asyncio.sleep(self.batch_pause)
+
+    async def _remove_conversations(self, job: dict):
+        await self._leave_shared(job)
+        db = self._get_db()
+        user_id = job["user_id"]
+        while True:
+            # Leave the next conversation, normally one the user is alone
+            # in. One emptied by an interrupted run or by the other members
+            # leaving meanwhile is found again through former_members
+            conversation = await db.conversations.find_one_and_update(
+                {"$or": [
+                    {"members": user_id},
+                    {"members": {"$size": 0}, "former_members": user_id},
+                ]},
+                {
+                    "$pull": {"members": user_id},
+                    "$addToSet": {"former_members": user_id},
+                    "$set": {"updated_at": datetime.utcnow()},
+                },
+                return_document=ReturnDocument.AFTER,
+            )
+            if conversation is None:
+                break
+            await self._announce([conversation["id"]])
+            if conversation["members"]:
+                # Someone joined since the shared ones were left
+                await self._checkpoint(job, conversations_left=job.get("conversations_left", 0) + 1)
+                continue
+            while True:
+                removed = await self._delete_batch(
+                    db.messages, {"conversation_id": conversation["id"]}
+                )
+                if not removed:
+                    break
+                job["removed"]["messages"] += removed
+                await self._checkpoint(job, removed=job["removed"])
+            while True:
+                removed = await self._delete_batch(
+                    db.message_archive, {"conversation_id": conversation["id"]}
+                )
+                if not removed:
+                    break
+                job["removed"]["archive_segments"] = job["removed"].get("archive_segments", 0) + removed
+                await self._checkpoint(job, removed=job["removed"])
+            # Only drop the conversation once its messages are gone, so an
+            # interrupted job finds it again on resume
+            await db.conversations.delete_one({"id": conversation["id"]})
+            await self._announce([conversation["id"]])
+            job["removed"]["conversations"] += 1
+            await self._checkpoint(job, removed=job["removed"])
+
+    async def process(self, job: dict):
+        steps = {
+            "schedules": self._remove_schedules,
+            "conversations": self._remove_conversations,
+        }
+        for phase in PHASES[PHASES.index(job["phase"]):-1]:
+            if job["phase"] != phase:
+                await self._checkpoint(job, phase=phase)
+            await steps[phase](job)
+        await self._checkpoint(job, phase="done", status="completed", lease_until=None)
+
+    async def run_pending(self) -> int:
+        """Process jobs until none are claimable. Returns how many ran."""
+        processed = 0
+        while True:
+            job = await self._claim()
+            if job is None:
+                return processed
+            try:
+                await self.process(job)
+            except LeaseLost:
+                logger.warning("Cleanup job %s was taken over by another worker", job["id"])
+                continue
+            processed += 1
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.run_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cascade cleanup iteration failed")
+            try:
+                # Also wakes periodically to pick up jobs whose lease expired
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_poll)
+            except asyncio.TimeoutError:
+                pass
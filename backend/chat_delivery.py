@@ -0,0 +1,81 @@
+"""
+In-memory delivery state for chat rooms.
+
+``RoomHistory`` keeps a bounded ring buffer of the most recent messages
+broadcast in each room. A reconnecting client that was only briefly
+away can be caught up from memory, without touching Mongo.
+``DeliveryMarks`` remembers the last message each user acknowledged per
+room, so a client that lost its own state can still resume.
+
+Both structures are bounded: per-room buffers by ``per_room``, and the
+set of rooms or users by least-recently-used eviction. ``RoomHistory``
+only holds messages stored by this process, so with several workers a
+buffered run can have gaps; callers must check it against the database
+before trusting it. Marks only move forward in ``(created_at, id)``
+order, so a late or repeated ack never rewinds them.
+"""
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class RoomHistory:
+    def __init__(self, per_room: int = 200, max_rooms: int = 10000):
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self._rooms: "OrderedDict[str, deque]" = OrderedDict()
+
+    def append(self, room: str, message: dict):
+        buffer = self._rooms.get(room)
+        if buffer is None:
+            buffer = self._rooms[room] = deque(maxlen=self.per_room)
+            if len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+        else:
+            self._rooms.move_to_end(room)
+        buffer.append(message)
+
+    def find(self, room: str, message_id: str) -> Optional[dict]:
+        """The buffered message ``message_id``, if still held."""
+        for message in reversed(self._rooms.get(room, ())):
+            if message["id"] == message_id:
+                return message
+        return None
+
+    def since(self, room: str, message_id: str) -> Optional[List[dict]]:
+        """Messages after ``message_id``, or ``None`` if it is no longer buffered."""
+        buffer = self._rooms.get(room)
+        if not buffer:
+            return None
+        missed = []
+        for message in reversed(buffer):
+            if message["id"] == message_id:
+                missed.reverse()
+                return missed
+            missed.append(message)
+        return None
+
+
+class DeliveryMarks:
+    def __init__(self, max_users: int = 100000):
+        self.max_users = max_users
+        self._marks: "OrderedDict[str, Dict[str, Tuple[datetime, str]]]" = OrderedDict()
+
+    def advance(self, user_id: str, room: str, message_id: str, created_at: datetime) -> bool:
+        """Move the mark to ``message_id`` if it is newer; return whether it moved."""
+        marks = self._marks.get(user_id)
+        if marks is None:
+            marks = self._marks[user_id] = {}
+            if len(self._marks) > self.max_users:
+                self._marks.popitem(last=False)
+        else:
+            self._marks.move_to_end(user_id)
+        position = (created_at, message_id)
+        if room in marks and marks[room] >= position:
+            return False
+        marks[room] = position
+        return True
+
+    def get(self, user_id: str, room: str) -> Optional[str]:
+        mark = self._marks.get(user_id, {}).get(room)
+        return mark[1] if mark else None
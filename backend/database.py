@@ -0,0 +1,226 @@
+"""
+MongoDB client ownership for the backend.
+
+One ``Database`` per process owns the Motor client. The API server and
+the seed script share it through ``get_database()``. It carries the
+connection pool settings, the read routes and the pool metrics.
+
+Writes, and any read that must see them straight away, go through
+``Database.db``, which reads from the primary. Reads that tolerate a
+little lag use ``Database.reader(route)``: chat history and search can
+then be served by secondaries. Each route has its own read preference
+and read concern. Against a standalone server every route resolves to
+that server, so nothing changes locally.
+
+Settings come from the environment:
+
+- ``MONGO_MAX_POOL_SIZE`` / ``MONGO_MIN_POOL_SIZE`` (default 100 / 0)
+- ``MONGO_MAX_IDLE_MS`` (default 60000)
+- ``MONGO_WAIT_QUEUE_TIMEOUT_MS``: how long a request waits for a free
+  connection before failing (default 5000)
+- ``MONGO_SERVER_SELECTION_TIMEOUT_MS`` (default 5000)
+- ``MONGO_CONNECT_TIMEOUT_MS`` (default 5000)
+- ``MONGO_SOCKET_TIMEOUT_MS`` (default none)
+- ``MONGO_COMPRESSORS``: e.g. ``zstd,zlib`` (default off)
+- ``MONGO_READ_ROUTES``: ``route=preference:concern`` pairs separated by
+  commas, e.g. ``history=secondaryPreferred:majority,search=nearest:local``
+- ``MONGO_MAX_STALENESS``: seconds a secondary may lag before it is
+  skipped (default 90, the minimum the drivers accept)
+"""
+import os
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring, read_preferences
+from pymongo.read_concern import ReadConcern
+
+DEFAULT_READ_ROUTES = {
+    "history": ("secondaryPreferred", "majority"),
+    "search": ("secondaryPreferred", "local"),
+}
+
+READ_PREFERENCES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+
+def parse_read_routes(spec: str) -> Dict[str, Tuple[str, str]]:
+    routes = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, setting = entry.partition("=")
+        preference, _, concern = setting.partition(":")
+        if preference not in READ_PREFERENCES:
+            raise ValueError(f"Unknown read preference for route {route!r}: {preference!r}")
+        routes[route.strip()] = (preference, concern or "local")
+    return routes
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Counts connection pool activity per server.
+
+    pymongo calls listeners from its own threads, so counters are guarded
+    by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers = defaultdict(lambda: defaultdict(int))
+
+    def _count(self, event, **deltas):
+        with self._lock:
+            counters = self._servers[f"{event.address[0]}:{event.address[1]}"]
+            for name, delta in deltas.items():
+                counters[name] += delta
+
+    def pool_created(self, event):
+        self._count(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._count(event, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count(event, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._count(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._count(event, waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._count(event, waiting=-1, in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._count(event, in_use=-1)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {address: dict(counters) for address, counters in self._servers.items()}
+
+
+class Database:
+    def __init__(
+        self,
+        url: str,
+        name: str,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        max_idle_ms: int = 60000,
+        wait_queue_timeout_ms: int = 5000,
+        server_selection_timeout_ms: int = 5000,
+        connect_timeout_ms: int = 5000,
+        socket_timeout_ms: Optional[int] = None,
+        compressors: Optional[str] = None,
+        read_routes: Optional[Dict[str, Tuple[str, str]]] = None,
+        max_staleness: int = 90,
+    ):
+        self.url = url
+        self.name = name
+        self.max_pool_size = max_pool_size
+        self.read_routes = {**DEFAULT_READ_ROUTES, **(read_routes or {})}
+        self.max_staleness = max_staleness
+        self.monitor = PoolMonitor()
+        self._client_options = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "maxIdleTimeMS": max_idle_ms,
+            "waitQueueTimeoutMS": wait_queue_timeout_ms,
+            "serverSelectionTimeoutMS": server_selection_timeout_ms,
+            "connectTimeoutMS": connect_timeout_ms,
+            "socketTimeoutMS": socket_timeout_ms,
+            "event_listeners": [self.monitor],
+        }
+        if compressors:
+            self._client_options["compressors"] = compressors
+        self._client = None
+        self._databases = {}
+
+    @classmethod
+    def from_env(cls) -> "Database":
+        env = os.environ
+        socket_timeout = env.get("MONGO_SOCKET_TIMEOUT_MS")
+        return cls(
+            url=env["MONGO_URL"],
+            name=env["DB_NAME"],
+            max_pool_size=int(env.get("MONGO_MAX_POOL_SIZE", "100")),
+            min_pool_size=int(env.get("MONGO_MIN_POOL_SIZE", "0")),
+            max_idle_ms=int(env.get("MONGO_MAX_IDLE_MS", "60000")),
+            wait_queue_timeout_ms=int(env.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+            server_selection_timeout_ms=int(env.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+            connect_timeout_ms=int(env.get("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+            socket_timeout_ms=int(socket_timeout) if socket_timeout else None,
+            compressors=env.get("MONGO_COMPRESSORS") or None,
+            read_routes=parse_read_routes(env.get("MONGO_READ_ROUTES", "")),
+            max_staleness=int(env.get("MONGO_MAX_STALENESS", "90")),
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Motor is imported here so that importing this module stays cheap
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self._client = AsyncIOMotorClient(self.url, **self._client_options)
+        return self._client
+
+    def use_client(self, client):
+        """Replace the client, e.g. with an in-process fake in tests."""
+        self._client = client
+        self._databases.clear()
+
+    @property
+    def db(self):
+        """Primary database handle, for writes and read-your-writes reads."""
+        return self.reader("primary")
+
+    def reader(self, route: str):
+        """Database handle for reads on ``route``; unknown routes read the primary."""
+        handle = self._databases.get(route)
+        if handle is None:
+            if route in self.read_routes:
+                preference, concern = self.read_routes[route]
+                options = {} if preference == "primary" else {"max_staleness": self.max_staleness}
+                handle = self.client.get_database(
+                    self.name,
+                    read_preference=READ_PREFERENCES[preference](**options),
+                    read_concern=ReadConcern(concern),
+                )
+            else:
+                handle = self.client.get_database(self.name)
+            self._databases[route] = handle
+        return handle
+
+    def pool_stats(self) -> dict:
+        servers = self.monitor.snapshot()
+        for counters in servers.values():
+            counters["utilization"] = round(counters.get("in_use", 0) / self.max_pool_size, 3)
+        return {"max_pool_size": self.max_pool_size, "servers": servers}
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._databases.clear()
+
+
+@lru_cache(maxsize=None)
+def get_database() -> Database:
+    """The process-wide ``Database``, configured from the environment on first use."""
+    return Database.from_env()
@@ -0,0 +1,298 @@
+"""
+Per-worker caches and the bus that keeps them coherent across workers.
+
+Each worker holds small ``LocalCache`` instances, for example users by id
+or conversation members. Cached entries are bounded by size and by a TTL,
+so a missed invalidation can only serve stale data until the entry
+expires. Invalidations normally arrive much sooner, over the bus: every
+worker subscribes its caches to entity names, and each change event
+evicts the matching key (or, for a ``None`` key, the whole cache).
+
+Events reach the bus through a transport:
+
+- ``MongoTransport`` follows a change stream on the watched collections,
+  so any write evicts, whichever worker or script made it. Change streams
+  need a replica set. On a standalone server ``auto`` mode falls back to
+  an outbox: ``publish`` appends to ``invalidation_outbox`` (within the
+  caller's transaction when given a ``session``) and every worker polls
+  it.
+- ``LocalTransport`` connects buses in one process, standing in for
+  several workers in tests.
+
+A worker applies its own ``publish`` calls at once, without waiting for
+the round trip. The bus records how long events took to arrive.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Collection -> field of the cached key; the entity name is the collection
+WATCHED = {"users": "id", "profiles": "user_id", "conversations": "id"}
+
+_MISSING = object()
+
+
+class LocalCache:
+    """A size-bounded LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING or entry[1] <= self._clock():
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.counters["misses"] += 1
+            return default
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value):
+        self._entries[key] = (value, self._clock() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def evict(self, key: Optional[Hashable] = None):
+        """Drop ``key``, or every entry when ``key`` is ``None``."""
+        if key is None:
+            self.counters["evictions"] += len(self._entries)
+            self._entries.clear()
+        elif self._entries.pop(key, _MISSING) is not _MISSING:
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "ttl": self.ttl, **self.counters}
+
+
+class InvalidationBus:
+    def __init__(self, transport, lag_window: int = 1000):
+        self.transport = transport
+        self.origin = uuid.uuid4().hex
+        self._subscribers: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+        self._lags: deque = deque(maxlen=lag_window)
+        self.counters = {"published": 0, "received": 0}
+
+    def subscribe(self, entity: str, evict: Callable[[Optional[str]], None]):
+        """Call ``evict(key)`` for each change to ``entity``; ``None`` means all keys."""
+        self._subscribers.setdefault(entity, []).append(evict)
+
+    async def publish(self, entity: str, keys: Iterable[str], session=None):
+        """Announce that ``keys`` of ``entity`` changed, evicting locally at once."""
+        keys = list(keys)
+        if not keys:
+            return
+        self.counters["published"] += 1
+        for key in keys:
+            self._evict(entity, key)
+        await self.transport.publish(self, entity, keys, session)
+
+    def deliver(self, entity: str, key: Optional[str], published_at: Optional[datetime] = None):
+        """Apply an event from the transport."""
+        self.counters["received"] += 1
+        if published_at is not None:
+            self._lags.append(max(0.0, (datetime.utcnow() - published_at).total_seconds()))
+        self._evict(entity, key)
+
+    def _evict(self, entity: str, key: Optional[str]):
+        for evict in self._subscribers.get(entity, ()):
+            evict(key)
+
+    def start(self):
+        self.transport.start(self)
+
+    async def stop(self):
+        await self.transport.stop()
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        lag_ms = {}
+        if lags:
+            lag_ms = {
+                "last": round(self._lags[-1] * 1000, 1),
+                "mean": round(sum(lags) / len(lags) * 1000, 1),
+                "p99": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 1),
+                "max": round(lags[-1] * 1000, 1),
+            }
+        return {"transport": self.transport.name, **self.counters, "lag_ms": lag_ms}
+
+
+class LocalTransport:
+    """Delivers to every other bus sharing ``hub`` (a plain list) on the next loop turn."""
+
+    name = "local"
+
+    def __init__(self, hub: list):
+        self.hub = hub
+
+    def start(self, bus: InvalidationBus):
+        self.hub.append(bus)
+
+    async def stop(self):
+        pass
+
+    async def publish(self, sender: InvalidationBus, entity: str, keys: List[str], session=None):
+        published_at = datetime.utcnow()
+        loop = asyncio.get_running_loop()
+        for bus in self.hub:
+            if bus is not sender:
+                for key in keys:
+                    loop.call_soon(bus.deliver, entity, key, published_at)
+
+
+class MongoTransport:
+    """Change streams where available, otherwise a polled outbox collection.
+
+    ``mode`` is ``auto``, ``change_stream`` or ``outbox``.
+    """
+
+    def __init__(
+        self,
+        get_db: Callable[[], object],
+        mode: str = "auto",
+        poll_interval: float = 0.5,
+        clock_skew: timedelta = timedelta(seconds=5),
+        retry_delay: float = 1.0,
+    ):
+        if mode not in ("auto", "change_stream", "outbox"):
+            raise ValueError(f"Unknown invalidation mode: {mode!r}")
+        self._get_db = get_db
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.clock_skew = clock_skew
+        self.retry_delay = retry_delay
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def name(self) -> str:
+        return self.mode
+
+    def start(self, bus: InvalidationBus):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bus))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, sender: InvalidationBus, entity: str, keys: List[str], session=None):
+        # Change streams see the write itself; until the mode is settled,
+        # the TTL bounds what other workers miss
+        if self.mode != "outbox":
+            return
+        try:
+            await self._get_db().invalidation_outbox.insert_one(
+                {"entity": entity, "keys": keys, "origin": sender.origin, "created_at": datetime.utcnow()},
+                session=session,
+            )
+        except PyMongoError:
+            logger.exception("Could not publish %s invalidation", entity)
+
+    async def _run(self, bus: InvalidationBus):
+        if self.mode != "outbox":
+            try:
+                await self._follow_change_stream(bus)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                # Only raised in auto mode while the stream has never opened
+                if self.mode != "auto":
+                    raise
+                logger.info("Change streams unavailable (%s); using the invalidation outbox", exc)
+                self.mode = "outbox"
+        await self._poll_outbox(bus)
+
+    async def _follow_change_stream(self, bus: InvalidationBus):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(WATCHED)},
+            "operationType": {"$in": ["update", "replace", "delete"]},
+        }}]
+        resume_token = None
+        while True:
+            try:
+                async with self._get_db().watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    if self.mode == "auto":
+                        self.mode = "change_stream"
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        collection = change["ns"]["coll"]
+                        document = change.get("fullDocument")
+                        # Deletes carry no document, so evict the whole entity
+                        key = document.get(WATCHED[collection]) if document else None
+                        bus.deliver(collection, key, change_time(change))
+            except OperationFailure as exc:
+                if self.mode == "auto":
+                    raise
+                if exc.code not in (260, 280, 286):
+                    logger.exception("Invalidation change stream failed; resuming")
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+                # The resume point fell off the oplog; events in between are
+                # unknown, so start over with empty caches
+                logger.warning("Invalidation change stream lost its place: %s", exc)
+                for entity in WATCHED:
+                    bus.deliver(entity, None)
+                resume_token = None
+            except PyMongoError:
+                logger.exception("Invalidation change stream failed; resuming")
+                await asyncio.sleep(self.retry_delay)
+
+    async def _poll_outbox(self, bus: InvalidationBus):
+        outbox = self._get_db().invalidation_outbox
+        since = datetime.utcnow()
+        # Writers' clocks differ slightly, so each poll re-reads a window
+        # of recent events and skips the ones already applied
+        seen: Dict[object, datetime] = {}
+        while True:
+            try:
+                events = await outbox.find(
+                    {"created_at": {"$gte": since - self.clock_skew}}
+                ).sort("created_at", 1).to_list(None)
+                for event in events:
+                    if event["_id"] in seen:
+                        continue
+                    seen[event["_id"]] = event["created_at"]
+                    since = max(since, event["created_at"])
+                    if event["origin"] == bus.origin:
+                        continue
+                    for key in event["keys"]:
+                        bus.deliver(event["entity"], key, event["created_at"])
+                horizon = since - self.clock_skew
+                for event_id in [event_id for event_id, at in seen.items() if at < horizon]:
+                    del seen[event_id]
+            except PyMongoError:
+                logger.exception("Invalidation outbox poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+
+def change_time(change: dict) -> Optional[datetime]:
+    """When the change was committed: ``wallTime`` where the server sends it."""
+    if change.get("wallTime") is not None:
+        return change["wallTime"].replace(tzinfo=None)
+    if change.get("clusterTime") is not None:
+        return datetime.utcfromtimestamp(change["clusterTime"].time)
+    return None
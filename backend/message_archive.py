@@ -0,0 +1,258 @@
+"""
+Tiered storage for chat history.
+
+Messages older than a configurable age are moved out of the hot
+``messages`` collection into ``message_archive``, so the live collection
+and its indexes only cover recent traffic. Each archive document is a
+segment: gzip-compressed JSON lines holding a run of consecutive messages
+from one conversation, plus the time range they cover. The archive index
+therefore grows by one entry per segment, not one per message.
+
+Archival walks old messages in ``ARCHIVE_ORDER``, which the
+``(conversation_id, created_at, id)`` index serves, resuming each batch
+after the last message of the previous one. Every worker runs the
+archiver, so a run first takes the ``message_archive`` lease in
+``leases``; while another worker holds it, the run does nothing. The
+lease is renewed before each batch is written, only by its owner, so a
+run whose lease expired stops instead of racing the worker that took
+over. Archival is idempotent per message: messages already held by an
+overlapping segment, left behind by a run that died before deleting
+them, are deleted without being archived again.
+
+Reads page backwards through time. ``read_before`` continues where the
+hot collection runs out, so callers see one continuous history.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Callable, List, Optional, Set, Tuple
+
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ORDER = [("conversation_id", 1), ("created_at", 1), ("id", 1)]
+LEASE_ID = "message_archive"
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot archive value of type {type(value).__name__}")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def pack_segment(messages: List[dict]) -> bytes:
+    lines = "\n".join(json.dumps(message, default=_encode) for message in messages)
+    return gzip.compress(lines.encode(), compresslevel=6)
+
+
+def unpack_segment(data: bytes) -> List[dict]:
+    text = gzip.decompress(data).decode()
+    return [json.loads(line, object_hook=_decode) for line in text.splitlines() if line]
+
+
+class MessageArchiver:
+    def __init__(
+        self,
+        get_db: Callable[[], object],
+        get_read_db: Optional[Callable[[], object]] = None,
+        max_age: timedelta = timedelta(days=90),
+        segment_size: int = 500,
+        batch_pause: float = 0.05,
+        interval: float = 3600.0,
+        lease: timedelta = timedelta(minutes=5),
+    ):
+        self._get_db = get_db
+        # Archived segments never change, so reads may use a secondary
+        self._get_read_db = get_read_db or get_db
+        self.max_age = max_age
+        self.segment_size = segment_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def archive_once(self, now: Optional[datetime] = None) -> int:
+        """Move every message older than ``max_age`` into segments.
+
+        Returns the number of messages archived, 0 when another worker
+        holds the lease.
+        """
+        db = self._get_db()
+        owner = await self._claim(db)
+        if owner is None:
+            return 0
+        try:
+            return await self._archive(db, owner, (now or datetime.utcnow()) - self.max_age)
+        finally:
+            await db.leases.update_one({"id": LEASE_ID, "owner": owner}, {"$set": {"lease_until": None}})
+
+    async def _claim(self, db) -> Optional[str]:
+        owner = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            await db.leases.update_one(
+                {"id": LEASE_ID, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": owner, "lease_until": now + self.lease}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held, so the upsert tried a second one
+            return None
+        return owner
+
+    async def _renew(self, db, owner: str) -> bool:
+        result = await db.leases.update_one(
+            {"id": LEASE_ID, "owner": owner},
+            {"$set": {"lease_until": datetime.utcnow() + self.lease}},
+        )
+        return result.matched_count == 1
+
+    async def _archive(self, db, owner: str, cutoff: datetime) -> int:
+        archived = 0
+        resume = None
+        while True:
+            query = {"created_at": {"$lt": cutoff}}
+            if resume is not None:
+                conversation_id, created_at, message_id = resume
+                query = {"$and": [query, {"$or": [
+                    {"conversation_id": {"$gt": conversation_id}},
+                    {"conversation_id": conversation_id, "created_at": {"$gt": created_at}},
+                    {"conversation_id": conversation_id, "created_at": created_at, "id": {"$gt": message_id}},
+                ]}]}
+            batch = await db.messages.find(query, {"_id": 0}).sort(ARCHIVE_ORDER).limit(
+                self.segment_size
+            ).to_list(self.segment_size)
+            if not batch:
+                return archived
+            if not await self._renew(db, owner):
+                logger.warning("Message archival lease lost after %d messages", archived)
+                return archived
+            last = batch[-1]
+            resume = (last["conversation_id"], last["created_at"], last["id"])
+
+            groups = [
+                (conversation_id, list(group))
+                for conversation_id, group in groupby(batch, key=lambda m: m["conversation_id"])
+            ]
+            already_archived = await self._archived_ids(db, groups)
+            for conversation_id, messages in groups:
+                messages = [message for message in messages if message["id"] not in already_archived]
+                if not messages:
+                    continue
+                ids = [message["id"] for message in messages]
+                segment = {
+                    # Derived from the contents, so re-inserting the same
+                    # segment after a crash is a no-op
+                    "id": hashlib.sha256("\n".join(ids).encode()).hexdigest(),
+                    "conversation_id": conversation_id,
+                    "first_created_at": messages[0]["created_at"],
+                    "last_created_at": messages[-1]["created_at"],
+                    "count": len(messages),
+                    "data": Binary(pack_segment(messages)),
+                }
+                try:
+                    await db.message_archive.insert_one(segment)
+                except DuplicateKeyError:
+                    pass
+            await db.messages.delete_many({"id": {"$in": [m["id"] for m in batch]}})
+            archived += len(batch)
+            await asyncio.sleep(self.batch_pause)
+
+    async def _archived_ids(self, db, groups: List[Tuple[str, List[dict]]]) -> Set[str]:
+        """Ids in ``groups`` that an existing segment already holds.
+
+        Only segments overlapping a group's time range can hold its
+        messages. Outside of crash recovery that is at most a neighbour
+        sharing a boundary timestamp.
+        """
+        overlapping = db.message_archive.find(
+            {"$or": [
+                {
+                    "conversation_id": conversation_id,
+                    "last_created_at": {"$gte": messages[0]["created_at"]},
+                    "first_created_at": {"$lte": messages[-1]["created_at"]},
+                }
+                for conversation_id, messages in groups
+            ]},
+            {"_id": 0, "data": 1},
+        )
+        ids = set()
+        async for segment in overlapping:
+            ids.update(message["id"] for message in unpack_segment(segment["data"]))
+        return ids
+
+    async def read_before(
+        self,
+        conversation_id: str,
+        before: Optional[Tuple[datetime, str]],
+        limit: int,
+    ) -> List[dict]:
+        """Up to ``limit`` archived messages older than ``before``, newest first."""
+        if limit <= 0:
+            return []
+        query = {"conversation_id": conversation_id}
+        if before is not None:
+            query["first_created_at"] = {"$lte": before[0]}
+        cursor = self._get_read_db().message_archive.find(query, {"_id": 0, "data": 1}).sort(
+            "last_created_at", -1
+        )
+        collected = []
+        async for segment in cursor:
+            for message in unpack_segment(segment["data"]):
+                if before is None or (message["created_at"], message["id"]) < before:
+                    collected.append(message)
+            if len(collected) >= limit:
+                break
+        collected.sort(key=lambda m: (m["created_at"], m["id"]), reverse=True)
+        return collected[:limit]
+
+    async def iter_after(self, conversation_id: str, after: Optional[Tuple[datetime, str]]):
+        """Yield archived messages newer than ``after``, oldest first."""
+        query = {"conversation_id": conversation_id}
+        if after is not None:
+            query["last_created_at"] = {"$gte": after[0]}
+        cursor = self._get_read_db().message_archive.find(query, {"_id": 0, "data": 1}).sort(
+            "first_created_at", 1
+        )
+        async for segment in cursor:
+            for message in unpack_segment(segment["data"]):
+                if after is None or (message["created_at"], message["id"]) > after:
+                    yield message
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await self.archive_once()
+                if archived:
+                    logger.info("Archived %d messages", archived)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Message archival failed")
+            await asyncio.sleep(self.interval)
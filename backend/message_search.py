@@ -0,0 +1,147 @@
+"""
+Full-text search over a user's chat history.
+
+Messages carry a compound text index on ``(conversation_id, content)``.
+Because ``conversation_id`` is the equality prefix, each query reads only
+the postings of one conversation. A search therefore runs one indexed
+query for each conversation the caller belongs to, and never touches
+anyone else's messages. The queries run at most ``max_parallel`` at a
+time. Each returns at most one page, already in ranking order, and the
+pages are merged through a heap.
+
+Results are ranked by Mongo's text score, then newest first. The score
+depends only on the message itself, not on the rest of the corpus, so
+scores from different conversations compare directly. Pages continue
+from an opaque cursor over ``(score, created_at, id)``.
+
+Only the hot ``messages`` collection is indexed. Messages already moved
+to the archive are not searchable.
+"""
+import asyncio
+import base64
+import heapq
+import json
+import re
+from datetime import datetime
+from itertools import islice
+from typing import Callable, List, Optional, Tuple
+
+WORD = re.compile(r"\w+", re.UNICODE)
+SUFFIXES = ("ingly", "edly", "ing", "ies", "es", "ed", "ly", "s")
+
+Position = Tuple[float, datetime, str]
+
+
+def stem(word: str) -> str:
+    """Crude suffix stripping, close enough to Mongo's stemmer to highlight matches."""
+    word = word.lower()
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def query_stems(query: str) -> set:
+    # Words excluded with a leading "-" are never highlighted
+    kept = " ".join(part for part in query.split() if not part.startswith("-"))
+    return {stem(word) for word in WORD.findall(kept)}
+
+
+def snippet(content: str, stems: set, width: int = 120) -> Tuple[str, List[List[int]]]:
+    """A window of ``content`` around the first match, with match offsets in it."""
+    matches = [m.span() for m in WORD.finditer(content) if stem(m.group()) in stems]
+    start = 0
+    if matches and len(content) > width:
+        start = max(0, min(matches[0][0] - width // 4, len(content) - width))
+    end = min(len(content), start + width)
+    text = content[start:end]
+    highlights = [[s - start, e - start] for s, e in matches if s >= start and e <= end]
+    if start > 0:
+        text = "…" + text
+        highlights = [[s + 1, e + 1] for s, e in highlights]
+    if end < len(content):
+        text += "…"
+    return text, highlights
+
+
+def encode_position(position: Position) -> str:
+    score, created_at, message_id = position
+    raw = json.dumps([score, created_at.isoformat(), message_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_position(cursor: str) -> Position:
+    """Raises ``ValueError`` for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        score, created_at, message_id = json.loads(raw)
+        return float(score), datetime.fromisoformat(created_at), str(message_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def ranking(hit: dict) -> Position:
+    return hit["score"], hit["created_at"], hit["id"]
+
+
+def search_pipeline(
+    conversation_id: str, query: str, after: Optional[Position], limit: int
+) -> List[dict]:
+    """Aggregation for the best ``limit`` matches in one conversation after ``after``."""
+    pipeline = [
+        {"$match": {"conversation_id": conversation_id, "$text": {"$search": query}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after is not None:
+        score, created_at, message_id = after
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "created_at": {"$lt": created_at}},
+            {"score": score, "created_at": created_at, "id": {"$lt": message_id}},
+        ]}})
+    pipeline += [
+        {"$sort": {"score": -1, "created_at": -1, "id": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0}},
+    ]
+    return pipeline
+
+
+class MessageSearch:
+    def __init__(self, get_db: Callable[[], object], max_parallel: int = 8):
+        self._get_db = get_db
+        self.max_parallel = max_parallel
+
+    async def search(
+        self,
+        conversation_ids: List[str],
+        query: str,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Best matches in ``conversation_ids`` after ``cursor``, and the next cursor.
+
+        Each hit is the message document with ``score``, ``snippet`` and
+        ``highlights`` (``[start, end]`` offsets into the snippet) added.
+        """
+        after = decode_position(cursor) if cursor else None
+        gate = asyncio.Semaphore(self.max_parallel)
+
+        async def one(conversation_id):
+            async with gate:
+                pipeline = search_pipeline(conversation_id, query, after, limit + 1)
+                return await self._get_db().messages.aggregate(pipeline).to_list(limit + 1)
+
+        pages = await asyncio.gather(*(one(conversation_id) for conversation_id in conversation_ids))
+        hits = list(islice(heapq.merge(*pages, key=ranking, reverse=True), limit + 1))
+
+        next_cursor = None
+        if len(hits) > limit:
+            hits = hits[:limit]
+            last = hits[-1]
+            next_cursor = encode_position(ranking(last))
+
+        stems = query_stems(query)
+        for hit in hits:
+            hit["snippet"], hit["highlights"] = snippet(hit["content"], stems)
+        return hits, next_cursor
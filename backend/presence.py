@@ -0,0 +1,138 @@
+"""
+In-memory presence tracking for socket-connected users.
+
+A user is online while at least one of their sockets has sent a heartbeat
+within ``ttl`` seconds. Sockets are kept in heartbeat order, so expiry
+only looks at the stale front of the queue, however many clients are
+connected.
+
+Changes are not broadcast as they happen. They accumulate and are sent
+every ``flush_interval`` seconds as a single ``presence`` event, emitted
+once to the union of the ``presence:<user_id>`` rooms of everyone who
+changed. A user who drops and comes back within one window produces no
+event at all. Every recipient gets the whole batch, so clients ignore
+entries for users they do not watch; presence is no more private than
+the ``GET /presence`` endpoint already makes it.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def presence_room(user_id: str) -> str:
+    return f"presence:{user_id}"
+
+
+class PresenceTracker:
+    def __init__(
+        self,
+        emit: Callable[[str, dict, List[str]], Awaitable[None]],
+        ttl: float = 90.0,
+        flush_interval: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._emit = emit
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._sids: Dict[str, Set[str]] = {}
+        self._owners: Dict[str, str] = {}
+        # sid -> last heartbeat, oldest first
+        self._beats: "OrderedDict[str, float]" = OrderedDict()
+        # user -> whether they were online when the window opened
+        self._pending: Dict[str, bool] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id in self._sids
+
+    def snapshot(self, user_ids: Iterable[str]) -> Dict[str, bool]:
+        return {user_id: user_id in self._sids for user_id in user_ids}
+
+    def _mark(self, user_id: str):
+        self._pending.setdefault(user_id, self.is_online(user_id))
+
+    def connect(self, sid: str, user_id: str):
+        self._mark(user_id)
+        self._sids.setdefault(user_id, set()).add(sid)
+        self._owners[sid] = user_id
+        self._beats[sid] = self._clock()
+
+    def heartbeat(self, sid: str, user_id: Optional[str] = None):
+        """Refresh ``sid``; with ``user_id``, bring it back if it had expired.
+
+        A socket that missed heartbeats for a while is expired but may still
+        be connected, and its next heartbeat makes its user online again.
+        """
+        if sid in self._beats:
+            self._beats[sid] = self._clock()
+            self._beats.move_to_end(sid)
+        elif user_id is not None:
+            self.connect(sid, user_id)
+
+    def disconnect(self, sid: str):
+        user_id = self._owners.pop(sid, None)
+        self._beats.pop(sid, None)
+        if user_id is None:
+            return
+        self._mark(user_id)
+        sids = self._sids.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids[user_id]
+
+    def expire(self):
+        deadline = self._clock() - self.ttl
+        while self._beats:
+            sid, beat = next(iter(self._beats.items()))
+            if beat >= deadline:
+                break
+            self.disconnect(sid)
+
+    def drain_changes(self) -> Dict[str, bool]:
+        """Net presence changes since the last drain."""
+        changes = {
+            user_id: self.is_online(user_id)
+            for user_id, was_online in self._pending.items()
+            if self.is_online(user_id) != was_online
+        }
+        self._pending.clear()
+        return changes
+
+    async def flush(self) -> int:
+        """Expire stale sockets and broadcast the coalesced changes."""
+        self.expire()
+        changes = self.drain_changes()
+        if changes:
+            await self._emit(
+                "presence", {"users": changes}, [presence_room(user_id) for user_id in changes]
+            )
+        return len(changes)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Presence flush failed")
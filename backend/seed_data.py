@@ -3,22 +3,20 @@
 Seed data script to create 15 dummy mentors for testing
 """
 import asyncio
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 import uuid
 from datetime import datetime
 from passlib.context import CryptContext
+from database import get_database
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection; the same pooled client as the API server when run from it
+database = get_database()
+db = database.db
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -271,7 +269,7 @@ async def main():
     except Exception as e:
         print(f"❌ Error seeding database: {e}")
     finally:
-        client.close()
+        database.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,32 +1,84 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, Header, Query, UploadFile, File
+from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field, EmailStr
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from pydantic import BaseModel, Field, EmailStr, field_validator
 from typing import List, Optional, Dict
-from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from datetime import datetime, timedelta, timezone
 import os
 import logging
 import uuid
+import hashlib
+import base64
+import json
+import zlib
+import time
 from pathlib import Path
 import socketio
-from fuzzywuzzy import fuzz
 import asyncio
+import bisect
+from session_scheduler import SessionScheduler
+from cascade_cleanup import CascadeCleanup
+from message_archive import MessageArchiver
+from chat_delivery import RoomHistory, DeliveryMarks
+from presence import PresenceTracker, presence_room
+from socket_throttle import EventThrottle, EphemeralCoalescer
+from wire_format import packet_class
+from database import get_database
+from admission import AdmissionController, AdmissionMiddleware
+from message_search import MessageSearch
+from attachments import AttachmentService, OffsetMismatch, blob_store_from_env
+from invalidation import InvalidationBus, LocalCache, MongoTransport
+from analytics import Rollups, METRICS as ANALYTICS_METRICS
+from avatars import AvatarPipeline, InvalidImage, VARIANTS, DIGEST, avatar_url, avatar_variant
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection, shared with seed_data.py; see database.py for settings.
+# The client is opened by start_up(), not at import
+database = get_database()
+db = None
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def reader(route: str):
+    """Database handle for lag-tolerant reads, which may go to a secondary."""
+    return database.reader(route)
+
+# Per-worker caches of hot reads. The invalidation bus evicts entries when
+# any worker changes them, and the TTL bounds staleness if an event is lost
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "30"))
+invalidation = InvalidationBus(
+    MongoTransport(get_db=lambda: db, mode=os.environ.get("INVALIDATION_MODE", "auto"))
+)
+# Emails never change, so this only has to forget deleted accounts eventually
+user_ids_by_email = LocalCache(ttl=3600)
+users_cache = LocalCache(ttl=CACHE_TTL)
+conversation_members_cache = LocalCache(ttl=CACHE_TTL)
+mentor_search_cache = LocalCache(max_entries=1000, ttl=CACHE_TTL)
+local_caches = {
+    "user_ids_by_email": user_ids_by_email,
+    "users": users_cache,
+    "conversation_members": conversation_members_cache,
+    "mentor_search": mentor_search_cache,
+}
+invalidation.subscribe("users", users_cache.evict)
+invalidation.subscribe("users", lambda user_id: mentor_search_cache.evict())
+invalidation.subscribe("profiles", lambda user_id: mentor_search_cache.evict())
+invalidation.subscribe("conversations", conversation_members_cache.evict)
+
+# Password hashing. passlib, jose and fuzzywuzzy are imported on first use
+# to keep imports fast; warm_up() loads them before the worker reports ready
+@lru_cache(maxsize=None)
+def password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # JWT settings
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-production')
@@ -39,15 +91,27 @@ security = HTTPBearer()
 # Create Socket.IO server
 sio = socketio.AsyncServer(
     cors_allowed_origins="*",
-    async_mode='asgi'
+    async_mode='asgi',
+    serializer=packet_class(os.environ.get("SOCKET_SERIALIZER", "json"))
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_up()
+    yield
+    await shut_down()
+
 # Create FastAPI app
-app = FastAPI(title="Testnet API", version="1.0.0")
+app = FastAPI(title="Testnet API", version="1.0.0", lifespan=lifespan)
 
 # Create API router
 api_router = APIRouter(prefix="/api")
 
+# Per-route concurrency limits and load shedding; see admission.py. Added
+# before CORS so that shed responses still carry CORS headers
+admission = AdmissionController.from_env()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -61,6 +125,16 @@ app.add_middleware(
 # MODELS
 # ================================
 
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """``value`` as a naive UTC datetime, the form stored in and read from Mongo.
+
+    Clients may send offsets ("...Z", "+02:00"); comparing those with
+    stored datetimes would raise ``TypeError``.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
 class UserRole(str):
     SEEKER = "seeker"
     MENTOR = "mentor"
@@ -106,22 +180,64 @@ class ProfileCreate(BaseModel):
     available: bool = True
     avatar_url: str = ""
 
+class AvatarJob(BaseModel):
+    id: str
+    status: str  # pending, running, completed, failed or superseded
+    error: Optional[str] = None
+    # Variant name to URL, once the thumbnails are rendered
+    thumbnails: Dict[str, str] = {}
+
 class Conversation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     members: List[str]  # user IDs
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class Attachment(BaseModel):
+    id: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
 class Message(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     conversation_id: str
     sender_id: str
     content: str
+    attachments: List[Attachment] = []
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+MAX_MESSAGE_ATTACHMENTS = 10
+
 class MessageCreate(BaseModel):
     conversation_id: str
     content: str
+    # Ready attachments uploaded by the sender to this conversation
+    attachment_ids: List[str] = Field([], max_length=MAX_MESSAGE_ATTACHMENTS)
+
+class UploadCreate(BaseModel):
+    conversation_id: str
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = "application/octet-stream"
+    size: int = Field(..., gt=0)
+
+class Upload(BaseModel):
+    id: str
+    conversation_id: str
+    filename: str
+    content_type: str
+    size: int
+    received: int
+    status: str
+    sha256: Optional[str] = None
+
+class MessageSearchHit(BaseModel):
+    message: Message
+    score: float
+    snippet: str
+    # [start, end) offsets of matched words within the snippet
+    highlights: List[List[int]]
 
 class Schedule(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -129,7 +245,7 @@ class Schedule(BaseModel):
     seeker_id: str
     start_time: datetime
     end_time: datetime
-    status: str = "scheduled"  # scheduled, completed, cancelled
+    status: str = "scheduled"  # scheduled, confirmed, in_progress, completed, no_show, cancelled
     title: str = ""
     description: str = ""
     meeting_link: str = ""
@@ -143,12 +259,84 @@ class ScheduleCreate(BaseModel):
     title: str = ""
     description: str = ""
 
+    @field_validator("start_time", "end_time")
+    @classmethod
+    def utc_times(cls, value: datetime) -> datetime:
+        return naive_utc(value)
+
+class Recurrence(BaseModel):
+    frequency: str = "weekly"  # weekly, biweekly
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+
+    @field_validator("until")
+    @classmethod
+    def utc_until(cls, value: Optional[datetime]) -> Optional[datetime]:
+        return naive_utc(value)
+
+class RecurringScheduleCreate(ScheduleCreate):
+    recurrence: Recurrence
+
+class BulkScheduleCreate(BaseModel):
+    sessions: List[ScheduleCreate]
+
+class BookingOutcome(BaseModel):
+    mentor_id: str
+    start_time: datetime
+    end_time: datetime
+    booked: bool
+    schedule: Optional[Schedule] = None
+    conflict_with: Optional[str] = None
+    detail: str = ""
+
+class BookingResult(BaseModel):
+    booked: int
+    conflicts: int
+    results: List[BookingOutcome]
+
 class ScheduleUpdate(BaseModel):
     status: str
     title: Optional[str] = None
     description: Optional[str] = None
     meeting_link: Optional[str] = None
 
+class AnalyticsPoint(BaseModel):
+    bucket: datetime
+    key: str
+    count: int
+
+class AnalyticsReport(BaseModel):
+    metric: str
+    granularity: str
+    start: datetime
+    end: datetime
+    series: List[AnalyticsPoint]
+    # Sum over the whole range per key, e.g. bookings per mentor
+    totals: Dict[str, int]
+
+class MentorEntry(BaseModel):
+    user: User
+    profile: Optional[Profile] = None
+
+class MentorQueuePage(BaseModel):
+    items: List[MentorEntry]
+    next_cursor: Optional[str] = None
+    total: int
+    pending: int
+
+class BulkModeration(BaseModel):
+    action: str  # verify, reject, delete
+    ids: List[str]
+
+class ModerationOutcome(BaseModel):
+    id: str
+    status: str  # verified, rejected, deleted, not_found
+
+class ModerationResult(BaseModel):
+    action: str
+    processed: int
+    results: List[ModerationOutcome]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -161,10 +349,10 @@ class TokenData(BaseModel):
 # ================================
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -173,6 +361,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -182,41 +371,164 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    user = await db.users.find_one({"email": token_data.username})
+    user = await user_from_token(credentials.credentials)
     if user is None:
         raise credentials_exception
     return User(**user)
 
+async def user_from_token(token: str) -> Optional[dict]:
+    """Resolve a bearer token to its user document, or ``None`` if invalid."""
+    from jose import JWTError, jwt
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    email = payload.get("sub")
+    if email is None:
+        return None
+    user_id = user_ids_by_email.get(email)
+    user = users_cache.get(user_id) if user_id else None
+    if user is None:
+        user = await db.users.find_one({"email": email})
+        if user is not None:
+            user_ids_by_email.set(email, user["id"])
+            users_cache.set(user["id"], user)
+    return user
+
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+# ================================
+# ATOMIC WRITE HELPERS
+# ================================
+
+async def find_and_update(collection, query: dict, update: dict, **kwargs):
+    """Apply ``update`` to the document matching ``query`` in one round trip.
+
+    Authorization belongs in ``query`` so that the check and the write are a
+    single atomic operation. Returns the updated document, or ``None`` when
+    nothing matched.
+    """
+    return await collection.find_one_and_update(
+        query, update, return_document=ReturnDocument.AFTER, **kwargs
+    )
+
+async def find_and_delete(collection, query: dict, **kwargs):
+    """Delete the document matching ``query`` and return it, or ``None``."""
+    return await collection.find_one_and_delete(query, **kwargs)
+
+def schedule_participant_filter(schedule_id: str, user_id: str) -> dict:
+    return {
+        "id": schedule_id,
+        "$or": [{"mentor_id": user_id}, {"seeker_id": user_id}]
+    }
+
+async def raise_schedule_miss(schedule_id: str, user_id: str, precondition: bool = False):
+    """Explain why a participant-filtered schedule write matched nothing."""
+    schedule = await db.schedules.find_one(
+        {"id": schedule_id}, {"_id": 0, "mentor_id": 1, "seeker_id": 1}
+    )
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    if user_id not in (schedule["mentor_id"], schedule["seeker_id"]):
+        raise HTTPException(status_code=403, detail="Access denied")
+    if precondition:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Precondition failed")
+    raise HTTPException(status_code=404, detail="Schedule not found")
+
+# ================================
+# CONDITIONAL REQUESTS
+# ================================
+
+def document_etag(doc: dict) -> str:
+    """Strong ETag for a single document, derived from its version counter."""
+    return f'"{doc["id"]}.{doc.get("version", 0)}"'
+
+def collection_etag(docs: List[dict]) -> str:
+    """Strong ETag for a list response, derived from each member's version."""
+    digest = hashlib.blake2b(digest_size=16)
+    for doc in docs:
+        stamp = doc.get("updated_at") or doc.get("created_at") or ""
+        digest.update(f'{doc["id"]}.{doc.get("version", 0)}.{stamp}\n'.encode())
+    return f'"{digest.hexdigest()}"'
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+def if_match_filter(if_match: Optional[str], doc_id: Optional[str] = None) -> dict:
+    """Translate an ``If-Match`` header into an id and version filter for the write.
+
+    Returns an empty filter when the header is absent or ``*``. A tag that
+    cannot belong to the target document fails the precondition outright.
+    Without ``doc_id`` the filter still pins the id named in the tag, so a
+    tag taken from another document never matches.
+    """
+    if not if_match or if_match.strip() == "*":
+        return {}
+    for tag in if_match.split(","):
+        tag = tag.strip().strip('"')
+        tag_id, _, version = tag.rpartition(".")
+        if version.isdigit() and tag_id and (doc_id is None or tag_id == doc_id):
+            version = int(version)
+            # Documents written before version counters existed are version 0
+            return {"id": tag_id, "version": {"$in": [0, None]} if version == 0 else version}
+    raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Precondition failed")
+
+# ================================
+# CURSOR PAGINATION
+# ================================
+
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(value: datetime, doc_id: str) -> str:
+    """Opaque token for the position just after ``(value, doc_id)``."""
+    raw = f"{value.isoformat()}|{doc_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        value, doc_id = raw.split("|", 1)
+        return datetime.fromisoformat(value), doc_id
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_cursor(field: str, cursor: Optional[str], descending: bool = False) -> dict:
+    """Filter selecting documents after ``cursor`` in ``(field, id)`` order."""
+    if not cursor:
+        return {}
+    value, doc_id = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, "id": {op: doc_id}}
+    ]}
+
 # ================================
 # API ROUTES
 # ================================
 
 @api_router.post("/auth/register", response_model=Token)
 async def register(user: UserCreate):
-    # Check if user already exists
-    existing_user = await db.users.find_one({"email": user.email})
-    if existing_user:
-        raise HTTPException(
-            status_code=400,
-            detail="Email already registered"
-        )
+    # Hash off the event loop so concurrent sign-ups are bound by bcrypt, not by each other
+    hashed_password = await run_in_threadpool(get_password_hash, user.password)
     
-    # Create user
-    hashed_password = get_password_hash(user.password)
+    # Create user; the unique index on email rejects duplicates atomically
     user_dict = user.dict()
     del user_dict["password"]
     user_dict["hashed_password"] = hashed_password
@@ -224,14 +536,18 @@ async def register(user: UserCreate):
     user_dict["is_verified"] = False
     user_dict["is_active"] = True
     user_dict["created_at"] = datetime.utcnow()
-    user_dict["updated_at"] = datetime.utcnow()
+    user_dict["updated_at"] = user_dict["created_at"]
     
-    await db.users.insert_one(user_dict)
-    user_obj = User(**{k: v for k, v in user_dict.items() if k != "hashed_password"})
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=400,
+            detail="Email already registered"
+        )
+    rollups.record("signups", user_dict["created_at"], user_dict["role"])
     
-    # Create empty profile
-    profile_obj = Profile(user_id=user_obj.id)
-    await db.profiles.insert_one(profile_obj.dict())
+    # The profile is created lazily on first read or update
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -264,64 +580,176 @@ async def login(user: UserLogin):
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
+def profile_defaults(user_id: str, exclude=()):
+    """Fields for a new empty profile, suitable for ``$setOnInsert``."""
+    defaults = Profile(user_id=user_id).dict()
+    return {k: v for k, v in defaults.items() if k not in exclude}
+
 @api_router.get("/users/me/profile", response_model=Profile)
-async def read_user_profile(current_user: User = Depends(get_current_active_user)):
-    profile = await db.profiles.find_one({"user_id": current_user.id})
-    if not profile:
-        raise HTTPException(status_code=404, detail="Profile not found")
+async def read_user_profile(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user)
+):
+    # Create the empty profile on first read in the same round trip
+    profile = await find_and_update(
+        db.profiles,
+        {"user_id": current_user.id},
+        {"$setOnInsert": profile_defaults(current_user.id)},
+        upsert=True
+    )
+    etag = document_etag(profile)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return Profile(**profile)
 
 @api_router.put("/users/me/profile", response_model=Profile)
 async def update_user_profile(
     profile_data: ProfileCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_active_user)
 ):
     profile_dict = profile_data.dict()
     profile_dict["updated_at"] = datetime.utcnow()
     
-    result = await db.profiles.update_one(
-        {"user_id": current_user.id},
-        {"$set": profile_dict}
-    )
+    query = {"user_id": current_user.id}
+    # The profile id is only known from the tag, which the filter pins
+    precondition = if_match_filter(if_match)
+    query.update(precondition)
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Profile not found")
+    updated_profile = await find_and_update(
+        db.profiles,
+        query,
+        {
+            "$set": profile_dict,
+            "$inc": {"version": 1},
+            "$setOnInsert": profile_defaults(current_user.id, exclude=profile_dict)
+        },
+        # A conditional update must never create the profile
+        upsert=not precondition
+    )
+    if updated_profile is None:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Precondition failed")
+    await invalidation.publish("profiles", [current_user.id])
     
-    updated_profile = await db.profiles.find_one({"user_id": current_user.id})
+    response.headers["ETag"] = document_etag(updated_profile)
     return Profile(**updated_profile)
 
+# Content-addressed files: chat attachments and avatar originals
+blob_store = blob_store_from_env(ROOT_DIR / "attachments")
+
+avatar_pipeline = AvatarPipeline(
+    get_db=lambda: db,
+    root=Path(os.environ.get("AVATAR_DIR", str(ROOT_DIR / "avatars"))),
+    store=blob_store,
+    profile_defaults=profile_defaults,
+    publish=invalidation.publish,
+    max_size=int(os.environ.get("AVATAR_MAX_SIZE", str(5 * 1024 * 1024)))
+)
+
+def avatar_job(job: dict) -> AvatarJob:
+    thumbnails = {}
+    if job["status"] == "completed":
+        thumbnails = {variant: avatar_url(job["digest"], variant) for variant in VARIANTS}
+    return AvatarJob(id=job["id"], status=job["status"], error=job.get("error"), thumbnails=thumbnails)
+
+@api_router.post("/users/me/avatar", response_model=AvatarJob, status_code=status.HTTP_202_ACCEPTED)
+async def upload_avatar(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Store a new avatar and queue its thumbnails.
+
+    The profile's ``avatar_url`` switches over once they are rendered;
+    ``GET /users/me/avatar`` reports progress.
+    """
+    try:
+        digest = await avatar_pipeline.store_original(file)
+    except InvalidImage as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    return avatar_job(await avatar_pipeline.enqueue(current_user.id, digest))
+
+@api_router.get("/users/me/avatar", response_model=AvatarJob)
+async def get_avatar_job(current_user: User = Depends(get_current_active_user)):
+    job = await db.avatar_jobs.find_one(
+        {"user_id": current_user.id}, {"_id": 0}, sort=[("created_at", -1)]
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="No avatar uploaded")
+    return avatar_job(job)
+
+@api_router.get("/avatars/{digest}/{variant}.webp")
+async def get_avatar(digest: str, variant: str):
+    """A rendered thumbnail. Public, so that it works in ``<img>`` tags."""
+    path = avatar_pipeline.thumbnail_path(digest, variant)
+    if variant not in VARIANTS or not DIGEST.fullmatch(digest) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    # The URL names the content, so it never changes
+    return FileResponse(
+        path, media_type="image/webp", headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+def card_profile(profile: dict) -> Profile:
+    """Profile for list responses, which show the small avatar."""
+    return Profile(**{**profile, "avatar_url": avatar_variant(profile.get("avatar_url", ""), "small")})
+
+def fuzzy_score(query: str, text: str) -> int:
+    from fuzzywuzzy import fuzz
+    return fuzz.partial_ratio(query, text)
+
 @api_router.get("/search/mentors")
 async def search_mentors(
     q: str,
     current_user: User = Depends(get_current_active_user)
 ):
+    cached = mentor_search_cache.get(q.lower())
+    if cached is not None:
+        return cached
+    
     # Get all mentors with profiles
-    mentors = await db.users.find({"role": UserRole.MENTOR, "is_verified": True}).to_list(100)
+    search_db = reader("search")
+    mentors = await search_db.users.find({"role": UserRole.MENTOR, "is_verified": True}).to_list(100)
     mentor_results = []
     
     for mentor in mentors:
-        profile = await db.profiles.find_one({"user_id": mentor["id"]})
-        if profile and profile.get("available"):
+        profile = await search_db.profiles.find_one({"user_id": mentor["id"]})
+        if profile is None:
+            # Profiles are created lazily, so a missing one is an empty profile
+            profile = profile_defaults(mentor["id"])
+        if profile.get("available"):
             # Calculate fuzzy score
             search_text = f"{mentor['name']} {profile.get('bio', '')} {' '.join(profile.get('skills', []))}"
-            score = fuzz.partial_ratio(q.lower(), search_text.lower())
+            score = fuzzy_score(q.lower(), search_text.lower())
             
             mentor_results.append({
                 "user": User(**mentor),
-                "profile": Profile(**profile),
+                "profile": card_profile(profile),
                 "score": score
             })
     
     # Sort by score (descending)
     mentor_results.sort(key=lambda x: x["score"], reverse=True)
     
+    mentor_search_cache.set(q.lower(), mentor_results[:10])
     return mentor_results[:10]  # Return top 10 results
 
 @api_router.get("/conversations", response_model=List[Conversation])
-async def get_conversations(current_user: User = Depends(get_current_active_user)):
+async def get_conversations(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user)
+):
     conversations = await db.conversations.find(
         {"members": current_user.id}
     ).to_list(100)
+    etag = collection_etag(conversations)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return [Conversation(**conv) for conv in conversations]
 
 @api_router.post("/conversations", response_model=Conversation)
@@ -346,6 +774,10 @@ async def create_conversation(
 @api_router.get("/conversations/{conversation_id}/messages", response_model=List[Message])
 async def get_messages(
     conversation_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_active_user)
 ):
     # Verify user is part of conversation
@@ -353,39 +785,365 @@ async def get_messages(
     if not conversation or current_user.id not in conversation["members"]:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    messages = await db.messages.find(
-        {"conversation_id": conversation_id}
-    ).sort("created_at", 1).to_list(100)
+    # The newest page (or the page before the cursor), returned oldest first;
+    # X-Next-Cursor points at the next older page
+    query = {"conversation_id": conversation_id}
+    page_filter = after_cursor("created_at", before, descending=True)
+    if page_filter:
+        query = {"$and": [query, page_filter]}
+    messages = await reader("history").messages.find(query).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
     
+    if len(messages) < limit:
+        # Paging past the hot window falls through to the archive
+        if messages:
+            older_than = (messages[-1]["created_at"], messages[-1]["id"])
+        else:
+            older_than = decode_cursor(before) if before else None
+        messages += await message_archiver.read_before(
+            conversation_id, older_than, limit - len(messages)
+        )
+    messages.reverse()
+    
+    etag = collection_etag(messages)
+    next_cursor = None
+    if len(messages) == limit:
+        next_cursor = encode_cursor(messages[0]["created_at"], messages[0]["id"])
+    
+    if etag_matches(if_none_match, etag):
+        not_modified_response = not_modified(etag)
+        if next_cursor:
+            not_modified_response.headers["X-Next-Cursor"] = next_cursor
+        return not_modified_response
+    response.headers["ETag"] = etag
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [Message(**msg) for msg in messages]
 
+message_search = MessageSearch(get_db=lambda: reader("search"))
+
+@api_router.get("/messages/search", response_model=List[MessageSearchHit])
+async def search_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    conversation_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Search the caller's conversations, best match first.
+
+    ``q`` accepts Mongo text search syntax ("quoted phrases", -excluded).
+    X-Next-Cursor points at the next page.
+    """
+    if conversation_id is not None:
+        if not await is_conversation_member(conversation_id, current_user.id):
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        conversation_ids = [conversation_id]
+    else:
+        conversations = await db.conversations.find(
+            {"members": current_user.id}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        conversation_ids = [conversation["id"] for conversation in conversations]
+    
+    try:
+        hits, next_cursor = await message_search.search(conversation_ids, q, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [
+        MessageSearchHit(
+            message=Message(**hit),
+            score=hit["score"],
+            snippet=hit["snippet"],
+            highlights=hit["highlights"]
+        )
+        for hit in hits
+    ]
+
+async def is_conversation_member(conversation_id: str, user_id: str) -> bool:
+    members = conversation_members_cache.get(conversation_id)
+    if members is None:
+        conversation = await db.conversations.find_one(
+            {"id": conversation_id}, {"_id": 0, "members": 1}
+        )
+        if conversation is None:
+            return False
+        members = frozenset(conversation["members"])
+        conversation_members_cache.set(conversation_id, members)
+    return user_id in members
+
+async def store_message(
+    conversation_id: str, sender_id: str, content: str, attachments: List[dict] = ()
+):
+    """Persist a message and buffer it for reconnect replay.
+
+    Returns the model and the payload callers broadcast. Datetimes are
+    left in place for the socket serializer to encode.
+    """
+    message = Message(
+        conversation_id=conversation_id,
+        sender_id=sender_id,
+        content=content,
+        attachments=[Attachment(**attachment) for attachment in attachments]
+    )
+    payload = message.dict()
+    await db.messages.insert_one(dict(payload))
+    rollups.record("messages", message.created_at)
+    room_history.append(conversation_id, payload)
+    return message, payload
+
+async def broadcast_message(payload: dict):
+    """Deliver a stored message to its conversation room.
+
+    Both the HTTP and the socket path send it as ``receive_message``,
+    which is the event clients listen for.
+    """
+    await sio.emit("receive_message", payload, room=payload["conversation_id"])
+
 @api_router.post("/messages", response_model=Message)
 async def create_message(
     message_data: MessageCreate,
     current_user: User = Depends(get_current_active_user)
 ):
     # Verify user is part of conversation
-    conversation = await db.conversations.find_one({"id": message_data.conversation_id})
-    if not conversation or current_user.id not in conversation["members"]:
+    if not await is_conversation_member(message_data.conversation_id, current_user.id):
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Create message
-    message = Message(
-        conversation_id=message_data.conversation_id,
-        sender_id=current_user.id,
-        content=message_data.content
+    attachments = []
+    if message_data.attachment_ids:
+        attachments = await db.attachments.find(
+            {
+                "id": {"$in": message_data.attachment_ids},
+                "owner_id": current_user.id,
+                "conversation_id": message_data.conversation_id,
+                "status": "ready"
+            },
+            {"_id": 0, "id": 1, "filename": 1, "content_type": 1, "size": 1, "sha256": 1}
+        ).to_list(MAX_MESSAGE_ATTACHMENTS)
+        if len(attachments) != len(set(message_data.attachment_ids)):
+            raise HTTPException(status_code=400, detail="Unknown or unfinished attachment")
+    
+    message, payload = await store_message(
+        message_data.conversation_id, current_user.id, message_data.content, attachments
     )
-    await db.messages.insert_one(message.dict())
+    await broadcast_message(payload)
+    return message
+
+# ================================
+# ATTACHMENTS
+# ================================
+
+attachment_service = AttachmentService(
+    get_db=lambda: db,
+    store=blob_store,
+    max_size=int(os.environ.get("ATTACHMENT_MAX_SIZE", str(100 * 1024 * 1024))),
+    upload_ttl=timedelta(hours=int(os.environ.get("ATTACHMENT_UPLOAD_TTL_HOURS", "24")))
+)
+
+async def own_upload(upload_id: str, user_id: str) -> dict:
+    upload = await db.attachments.find_one({"id": upload_id, "owner_id": user_id}, {"_id": 0})
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+@api_router.post("/attachments", response_model=Upload)
+async def create_upload(
+    upload_data: UploadCreate,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Start an upload; send the bytes with ``PATCH /attachments/{id}``."""
+    if not await is_conversation_member(upload_data.conversation_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    try:
+        upload = await attachment_service.create_upload(current_user.id, **upload_data.dict())
+    except ValueError as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    return Upload(**upload)
+
+@api_router.get("/attachments/{upload_id}/upload", response_model=Upload)
+async def get_upload(upload_id: str, current_user: User = Depends(get_current_active_user)):
+    """Upload progress; an interrupted upload resumes at ``received``."""
+    return Upload(**await own_upload(upload_id, current_user.id))
+
+@api_router.patch("/attachments/{upload_id}", response_model=Upload)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., ge=0),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Append the request body at ``Upload-Offset``.
+
+    A mismatched offset gets 409 with the stored offset in
+    ``Upload-Offset``. The upload is ready once the last byte arrives.
+    """
+    upload = await own_upload(upload_id, current_user.id)
+    try:
+        upload = await attachment_service.write_chunk(upload, upload_offset, request.stream())
+    except OffsetMismatch as mismatch:
+        raise HTTPException(
+            status_code=409,
+            detail="Upload offset mismatch",
+            headers={"Upload-Offset": str(mismatch.offset)}
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return Upload(**upload)
+
+@api_router.get("/attachments/{attachment_id}")
+async def download_attachment(
+    attachment_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    current_user: User = Depends(get_current_active_user)
+):
+    """The attachment's bytes, or one ``Range`` of them (206)."""
+    attachment = await db.attachments.find_one({"id": attachment_id, "status": "ready"}, {"_id": 0})
+    if not attachment or not await is_conversation_member(attachment["conversation_id"], current_user.id):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return await attachment_service.download(attachment, range_header)
+
+# ================================
+# DATA EXPORT
+# ================================
+
+EXPORT_CHECKPOINT_EVERY = 100
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def encode_export_cursor(position) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+def decode_export_cursor(cursor: str):
+    """``(section, key)`` from a cursor made by ``encode_export_cursor``.
+
+    A schedules key is the last schedule id. A conversations key is
+    ``(conversation_id, after)``, where ``after`` is ``None`` or the
+    ``(created_at, id)`` of the last message exported.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        section, key = json.loads(raw)
+        if section == "schedules" and (key is None or isinstance(key, str)):
+            return section, key
+        if section == "conversations" and isinstance(key, list):
+            conversation_id, position = key
+            if not isinstance(conversation_id, str):
+                raise ValueError
+            if position is None:
+                return section, (conversation_id, None)
+            if not isinstance(position, list):
+                raise ValueError
+            created_at, message_id = position
+            if not isinstance(created_at, str) or not isinstance(message_id, str):
+                raise ValueError
+            return section, (conversation_id, (datetime.fromisoformat(created_at), message_id))
+    except (ValueError, TypeError):
+        pass
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def conversation_history(conversation_id: str, after):
+    """Every message of a conversation oldest first: archive, then hot."""
+    last = after
+    async for message in message_archiver.iter_after(conversation_id, after):
+        last = (message["created_at"], message["id"])
+        yield message
+    query = {"conversation_id": conversation_id}
+    if last is not None:
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$gt": last[0]}},
+            {"created_at": last[0], "id": {"$gt": last[1]}}
+        ]}]}
+    cursor = reader("history").messages.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+    async for message in cursor:
+        yield message
+
+async def export_records(user_id: str, section: str, key):
+    """Yield ``(type, document, position)`` for everything the user owns.
+
+    ``position`` identifies the record just emitted and is what a resume
+    cursor encodes. Records are ordered so that resuming from a position
+    never skips anything.
+    """
+    if section == "schedules":
+        query = {"$or": [{"mentor_id": user_id}, {"seeker_id": user_id}]}
+        if key:
+            query = {"$and": [query, {"id": {"$gt": key}}]}
+        async for schedule in db.schedules.find(query, {"_id": 0}).sort("id", 1):
+            yield "schedule", schedule, ["schedules", schedule["id"]]
+        key = None
+    
+    resume_conversation, resume_after = key or (None, None)
+    query = {"members": user_id}
+    if resume_conversation:
+        query["id"] = {"$gte": resume_conversation}
+    async for conversation in db.conversations.find(query, {"_id": 0}).sort("id", 1):
+        after = None
+        if conversation["id"] == resume_conversation:
+            after = resume_after
+        else:
+            yield "conversation", conversation, ["conversations", [conversation["id"], None]]
+        async for message in conversation_history(conversation["id"], after):
+            position = [message["created_at"].isoformat(), message["id"]]
+            yield "message", message, ["conversations", [conversation["id"], position]]
+
+@api_router.get("/users/me/export")
+async def export_user_data(
+    cursor: Optional[str] = None,
+    compress: bool = False,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Stream the caller's schedules, conversations and messages as NDJSON.
+
+    A ``checkpoint`` line carrying a resume cursor follows every
+    ``EXPORT_CHECKPOINT_EVERY`` records. After a dropped download, pass the
+    last checkpoint's cursor to continue; records after that checkpoint
+    may be repeated and can be deduplicated by ``id``.
+    """
+    section, key = decode_export_cursor(cursor) if cursor else ("schedules", None)
     
-    # Emit to socket
-    await sio.emit("new_message", message.dict(), room=message_data.conversation_id)
+    async def lines():
+        chunk = []
+        position = None
+        async for kind, document, position in export_records(current_user.id, section, key):
+            chunk.append(json.dumps({"type": kind, "data": document}, default=json_default))
+            if len(chunk) >= EXPORT_CHECKPOINT_EVERY:
+                chunk.append(json.dumps({"type": "checkpoint", "cursor": encode_export_cursor(position)}))
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        chunk.append(json.dumps({"type": "end"}))
+        yield "\n".join(chunk) + "\n"
     
-    return message
+    async def gzipped():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        async for text in lines():
+            # Sync-flush each chunk so a truncated download still decompresses
+            # up to its last checkpoint
+            yield compressor.compress(text.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    
+    filename = "testnet-export.ndjson.gz" if compress else "testnet-export.ndjson"
+    return StreamingResponse(
+        gzipped() if compress else lines(),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 # ================================
 # SCHEDULING ROUTES
 # ================================
 
+# Statuses that hold a mentor's time slot
+ACTIVE_SCHEDULE_STATUSES = ["scheduled", "confirmed", "in_progress"]
+
+RECURRENCE_INTERVALS = {"weekly": timedelta(weeks=1), "biweekly": timedelta(weeks=2)}
+MAX_BOOKINGS_PER_REQUEST = 52
+
 @api_router.post("/schedules", response_model=Schedule)
 async def create_schedule(
     schedule_data: ScheduleCreate,
@@ -401,7 +1159,7 @@ async def create_schedule(
         "mentor_id": schedule_data.mentor_id,
         "start_time": {"$lte": schedule_data.end_time},
         "end_time": {"$gte": schedule_data.start_time},
-        "status": {"$in": ["scheduled", "confirmed"]}
+        "status": {"$in": ACTIVE_SCHEDULE_STATUSES}
     })
     
     if existing_schedule:
@@ -418,21 +1176,260 @@ async def create_schedule(
     )
     
     await db.schedules.insert_one(schedule.dict())
+    session_scheduler.track(schedule.dict())
+    rollups.record("bookings", schedule.created_at, schedule.mentor_id)
     return schedule
 
+def expand_recurrence(session: ScheduleCreate, recurrence: Recurrence) -> List[ScheduleCreate]:
+    interval = RECURRENCE_INTERVALS.get(recurrence.frequency)
+    if interval is None:
+        raise HTTPException(status_code=400, detail="Unsupported recurrence frequency")
+    if (recurrence.count is None) == (recurrence.until is None):
+        raise HTTPException(status_code=400, detail="Recurrence needs exactly one of count or until")
+    
+    occurrences = []
+    offset = timedelta(0)
+    while len(occurrences) < MAX_BOOKINGS_PER_REQUEST + 1:
+        if recurrence.count is not None and len(occurrences) >= recurrence.count:
+            break
+        if recurrence.until is not None and session.start_time + offset > recurrence.until:
+            break
+        occurrences.append(session.copy(update={
+            "start_time": session.start_time + offset,
+            "end_time": session.end_time + offset
+        }))
+        offset += interval
+    return occurrences
+
+async def book_sessions(sessions: List[ScheduleCreate], seeker_id: str) -> BookingResult:
+    """Book many sessions with one mentor lookup, one conflict query and one insert.
+
+    Existing bookings of every mentor involved are fetched with a single
+    range query. They are then merged per mentor into sorted, disjoint busy
+    blocks, and each requested session is checked with a binary search in
+    start-time order. Sessions accepted earlier in the same request block
+    later ones, so a series cannot double-book itself.
+    """
+    if not sessions:
+        raise HTTPException(status_code=400, detail="No sessions to book")
+    if len(sessions) > MAX_BOOKINGS_PER_REQUEST:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BOOKINGS_PER_REQUEST} sessions can be booked at once"
+        )
+    if any(session.end_time <= session.start_time for session in sessions):
+        raise HTTPException(status_code=400, detail="Session must end after it starts")
+    
+    mentor_ids = list({session.mentor_id for session in sessions})
+    mentors = await db.users.find(
+        {"id": {"$in": mentor_ids}, "role": UserRole.MENTOR}, {"_id": 0, "id": 1}
+    ).to_list(None)
+    known_mentors = {mentor["id"] for mentor in mentors}
+    
+    existing = await db.schedules.find(
+        {
+            "mentor_id": {"$in": list(known_mentors)},
+            "start_time": {"$lte": max(session.end_time for session in sessions)},
+            "end_time": {"$gte": min(session.start_time for session in sessions)},
+            "status": {"$in": ACTIVE_SCHEDULE_STATUSES}
+        },
+        {"_id": 0, "id": 1, "mentor_id": 1, "start_time": 1, "end_time": 1}
+    ).sort("start_time", 1).to_list(None)
+    
+    # Per mentor: parallel lists of block starts, block ends and a block id
+    busy: Dict[str, tuple] = {mentor_id: ([], [], []) for mentor_id in known_mentors}
+    for booking in existing:
+        starts, ends, ids = busy[booking["mentor_id"]]
+        # Touching intervals conflict, matching the single-booking check
+        if ends and booking["start_time"] <= ends[-1]:
+            ends[-1] = max(ends[-1], booking["end_time"])
+        else:
+            starts.append(booking["start_time"])
+            ends.append(booking["end_time"])
+            ids.append(booking["id"])
+    
+    outcomes: List[Optional[BookingOutcome]] = [None] * len(sessions)
+    accepted = []
+    for index in sorted(range(len(sessions)), key=lambda i: sessions[i].start_time):
+        session = sessions[index]
+        outcome = BookingOutcome(
+            mentor_id=session.mentor_id,
+            start_time=session.start_time,
+            end_time=session.end_time,
+            booked=False
+        )
+        outcomes[index] = outcome
+        if session.mentor_id not in known_mentors:
+            outcome.detail = "Mentor not found"
+            continue
+        
+        starts, ends, ids = busy[session.mentor_id]
+        position = bisect.bisect_left(ends, session.start_time)
+        if position < len(starts) and starts[position] <= session.end_time:
+            outcome.conflict_with = ids[position]
+            outcome.detail = "Time slot already booked"
+            continue
+        
+        schedule = Schedule(
+            mentor_id=session.mentor_id,
+            seeker_id=seeker_id,
+            start_time=session.start_time,
+            end_time=session.end_time,
+            title=session.title,
+            description=session.description
+        )
+        starts.insert(position, schedule.start_time)
+        ends.insert(position, schedule.end_time)
+        ids.insert(position, schedule.id)
+        outcome.booked = True
+        outcome.schedule = schedule
+        accepted.append(schedule.dict())
+    
+    if accepted:
+        await db.schedules.insert_many(accepted)
+        for schedule in accepted:
+            session_scheduler.track(schedule)
+        rollups.record_many(
+            "bookings", [(schedule["created_at"], schedule["mentor_id"]) for schedule in accepted]
+        )
+    
+    return BookingResult(
+        booked=len(accepted),
+        conflicts=len(sessions) - len(accepted),
+        results=outcomes
+    )
+
+@api_router.post("/schedules/recurring", response_model=BookingResult)
+async def create_recurring_schedule(
+    schedule_data: RecurringScheduleCreate,
+    current_user: User = Depends(get_current_active_user)
+):
+    session = ScheduleCreate(**schedule_data.dict(exclude={"recurrence"}))
+    return await book_sessions(expand_recurrence(session, schedule_data.recurrence), current_user.id)
+
+@api_router.post("/schedules/bulk", response_model=BookingResult)
+async def create_bulk_schedules(
+    bulk_data: BulkScheduleCreate,
+    current_user: User = Depends(get_current_active_user)
+):
+    return await book_sessions(bulk_data.sessions, current_user.id)
+
+def schedule_list_query(
+    current_user: User,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    statuses: Optional[List[str]]
+) -> dict:
+    # Served by the (mentor_id, start_time) / (seeker_id, start_time) indexes
+    owner_field = "mentor_id" if current_user.role == UserRole.MENTOR else "seeker_id"
+    query = {owner_field: current_user.id}
+    window = {}
+    if start is not None:
+        window["$gte"] = start
+    if end is not None:
+        window["$lt"] = end
+    if window:
+        query["start_time"] = window
+    if statuses:
+        query["status"] = {"$in": statuses}
+    return query
+
 @api_router.get("/schedules", response_model=List[Schedule])
-async def get_schedules(current_user: User = Depends(get_current_active_user)):
-    # Get schedules based on user role
-    if current_user.role == UserRole.MENTOR:
-        schedules = await db.schedules.find({"mentor_id": current_user.id}).to_list(100)
-    else:
-        schedules = await db.schedules.find({"seeker_id": current_user.id}).to_list(100)
+async def get_schedules(
+    response: Response,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    statuses: Optional[List[str]] = Query(None, alias="status"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user)
+):
+    # Sessions starting in [from, to), ordered by start time; the next page
+    # is advertised through the X-Next-Cursor header
+    query = schedule_list_query(current_user, start, end, statuses)
+    page_filter = after_cursor("start_time", cursor)
+    if page_filter:
+        query = {"$and": [query, page_filter]}
+    
+    schedules = await db.schedules.find(query).sort(
+        [("start_time", 1), ("id", 1)]
+    ).limit(limit).to_list(limit)
+    
+    etag = collection_etag(schedules)
+    next_cursor = None
+    if len(schedules) == limit:
+        last = schedules[-1]
+        next_cursor = encode_cursor(last["start_time"], last["id"])
     
+    if etag_matches(if_none_match, etag):
+        not_modified_response = not_modified(etag)
+        if next_cursor:
+            not_modified_response.headers["X-Next-Cursor"] = next_cursor
+        return not_modified_response
+    response.headers["ETag"] = etag
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [Schedule(**schedule) for schedule in schedules]
 
+def ics_escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+def ics_timestamp(value: datetime) -> str:
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+def ics_event(schedule: dict) -> str:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{schedule['id']}@testnet",
+        f"DTSTAMP:{ics_timestamp(schedule.get('updated_at') or schedule['start_time'])}",
+        f"DTSTART:{ics_timestamp(schedule['start_time'])}",
+        f"DTEND:{ics_timestamp(schedule['end_time'])}",
+        f"SUMMARY:{ics_escape(schedule.get('title') or 'Mentoring session')}",
+    ]
+    if schedule.get("description"):
+        lines.append(f"DESCRIPTION:{ics_escape(schedule['description'])}")
+    if schedule.get("meeting_link"):
+        lines.append(f"URL:{schedule['meeting_link']}")
+    if schedule.get("status") == "cancelled":
+        lines.append("STATUS:CANCELLED")
+    lines.append("END:VEVENT")
+    return "\r\n".join(lines) + "\r\n"
+
+@api_router.get("/schedules/export.ics")
+async def export_schedules_ics(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    statuses: Optional[List[str]] = Query(None, alias="status"),
+    current_user: User = Depends(get_current_active_user)
+):
+    query = schedule_list_query(current_user, start, end, statuses)
+    
+    async def calendar():
+        yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Testnet//Schedules//EN\r\n"
+        # Iterate the cursor so memory stays flat regardless of calendar size
+        cursor = db.schedules.find(query, {"_id": 0}).sort("start_time", 1).batch_size(200)
+        async for schedule in cursor:
+            yield ics_event(schedule)
+        yield "END:VCALENDAR\r\n"
+    
+    return StreamingResponse(
+        calendar(),
+        media_type="text/calendar",
+        headers={"Content-Disposition": 'attachment; filename="schedules.ics"'}
+    )
+
 @api_router.get("/schedules/{schedule_id}", response_model=Schedule)
 async def get_schedule(
     schedule_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_active_user)
 ):
     schedule = await db.schedules.find_one({"id": schedule_id})
@@ -443,35 +1440,40 @@ async def get_schedule(
     if schedule["mentor_id"] != current_user.id and schedule["seeker_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
+    etag = document_etag(schedule)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return Schedule(**schedule)
 
 @api_router.put("/schedules/{schedule_id}", response_model=Schedule)
 async def update_schedule(
     schedule_id: str,
     schedule_data: ScheduleUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_active_user)
 ):
-    schedule = await db.schedules.find_one({"id": schedule_id})
-    if not schedule:
-        raise HTTPException(status_code=404, detail="Schedule not found")
-    
-    # Check if user has access to update this schedule
-    if schedule["mentor_id"] != current_user.id and schedule["seeker_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Update schedule
+    # Update schedule; only participants match the filter
     update_data = schedule_data.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.utcnow()
     
-    result = await db.schedules.update_one(
-        {"id": schedule_id},
-        {"$set": update_data}
+    query = schedule_participant_filter(schedule_id, current_user.id)
+    precondition = if_match_filter(if_match, schedule_id)
+    query.update(precondition)
+    
+    updated_schedule = await find_and_update(
+        db.schedules,
+        query,
+        {"$set": update_data, "$inc": {"version": 1}}
     )
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Schedule not found")
+    if updated_schedule is None:
+        await raise_schedule_miss(schedule_id, current_user.id, precondition=bool(precondition))
+    if updated_schedule["status"] not in ACTIVE_SCHEDULE_STATUSES:
+        session_scheduler.untrack(schedule_id)
     
-    updated_schedule = await db.schedules.find_one({"id": schedule_id})
+    response.headers["ETag"] = document_etag(updated_schedule)
     return Schedule(**updated_schedule)
 
 @api_router.delete("/schedules/{schedule_id}")
@@ -479,76 +1481,229 @@ async def delete_schedule(
     schedule_id: str,
     current_user: User = Depends(get_current_active_user)
 ):
-    schedule = await db.schedules.find_one({"id": schedule_id})
-    if not schedule:
-        raise HTTPException(status_code=404, detail="Schedule not found")
-    
-    # Check if user has access to delete this schedule
-    if schedule["mentor_id"] != current_user.id and schedule["seeker_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    result = await db.schedules.delete_one({"id": schedule_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Schedule not found")
+    # Only participants match the filter
+    deleted = await find_and_delete(
+        db.schedules,
+        schedule_participant_filter(schedule_id, current_user.id),
+        projection={"_id": 1}
+    )
+    if deleted is None:
+        await raise_schedule_miss(schedule_id, current_user.id)
+    session_scheduler.untrack(schedule_id)
     
     return {"message": "Schedule deleted successfully"}
 
 # Admin routes
-@api_router.get("/admin/mentors")
-async def get_pending_mentors(current_user: User = Depends(get_current_active_user)):
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
+async def mentor_page(verified: Optional[bool], limit: int, cursor: Optional[str]):
+    """One page of mentors ordered by ``created_at`` with profiles joined in."""
+    match = {"role": UserRole.MENTOR}
+    if verified is not None:
+        match["is_verified"] = verified
+    page_filter = after_cursor("created_at", cursor)
+    if page_filter:
+        match = {"$and": [match, page_filter]}
     
-    mentors = await db.users.find({"role": UserRole.MENTOR}).to_list(100)
-    mentor_results = []
+    mentors = await db.users.aggregate([
+        {"$match": match},
+        {"$sort": {"created_at": 1, "id": 1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "profiles",
+            "localField": "id",
+            "foreignField": "user_id",
+            "as": "profile"
+        }},
+        {"$project": {"_id": 0, "hashed_password": 0, "profile._id": 0}}
+    ]).to_list(limit)
     
+    entries = []
     for mentor in mentors:
-        profile = await db.profiles.find_one({"user_id": mentor["id"]})
-        mentor_results.append({
-            "user": User(**mentor),
-            "profile": Profile(**profile) if profile else None
-        })
+        profiles = mentor.pop("profile")
+        entries.append(MentorEntry(
+            user=User(**mentor),
+            profile=card_profile(profiles[0]) if profiles else None
+        ))
     
-    return mentor_results
+    next_cursor = None
+    if len(mentors) == limit:
+        next_cursor = encode_cursor(mentors[-1]["created_at"], mentors[-1]["id"])
+    return entries, next_cursor
+
+async def mentor_counts() -> Dict[str, int]:
+    counts = await db.users.aggregate([
+        {"$match": {"role": UserRole.MENTOR}},
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "pending": {"$sum": {"$cond": [{"$eq": ["$is_verified", True]}, 0, 1]}}
+        }}
+    ]).to_list(1)
+    if not counts:
+        return {"total": 0, "pending": 0}
+    return {"total": counts[0]["total"], "pending": counts[0]["pending"]}
+
+@api_router.get("/admin/mentors", response_model=List[MentorEntry])
+async def get_pending_mentors(
+    response: Response,
+    verified: Optional[bool] = False,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_admin_user)
+):
+    entries, next_cursor = await mentor_page(verified, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return entries
+
+@api_router.get("/admin/mentors/queue", response_model=MentorQueuePage)
+async def get_mentor_queue(
+    verified: Optional[bool] = False,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_admin_user)
+):
+    # Oldest applications first; the page and the counts are fetched concurrently
+    (entries, next_cursor), counts = await asyncio.gather(
+        mentor_page(verified, limit, cursor),
+        mentor_counts()
+    )
+    return MentorQueuePage(items=entries, next_cursor=next_cursor, **counts)
 
 @api_router.put("/admin/mentors/{mentor_id}/verify")
 async def verify_mentor(
     mentor_id: str,
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_admin_user)
 ):
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    result = await db.users.update_one(
+    mentor = await find_and_update(
+        db.users,
         {"id": mentor_id, "role": UserRole.MENTOR},
-        {"$set": {"is_verified": True, "updated_at": datetime.utcnow()}}
+        {"$set": {"is_verified": True, "updated_at": datetime.utcnow()}},
+        projection={"_id": 1}
     )
     
-    if result.matched_count == 0:
+    if mentor is None:
         raise HTTPException(status_code=404, detail="Mentor not found")
+    await invalidation.publish("users", [mentor_id])
     
     return {"message": "Mentor verified successfully"}
 
 @api_router.delete("/admin/mentors/{mentor_id}")
 async def delete_mentor(
     mentor_id: str,
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_admin_user)
 ):
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    # Delete user and profile
-    await db.users.delete_one({"id": mentor_id})
+    # Delete user and profile; dependent data is removed in the background
+    result = await db.users.delete_one({"id": mentor_id})
     await db.profiles.delete_one({"user_id": mentor_id})
+    await invalidation.publish("users", [mentor_id])
+    await invalidation.publish("profiles", [mentor_id])
+    
+    job_ids = await cascade_cleanup.enqueue([mentor_id] if result.deleted_count else [])
     
-    return {"message": "Mentor deleted successfully"}
+    return {
+        "message": "Mentor deleted successfully",
+        "cleanup_job_id": job_ids[0] if job_ids else None
+    }
+
+MODERATION_OUTCOMES = {"verify": "verified", "reject": "rejected", "delete": "deleted"}
+MAX_BULK_MODERATION = 1000
+
+async def moderated_mentor_ids(action: str, mentor_ids: List[str]) -> List[str]:
+    """Which of ``mentor_ids``, all mentors when read, the update_many or delete_many moderated.
+
+    Only needed when the write matched fewer mentors than were read, i.e.
+    some changed in between.
+    """
+    current = await db.users.find(
+        {"id": {"$in": mentor_ids}}, {"_id": 0, "id": 1, "role": 1, "is_verified": 1}
+    ).to_list(None)
+    users = {user["id"]: user for user in current}
+    if action == "delete":
+        return [mentor_id for mentor_id in mentor_ids if mentor_id not in users]
+    if action == "verify":
+        return [
+            mentor_id for mentor_id in mentor_ids
+            if mentor_id in users and users[mentor_id]["role"] == UserRole.MENTOR
+            and users[mentor_id].get("is_verified")
+        ]
+    return [
+        mentor_id for mentor_id in mentor_ids
+        if mentor_id in users and users[mentor_id]["role"] == UserRole.SEEKER
+    ]
+
+@api_router.post("/admin/mentors/bulk", response_model=ModerationResult)
+async def moderate_mentors(
+    moderation: BulkModeration,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Verify, reject or delete many mentors with one write per collection.
+
+    Rejecting an application turns the account back into a seeker, which
+    removes it from the moderation queue while leaving it usable. The
+    per-id outcomes reflect what the write did, so a mentor changed by
+    someone else in the meantime is reported as ``not_found``.
+    """
+    outcome = MODERATION_OUTCOMES.get(moderation.action)
+    if outcome is None:
+        raise HTTPException(status_code=400, detail="Unknown moderation action")
+    ids = list(dict.fromkeys(moderation.ids))
+    if len(ids) > MAX_BULK_MODERATION:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BULK_MODERATION} mentors can be moderated at once"
+        )
+    
+    found = await db.users.find(
+        {"id": {"$in": ids}, "role": UserRole.MENTOR}, {"_id": 0, "id": 1}
+    ).to_list(None)
+    found_ids = [mentor["id"] for mentor in found]
+    
+    moderated_ids: List[str] = []
+    if found_ids:
+        # The role filter makes the write skip anyone no longer a mentor
+        selector = {"id": {"$in": found_ids}, "role": UserRole.MENTOR}
+        if moderation.action == "delete":
+            written = (await db.users.delete_many(selector)).deleted_count
+        else:
+            changes = {"is_verified": True} if moderation.action == "verify" else {
+                "role": UserRole.SEEKER, "is_verified": False
+            }
+            changes["updated_at"] = datetime.utcnow()
+            written = (await db.users.update_many(selector, {"$set": changes})).matched_count
+        moderated_ids = found_ids
+        if written < len(found_ids):
+            moderated_ids = await moderated_mentor_ids(moderation.action, found_ids)
+    
+    if moderated_ids:
+        if moderation.action == "delete":
+            await db.profiles.delete_many({"user_id": {"$in": moderated_ids}})
+            await cascade_cleanup.enqueue(moderated_ids)
+            await invalidation.publish("profiles", moderated_ids)
+        await invalidation.publish("users", moderated_ids)
+    
+    moderated = set(moderated_ids)
+    return ModerationResult(
+        action=moderation.action,
+        processed=len(moderated_ids),
+        results=[
+            ModerationOutcome(id=mentor_id, status=outcome if mentor_id in moderated else "not_found")
+            for mentor_id in ids
+        ]
+    )
+
+@api_router.get("/admin/cleanup-jobs/{job_id}")
+async def get_cleanup_job(
+    job_id: str,
+    current_user: User = Depends(get_current_admin_user)
+):
+    job = await db.cleanup_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Cleanup job not found")
+    return job
 
 # Seed data endpoint (admin only)
 @api_router.post("/admin/seed-data")
-async def seed_dummy_data(current_user: User = Depends(get_current_active_user)):
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def seed_dummy_data(current_user: User = Depends(get_current_admin_user)):
     # Import and run seed data
     from pathlib import Path
     import importlib.util
@@ -566,31 +1721,347 @@ async def seed_dummy_data(current_user: User = Depends(get_current_active_user))
 # SOCKET.IO EVENTS
 # ================================
 
+def user_room(user_id: str) -> str:
+    return f"user:{user_id}"
+
+async def notify_user(user_id: str, event: str, data: dict):
+    await sio.emit(event, data, room=user_room(user_id))
+
+# Most users a client may watch, or ask about in one presence query
+MAX_PRESENCE_USERS = 200
+
+async def broadcast_presence(event: str, data: dict, rooms: List[str]):
+    # One emit to the union of the watcher rooms: the packet is encoded once
+    # and each watcher receives it once, however many of its users changed
+    await sio.emit(event, data, room=rooms)
+
+presence = PresenceTracker(
+    emit=broadcast_presence,
+    ttl=float(os.environ.get("PRESENCE_TTL", "90")),
+    flush_interval=float(os.environ.get("PRESENCE_FLUSH_INTERVAL", "2"))
+)
+
+# Chat messages are limited per connection and per room; ephemeral events
+# (typing, heartbeats, presence subscriptions) only per connection
+message_throttle = EventThrottle(
+    sid_rate=float(os.environ.get("SOCKET_MESSAGE_RATE", "5")),
+    sid_burst=float(os.environ.get("SOCKET_MESSAGE_BURST", "10")),
+    room_rate=float(os.environ.get("SOCKET_ROOM_RATE", "20")),
+    room_burst=float(os.environ.get("SOCKET_ROOM_BURST", "40"))
+)
+ephemeral_throttle = EventThrottle(sid_rate=2, sid_burst=10)
+
+async def broadcast_to_room(event: str, data: dict, room: str):
+    await sio.emit(event, data, room=room)
+
+typing_events = EphemeralCoalescer(
+    emit=broadcast_to_room,
+    window=float(os.environ.get("TYPING_WINDOW", "1"))
+)
+
+ANALYTICS_WINDOWS = {"hour": timedelta(days=2), "day": timedelta(days=30), "week": timedelta(weeks=12)}
+ANALYTICS_MAX_RANGE = {"hour": timedelta(days=31), "day": timedelta(days=731), "week": timedelta(days=731)}
+
+@api_router.get("/admin/analytics", response_model=AnalyticsReport)
+async def get_analytics(
+    metric: str,
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    key: Optional[str] = None,
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """Counts of ``metric`` per hour, day or week, read from the rollups only.
+
+    Metrics are messages, bookings (keyed by mentor) and signups (keyed
+    by role). Defaults to a recent window ending now.
+    """
+    if metric not in ANALYTICS_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric; use one of {sorted(ANALYTICS_METRICS)}")
+    if granularity not in ANALYTICS_WINDOWS:
+        raise HTTPException(status_code=400, detail="Granularity must be hour, day or week")
+    end = naive_utc(end) or datetime.utcnow()
+    start = naive_utc(start) or end - ANALYTICS_WINDOWS[granularity]
+    if not start < end <= start + ANALYTICS_MAX_RANGE[granularity]:
+        raise HTTPException(status_code=400, detail="Invalid or too long time range")
+    
+    series = await rollups.series(metric, granularity, start, end, key)
+    totals: Dict[str, int] = {}
+    for point in series:
+        totals[point["key"]] = totals.get(point["key"], 0) + point["count"]
+    return AnalyticsReport(
+        metric=metric,
+        granularity=granularity,
+        start=start,
+        end=end,
+        series=[AnalyticsPoint(**point) for point in series],
+        totals=dict(sorted(totals.items(), key=lambda item: -item[1]))
+    )
+
+@api_router.get("/admin/db-stats")
+async def get_db_stats(admin_user: User = Depends(get_current_admin_user)):
+    return database.pool_stats()
+
+@api_router.get("/admin/admission-stats")
+async def get_admission_stats(admin_user: User = Depends(get_current_admin_user)):
+    return admission.stats()
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(admin_user: User = Depends(get_current_admin_user)):
+    return {
+        "caches": {name: cache.stats() for name, cache in local_caches.items()},
+        "invalidation": invalidation.stats()
+    }
+
+@api_router.get("/admin/socket-stats")
+async def get_socket_stats(admin_user: User = Depends(get_current_admin_user)):
+    return {
+        "dropped": dict(message_throttle.dropped + ephemeral_throttle.dropped),
+        "coalesced": dict(typing_events.coalesced)
+    }
+
+@api_router.get("/presence", response_model=Dict[str, bool])
+async def get_presence(
+    user_ids: List[str] = Query(..., alias="user_id"),
+    current_user: User = Depends(get_current_active_user)
+):
+    if len(user_ids) > MAX_PRESENCE_USERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_PRESENCE_USERS} users per request"
+        )
+    return presence.snapshot(user_ids)
+
+# Most messages a reconnecting client is replayed; beyond that it refetches
+MAX_REPLAY = 500
+
+room_history = RoomHistory(per_room=int(os.environ.get("CHAT_REPLAY_BUFFER", "200")))
+delivery_marks = DeliveryMarks()
+
+def after_message(room: str, anchor: dict) -> dict:
+    """Filter for the messages of ``room`` after ``anchor``."""
+    return {
+        "conversation_id": room,
+        "$or": [
+            {"created_at": {"$gt": anchor["created_at"]}},
+            {"created_at": anchor["created_at"], "id": {"$gt": anchor["id"]}}
+        ]
+    }
+
+async def find_message(room: str, message_id: str) -> Optional[dict]:
+    """``id`` and ``created_at`` of a message, from the replay buffer if possible."""
+    message = room_history.find(room, message_id)
+    if message is not None:
+        # Mongo stores milliseconds; match what a query would see
+        created_at = message["created_at"]
+        return {"id": message_id, "created_at": created_at.replace(microsecond=created_at.microsecond // 1000 * 1000)}
+    return await db.messages.find_one(
+        {"id": message_id, "conversation_id": room}, {"_id": 0, "id": 1, "created_at": 1}
+    )
+
+async def missed_messages(room: str, last_seen_id: str) -> Optional[List[dict]]:
+    """Messages after ``last_seen_id``, oldest first, or ``None`` to resync.
+
+    Recent gaps are served from the in-memory ring buffer when a count of
+    the gap shows it holds all of it; the buffer misses messages other
+    workers stored. Otherwise an indexed range query starting at the last
+    seen message fetches them.
+    """
+    anchor = await find_message(room, last_seen_id)
+    if anchor is None:
+        return None
+    query = after_message(room, anchor)
+    
+    buffered = room_history.since(room, last_seen_id)
+    if buffered is not None and len(buffered) <= MAX_REPLAY:
+        # Every buffered message is stored after the anchor, so equal
+        # counts mean the buffer is the whole gap
+        stored = await db.messages.count_documents(query, limit=len(buffered) + 1)
+        if stored == len(buffered):
+            return buffered
+    
+    missed = await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", 1), ("id", 1)]
+    ).limit(MAX_REPLAY + 1).to_list(MAX_REPLAY + 1)
+    if len(missed) > MAX_REPLAY:
+        return None
+    return [Message(**message).dict() for message in missed]
+
 @sio.event
 async def connect(sid, environ, auth):
-    print(f"Client {sid} connected")
+    # Authenticate once per connection; later events trust the session
+    token = auth.get("token") if isinstance(auth, dict) else None
+    user = await user_from_token(token) if token else None
+    if token and (user is None or not user.get("is_active", True)):
+        raise socketio.exceptions.ConnectionRefusedError("Invalid credentials")
+    if user:
+        await sio.save_session(sid, {"user_id": user["id"], "rooms": set()})
+        # Personal room for direct notifications
+        await sio.enter_room(sid, user_room(user["id"]))
+        presence.connect(sid, user["id"])
+    logger.debug("Client %s connected", sid)
 
 @sio.event
 async def disconnect(sid):
-    print(f"Client {sid} disconnected")
+    presence.disconnect(sid)
+    message_throttle.forget(sid)
+    ephemeral_throttle.forget(sid)
+    logger.debug("Client %s disconnected", sid)
+
+@sio.event
+async def heartbeat(sid, data=None):
+    """Keep this connection counted as online; sent by clients every ~30s."""
+    if ephemeral_throttle.allow("heartbeat", sid):
+        session = await sio.get_session(sid)
+        presence.heartbeat(sid, session.get("user_id"))
+
+@sio.event
+async def watch_presence(sid, data):
+    """Subscribe to presence changes of ``user_ids``.
+
+    The ack carries their current state; later changes arrive in batched
+    ``presence`` events of the form ``{"users": {user_id: online}}``.
+    """
+    user_ids = data.get("user_ids") if isinstance(data, dict) else None
+    if not isinstance(user_ids, list) or len(user_ids) > MAX_PRESENCE_USERS:
+        return {"error": f"user_ids must be a list of at most {MAX_PRESENCE_USERS}"}
+    if not ephemeral_throttle.allow("watch_presence", sid):
+        return {"error": "Rate limited"}
+    session = await sio.get_session(sid)
+    if not session.get("user_id"):
+        return {"error": "Not authenticated"}
+    for user_id in user_ids:
+        await sio.enter_room(sid, presence_room(user_id))
+    return {"users": presence.snapshot(user_ids)}
+
+@sio.event
+async def unwatch_presence(sid, data):
+    user_ids = data.get("user_ids") if isinstance(data, dict) else None
+    if not isinstance(user_ids, list):
+        return {"error": "user_ids must be a list"}
+    for user_id in user_ids[:MAX_PRESENCE_USERS]:
+        await sio.leave_room(sid, presence_room(user_id))
 
 @sio.event
 async def join_room(sid, data):
-    room = data.get("room")
+    """Join a conversation room, optionally resuming after a reconnect.
+
+    With ``last_seen_id`` (or ``resume: true`` to use the last message
+    this user acknowledged) the ack carries the ``missed`` messages.
+    ``resync: true`` means the gap is too large or too old to replay,
+    and the client should refetch the history over HTTP.
+    """
+    room = data.get("room") if isinstance(data, dict) else None
+    if not isinstance(room, str):
+        return {"error": "room is required"}
+    async with sio.session(sid) as session:
+        user_id = session.get("user_id")
+        if not user_id:
+            return {"error": "Not authenticated"}
+        # Membership is checked once here and remembered for send_message
+        if room not in session["rooms"]:
+            if not await is_conversation_member(room, user_id):
+                return {"error": "Conversation not found"}
+            session["rooms"].add(room)
     await sio.enter_room(sid, room)
-    print(f"Client {sid} joined room {room}")
+    logger.debug("Client %s joined room %s", sid, room)
+    
+    last_seen_id = data.get("last_seen_id")
+    if not isinstance(last_seen_id, str):
+        last_seen_id = None
+    if not last_seen_id and data.get("resume"):
+        last_seen_id = delivery_marks.get(user_id, room)
+    if not last_seen_id:
+        return {"ok": True}
+    missed = await missed_messages(room, last_seen_id)
+    if missed is None:
+        return {"ok": True, "resync": True}
+    return {"ok": True, "missed": missed}
+
+@sio.event
+async def message_ack(sid, data):
+    """Record the newest message a client has received in a room."""
+    room, message_id = (data.get("room"), data.get("message_id")) if isinstance(data, dict) else (None, None)
+    if not isinstance(room, str) or not isinstance(message_id, str):
+        return {"error": "room and message_id are required"}
+    session = await sio.get_session(sid)
+    if session.get("user_id") and room in session.get("rooms", ()):
+        # Acks can arrive late or out of order; the mark only moves forward
+        message = await find_message(room, message_id)
+        if message is not None:
+            delivery_marks.advance(session["user_id"], room, message_id, message["created_at"])
 
 @sio.event
 async def leave_room(sid, data):
-    room = data.get("room")
+    room = data.get("room") if isinstance(data, dict) else None
+    if not isinstance(room, str):
+        return {"error": "room is required"}
+    async with sio.session(sid) as session:
+        session.get("rooms", set()).discard(room)
     await sio.leave_room(sid, room)
-    print(f"Client {sid} left room {room}")
+    logger.debug("Client %s left room %s", sid, room)
 
 @sio.event
 async def send_message(sid, data):
+    """Persist a chat message, broadcast it to the room and ack the sender.
+
+    The ack carries the stored ``id`` and ``created_at`` on success, or an
+    ``error`` string. Only rooms joined through ``join_room`` are accepted.
+    """
+    if not isinstance(data, dict):
+        return {"error": "Message content is required"}
     room = data.get("room")
-    message = data.get("message")
-    await sio.emit("receive_message", message, room=room)
+    content = data.get("content", data.get("message"))
+    if not isinstance(content, str) or not content.strip():
+        return {"error": "Message content is required"}
+    
+    session = await sio.get_session(sid)
+    user_id = session.get("user_id")
+    if not user_id:
+        return {"error": "Not authenticated"}
+    if not isinstance(room, str) or room not in session.get("rooms", ()):
+        return {"error": "Join the conversation first"}
+    if not message_throttle.allow("send_message", sid, room):
+        return {"error": "Rate limited"}
+    
+    message, payload = await store_message(room, user_id, content)
+    await broadcast_message(payload)
+    return {"id": message.id, "created_at": payload["created_at"]}
+
+@sio.event
+async def typing(sid, data):
+    """Typing indicator; relayed as at most one ``typing`` event per room per window.
+
+    The relayed event is ``{"room": ..., "users": {user_id: is_typing}}``.
+    """
+    room = data.get("room") if isinstance(data, dict) else None
+    session = await sio.get_session(sid)
+    if room not in session.get("rooms", ()):
+        return
+    if ephemeral_throttle.allow("typing", sid):
+        typing_events.add("typing", room, session["user_id"], bool(data.get("typing", True)))
+
+# ================================
+# BACKGROUND JOBS
+# ================================
+
+rollups = Rollups(
+    get_db=lambda: db,
+    flush_interval=float(os.environ.get("ANALYTICS_FLUSH_INTERVAL", "1"))
+)
+
+session_scheduler = SessionScheduler(get_db=lambda: db, notify=notify_user)
+cascade_cleanup = CascadeCleanup(
+    get_db=lambda: db,
+    publish=invalidation.publish,
+    batch_size=int(os.environ.get("CLEANUP_BATCH_SIZE", "500")),
+    batch_pause=float(os.environ.get("CLEANUP_BATCH_PAUSE", "0.05"))
+)
+message_archiver = MessageArchiver(
+    get_db=lambda: db,
+    get_read_db=lambda: reader("history"),
+    max_age=timedelta(days=int(os.environ.get("MESSAGE_HOT_DAYS", "90")))
+)
 
 # Include router
 app.include_router(api_router)
@@ -605,9 +2076,126 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def create_indexes():
+    await db.users.create_index("email", unique=True)
+    await db.users.create_index("id", unique=True)
+    await db.profiles.create_index("user_id", unique=True)
+    await db.users.create_index([("role", 1), ("is_verified", 1), ("created_at", 1)])
+    await db.users.create_index([("role", 1), ("created_at", 1)])
+    await db.schedules.create_index("id", unique=True)
+    await db.schedules.create_index([("mentor_id", 1), ("start_time", 1)])
+    await db.schedules.create_index([("seeker_id", 1), ("start_time", 1)])
+    await db.schedules.create_index([("status", 1), ("start_time", 1)])
+    await db.conversations.create_index("id", unique=True)
+    await db.conversations.create_index("members")
+    await db.conversations.create_index("former_members", sparse=True)
+    # Also serves message archival, which walks old messages in this order
+    await db.messages.create_index([("conversation_id", 1), ("created_at", 1), ("id", 1)])
+    await db.messages.create_index("created_at")
+    await db.messages.create_index("id", unique=True)
+    # A collection holds a single text index. content_text, briefly used
+    # instead, let a search read every conversation's postings
+    if "content_text" in await db.messages.index_information():
+        await db.messages.drop_index("content_text")
+    await db.messages.create_index(
+        [("conversation_id", 1), ("content", "text")], name="conversation_text"
+    )
+    await db.message_archive.create_index("id", unique=True)
+    await db.leases.create_index("id", unique=True)
+    await db.attachments.create_index("id", unique=True)
+    await db.attachments.create_index([("status", 1), ("updated_at", 1)])
+    await db.message_archive.create_index([("conversation_id", 1), ("last_created_at", 1)])
+    await db.cleanup_jobs.create_index([("status", 1), ("created_at", 1)])
+    await db.invalidation_outbox.create_index("created_at", expireAfterSeconds=3600)
+    await db.avatar_jobs.create_index([("status", 1), ("created_at", 1)])
+    await db.analytics_rollups.create_index(
+        [("metric", 1), ("granularity", 1), ("bucket", 1), ("key", 1)], unique=True
+    )
+    await db.avatar_jobs.create_index([("user_id", 1), ("created_at", -1)])
+
+# ================================
+# STARTUP AND HEALTH
+# ================================
+
+startup_state = {"ready": False, "started_at": None, "warm_up_seconds": None}
+warm_up_task: Optional[asyncio.Task] = None
+
+def warm_imports():
+    password_context().handler().get_backend()
+    from jose import jwt  # noqa: F401
+    from fuzzywuzzy import fuzz  # noqa: F401
+
+async def warm_room_history(window: timedelta = timedelta(hours=1)):
+    """Preload the replay buffers with the last hour of chat traffic."""
+    recent = db.messages.find(
+        {"created_at": {"$gte": datetime.utcnow() - window}}, {"_id": 0}
+    ).sort([("created_at", 1), ("id", 1)]).limit(room_history.per_room * 100)
+    async for message in recent:
+        room_history.append(message["conversation_id"], Message(**message).dict())
+
+async def warm_up():
+    """Create indexes and warm caches, retrying until the database answers."""
+    while True:
+        try:
+            await create_indexes()
+            await run_in_threadpool(warm_imports)
+            await warm_room_history()
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Warm-up failed; retrying")
+            await asyncio.sleep(5)
+    startup_state["ready"] = True
+    startup_state["warm_up_seconds"] = round(time.perf_counter() - startup_state["started_at"], 3)
+    logger.info("Ready after %.3fs warm-up", startup_state["warm_up_seconds"])
+
+async def start_up():
+    global db, warm_up_task
+    if db is None:
+        db = database.db
+    startup_state["started_at"] = time.perf_counter()
+    # Serve liveness straight away; /readyz reports ready once warm-up is done
+    warm_up_task = asyncio.create_task(warm_up())
+    session_scheduler.start()
+    cascade_cleanup.start()
+    message_archiver.start()
+    attachment_service.start()
+    avatar_pipeline.start()
+    rollups.start()
+    invalidation.start()
+    presence.start()
+    typing_events.start()
+
+async def shut_down():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await session_scheduler.stop()
+    await cascade_cleanup.stop()
+    await message_archiver.stop()
+    await attachment_service.stop()
+    await avatar_pipeline.stop()
+    await rollups.stop()
+    await invalidation.stop()
+    await presence.stop()
+    await typing_events.stop()
+    database.close()
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    if not startup_state["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "starting"}
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=2)
+    except Exception:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "database unavailable"}
+    return {"status": "ready", "warm_up_seconds": startup_state["warm_up_seconds"]}
 
 # For uvicorn to run socket.io
 if __name__ == "__main__":
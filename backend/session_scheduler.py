@@ -0,0 +1,234 @@
+"""
+Background lifecycle transitions for mentoring sessions.
+
+Upcoming schedule boundaries (reminder, start and end) are kept in an
+in-process min-heap ordered by time. A single task sleeps until the
+earliest boundary is due, then applies every due transition with one
+``update_many`` per transition kind and sends reminders to both parties.
+
+Boundaries are loaded one lookahead window at a time with an indexed
+range query on ``(status, start_time)``. Only sessions that are still
+active and not over before the previous window ended are read, so the
+whole collection is never swept. New bookings inside the loaded window
+are pushed straight onto the heap via ``track()``.
+
+Transitions:
+
+- start: ``confirmed`` -> ``in_progress``
+- end:   ``confirmed`` / ``in_progress`` -> ``completed``
+- end:   ``scheduled`` (never confirmed) -> ``no_show``
+
+``untrack()`` drops a cancelled or deleted session's entries. They are
+skipped when popped, and the heap is compacted once they make up half of
+it. Writes that bypass ``untrack()`` are still safe: the status filter on
+each ``update_many`` turns their stale entries into no-ops.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACKED_STATUSES = ["scheduled", "confirmed", "in_progress"]
+
+REMIND = "remind"
+START = "start"
+END = "end"
+
+
+class SessionScheduler:
+    def __init__(
+        self,
+        get_db: Callable[[], object],
+        notify: Callable[[str, str, dict], Awaitable[None]],
+        lookahead: timedelta = timedelta(hours=6),
+        reminder_lead: timedelta = timedelta(minutes=15),
+    ):
+        self._get_db = get_db
+        self._notify = notify
+        self.lookahead = lookahead
+        self.reminder_lead = reminder_lead
+        # (when, seq, kind, schedule doc)
+        self._heap: List[Tuple[datetime, int, str, dict]] = []
+        # (kind, schedule id) -> seq of its live heap entry; any other
+        # entry for the key is stale
+        self._keys: Dict[Tuple[str, str], int] = {}
+        self._stale = 0
+        self._seq = itertools.count()
+        self._loaded_until: Optional[datetime] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            # Created here so the event binds to the running loop
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._heap.clear()
+        self._keys.clear()
+        self._stale = 0
+        self._loaded_until = None
+
+    def track(self, schedule: dict):
+        """Register a newly booked session if its boundaries fall in the loaded window.
+
+        Never raises: the booking is already stored, and a session missed
+        here still gets its transitions from the status filter once it is
+        reloaded after a restart.
+        """
+        if self._loaded_until is None:
+            return
+        try:
+            earliest = self._heap[0][0] if self._heap else None
+            self._push_boundaries(schedule, None, self._loaded_until, datetime.utcnow())
+        except Exception:
+            logger.exception("Could not track schedule %s", schedule.get("id"))
+            return
+        if self._wakeup and self._heap and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    def untrack(self, schedule_id: str):
+        """Forget a session's pending boundaries, e.g. once it is cancelled."""
+        for kind in (REMIND, START, END):
+            if self._keys.pop((kind, schedule_id), None) is not None:
+                self._stale += 1
+        if self._stale > len(self._heap) // 2:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [
+            entry for entry in self._heap
+            if self._keys.get((entry[2], entry[3]["id"])) == entry[1]
+        ]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    def _push_boundaries(self, schedule: dict, lower: Optional[datetime], upper: datetime, now: datetime):
+        boundaries = (
+            (REMIND, schedule["start_time"] - self.reminder_lead),
+            (START, schedule["start_time"]),
+            (END, schedule["end_time"]),
+        )
+        for kind, when in boundaries:
+            if when >= upper or (lower is not None and when < lower):
+                continue
+            # Reminders for sessions that have already started are pointless
+            if kind == REMIND and schedule["start_time"] <= now:
+                continue
+            key = (kind, schedule["id"])
+            if key in self._keys:
+                continue
+            seq = next(self._seq)
+            self._keys[key] = seq
+            heapq.heappush(self._heap, (when, seq, kind, schedule))
+
+    async def _load_window(self, until: datetime, now: datetime):
+        db = self._get_db()
+        # The first load has no lower bound, so overdue sessions left over
+        # from downtime become due immediately and are caught up in one batch.
+        # Later loads skip sessions that ended before the previous window did,
+        # as all their boundaries were loaded then
+        lower = self._loaded_until
+        query = {
+            "status": {"$in": TRACKED_STATUSES},
+            "start_time": {"$lt": until + self.reminder_lead},
+        }
+        if lower is not None:
+            query["end_time"] = {"$gte": lower}
+        cursor = db.schedules.find(
+            query,
+            {"_id": 0, "id": 1, "mentor_id": 1, "seeker_id": 1, "title": 1,
+             "start_time": 1, "end_time": 1},
+        )
+        async for schedule in cursor:
+            self._push_boundaries(schedule, lower, until, now)
+        self._loaded_until = until
+
+    def _pop_due(self, now: datetime) -> Dict[str, List[dict]]:
+        due: Dict[str, List[dict]] = {REMIND: [], START: [], END: []}
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, kind, schedule = heapq.heappop(self._heap)
+            key = (kind, schedule["id"])
+            if self._keys.get(key) != seq:
+                self._stale -= 1
+                continue
+            del self._keys[key]
+            due[kind].append(schedule)
+        return due
+
+    async def _apply(self, due: Dict[str, List[dict]], now: datetime):
+        db = self._get_db()
+
+        async def transition(schedules, from_statuses, to_status):
+            if not schedules:
+                return
+            await db.schedules.update_many(
+                {"id": {"$in": [s["id"] for s in schedules]}, "status": {"$in": from_statuses}},
+                {"$set": {"status": to_status, "updated_at": now}, "$inc": {"version": 1}},
+            )
+
+        await transition(due[START], ["confirmed"], "in_progress")
+        await transition(due[END], ["confirmed", "in_progress"], "completed")
+        await transition(due[END], ["scheduled"], "no_show")
+
+        if due[REMIND]:
+            # Skip sessions cancelled since they were loaded
+            live = await db.schedules.find(
+                {"id": {"$in": [s["id"] for s in due[REMIND]]}, "status": {"$in": TRACKED_STATUSES}},
+                {"_id": 0, "id": 1},
+            ).to_list(None)
+            live_ids = {s["id"] for s in live}
+            for schedule in due[REMIND]:
+                if schedule["id"] not in live_ids:
+                    continue
+                payload = {
+                    "schedule_id": schedule["id"],
+                    "title": schedule.get("title", ""),
+                    "start_time": schedule["start_time"].isoformat(),
+                }
+                await self._notify(schedule["mentor_id"], "session_reminder", payload)
+                await self._notify(schedule["seeker_id"], "session_reminder", payload)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Load the next window if needed and apply due boundaries.
+
+        Returns the time of the next wake-up.
+        """
+        now = now or datetime.utcnow()
+        if self._loaded_until is None or self._loaded_until - now < self.lookahead / 2:
+            await self._load_window(now + self.lookahead, now)
+        due = self._pop_due(now)
+        if any(due.values()):
+            await self._apply(due, now)
+        next_reload = self._loaded_until - self.lookahead / 2
+        if self._heap:
+            return min(self._heap[0][0], next_reload)
+        return next_reload
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                next_wake = await self.run_once()
+                delay = (next_wake - datetime.utcnow()).total_seconds()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Session scheduler iteration failed")
+                delay = 30
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
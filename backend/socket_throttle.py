@@ -0,0 +1,143 @@
+"""
+Rate limiting and coalescing for inbound Socket.IO events.
+
+``EventThrottle`` applies token buckets per connection and per room.
+Chat messages must pass both: one client cannot flood a room, and many
+clients together cannot push a room past its budget. Buckets are kept in
+bounded LRU maps, so idle sids and rooms are eventually forgotten.
+
+``EphemeralCoalescer`` handles state that only matters in its latest
+form, such as typing indicators. Updates are merged per room and flushed
+as at most one emit per room per ``window``. A burst of keystrokes from
+any number of members therefore costs one fan-out per window rather than
+one per event.
+
+Both count what they dropped or merged, per event name.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class EventThrottle:
+    def __init__(
+        self,
+        sid_rate: float = 5.0,
+        sid_burst: float = 10.0,
+        room_rate: float = 20.0,
+        room_burst: float = 40.0,
+        max_keys: int = 100000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.sid_rate = sid_rate
+        self.sid_burst = sid_burst
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._sids: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._rooms: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.dropped: Counter = Counter()
+
+    def _bucket(self, buckets: OrderedDict, key: str, rate: float, burst: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, event: str, sid: str, room: Optional[str] = None) -> bool:
+        """Spend one token from the sid's bucket and, if given, the room's."""
+        now = self._clock()
+        sid_bucket = self._bucket(self._sids, sid, self.sid_rate, self.sid_burst, now)
+        if not sid_bucket.take(now):
+            self.dropped[event] += 1
+            return False
+        if room is not None:
+            room_bucket = self._bucket(self._rooms, room, self.room_rate, self.room_burst, now)
+            if not room_bucket.take(now):
+                # Refund the sid so a busy room doesn't also penalise the client
+                sid_bucket.tokens = min(sid_bucket.burst, sid_bucket.tokens + 1)
+                self.dropped[event] += 1
+                return False
+        return True
+
+    def forget(self, sid: str):
+        self._sids.pop(sid, None)
+
+
+class EphemeralCoalescer:
+    def __init__(
+        self,
+        emit: Callable[[str, dict, str], Awaitable[None]],
+        window: float = 1.0,
+    ):
+        self._emit = emit
+        self.window = window
+        # (event, room) -> {key: latest value}
+        self._pending: Dict[tuple, dict] = {}
+        self.coalesced: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add(self, event: str, room: str, key: str, value):
+        """Record the latest ``value`` of ``key``; earlier ones in the window are merged."""
+        updates = self._pending.setdefault((event, room), {})
+        if updates:
+            self.coalesced[event] += 1
+        updates[key] = value
+
+    async def flush(self) -> int:
+        """Emit one event per room with pending updates. Returns the emit count."""
+        pending, self._pending = self._pending, {}
+        for (event, room), updates in pending.items():
+            await self._emit(event, {"room": room, "users": updates}, room)
+        return len(pending)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ephemeral event flush failed")
+
@@ -0,0 +1,63 @@
+"""
+Packet serializers for Socket.IO traffic.
+
+Handlers emit plain dicts that may contain ``datetime`` values. The
+packet class turns them into wire format once per emit. The manager
+reuses that encoding for every recipient in the room, so payloads
+should not be pre-encoded per message.
+
+- ``json`` (default): text packets. Datetimes become ISO 8601 strings,
+  exactly as ``jsonable_encoder`` would produce them.
+- ``msgpack``: binary packets. Datetimes use the standard MessagePack
+  timestamp extension (type -1, 6 bytes for whole seconds). Clients
+  need a msgpack parser such as ``socket.io-msgpack-parser``.
+
+The choice is made with ``SOCKET_SERIALIZER``. Server and clients must
+agree on it.
+"""
+import json
+from datetime import datetime, timezone
+
+from socketio import packet
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _DatetimeJSON:
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return json.dumps(obj, default=_json_default, **kwargs)
+
+    loads = staticmethod(json.loads)
+
+
+class JSONPacket(packet.Packet):
+    json = _DatetimeJSON
+
+
+def packet_class(serializer: str):
+    """The Socket.IO packet class for ``serializer`` (``json`` or ``msgpack``)."""
+    if serializer == "json":
+        return JSONPacket
+    if serializer == "msgpack":
+        # Imported lazily: msgpack is only needed when it is selected
+        import msgpack
+        from socketio.msgpack_packet import MsgPackPacket
+
+        def default(value):
+            if isinstance(value, datetime):
+                if value.tzinfo is not None:
+                    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+                # Naive datetimes in this app are UTC
+                delta = value - EPOCH
+                return msgpack.Timestamp(delta.days * 86400 + delta.seconds, delta.microseconds * 1000)
+            raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+        return MsgPackPacket.configure(dumps_default=default)
+    raise ValueError(f"Unknown socket serializer: {serializer!r}")
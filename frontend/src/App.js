@@ -1,4 +1,4 @@
-import React, { useState, useEffect, createContext, useContext } from 'react';
+import React, { useState, useEffect, useRef, createContext, useContext } from 'react';
 import { BrowserRouter as Router, Routes, Route, Navigate, Link } from 'react-router-dom';
 import axios from 'axios';
 import { io } from 'socket.io-client';
@@ -578,33 +578,134 @@ const ChatPage = () => {
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState('');
   const [socket, setSocket] = useState(null);
+  const [typingUsers, setTypingUsers] = useState({});
   const { user } = useAuth();
 
   useEffect(() => {
     fetchConversations();
     
-    // Initialize socket
-    const newSocket = io(BACKEND_URL);
+    // Initialize socket; the token authenticates the whole connection
+    const newSocket = io(BACKEND_URL, {
+      auth: { token: localStorage.getItem('token') }
+    });
     setSocket(newSocket);
 
-    return () => newSocket.close();
+    // Keeps this connection counted as online
+    const heartbeat = setInterval(() => newSocket.emit('heartbeat'), 30000);
+
+    return () => {
+      clearInterval(heartbeat);
+      newSocket.close();
+    };
   }, []);
 
+  const [online, setOnline] = useState({});
+  useEffect(() => {
+    if (!socket || !conversations.length) return;
+    const userIds = [...new Set(conversations.flatMap(c => c.members || []))]
+      .filter(id => id !== user?.id);
+
+    // Current state comes with the ack; changes arrive in batches
+    const watch = async () => {
+      const ack = await socket.emitWithAck('watch_presence', { user_ids: userIds });
+      if (ack?.users) setOnline(prev => ({ ...prev, ...ack.users }));
+    };
+    if (socket.connected) watch();
+    socket.on('connect', watch);
+    socket.on('presence', ({ users }) => setOnline(prev => ({ ...prev, ...users })));
+
+    return () => {
+      socket.emit('unwatch_presence', { user_ids: userIds });
+      socket.off('connect', watch);
+      socket.off('presence');
+    };
+  }, [socket, conversations]);
+
+  const isPartnerOnline = (conversation) =>
+    (conversation.members || []).some(id => id !== user?.id && online[id]);
+
+  const messagesRef = useRef([]);
+  useEffect(() => {
+    messagesRef.current = messages;
+  }, [messages]);
+
+  const appendMessages = (incoming) => {
+    setMessages(prev => {
+      const seen = new Set(prev.map(m => m.id));
+      return [...prev, ...incoming.filter(m => !seen.has(m.id))];
+    });
+  };
+
   useEffect(() => {
     if (socket && selectedConversation) {
-      socket.emit('join_room', { room: selectedConversation.id });
-      
+      const room = selectedConversation.id;
+
+      // (Re)join the room; after a reconnect the server replays only what we missed
+      const join = async () => {
+        const current = messagesRef.current;
+        const last = current[current.length - 1];
+        const ack = await socket.emitWithAck('join_room', {
+          room,
+          last_seen_id: last?.conversation_id === room ? last.id : undefined
+        });
+        if (ack?.resync) {
+          fetchMessages(room);
+        } else if (ack?.missed?.length) {
+          appendMessages(ack.missed);
+        }
+      };
+      if (socket.connected) join();
+      socket.on('connect', join);
+
       socket.on('receive_message', (message) => {
-        setMessages(prev => [...prev, message]);
+        appendMessages([message]);
+        socket.emit('message_ack', { room, message_id: message.id });
+      });
+
+      // Batched by the server: at most one update per room per second
+      socket.on('typing', ({ room: typingRoom, users }) => {
+        if (typingRoom !== room) return;
+        setTypingUsers(prev => {
+          const next = { ...prev };
+          Object.entries(users).forEach(([id, isTyping]) => {
+            if (id === user.id) return;
+            if (isTyping) next[id] = Date.now();
+            else delete next[id];
+          });
+          return next;
+        });
       });
 
       return () => {
-        socket.emit('leave_room', { room: selectedConversation.id });
+        socket.emit('leave_room', { room });
+        socket.off('connect', join);
         socket.off('receive_message');
+        socket.off('typing');
+        setTypingUsers({});
       };
     }
   }, [socket, selectedConversation]);
 
+  useEffect(() => {
+    // Typing indicators lapse when the updates stop
+    const timer = setInterval(() => {
+      setTypingUsers(prev => {
+        const fresh = Object.entries(prev).filter(([, at]) => Date.now() - at < 4000);
+        return fresh.length === Object.keys(prev).length ? prev : Object.fromEntries(fresh);
+      });
+    }, 1000);
+    return () => clearInterval(timer);
+  }, []);
+
+  const lastTypingSent = useRef(0);
+  const handleMessageChange = (e) => {
+    setNewMessage(e.target.value);
+    if (socket && selectedConversation && Date.now() - lastTypingSent.current > 2000) {
+      lastTypingSent.current = Date.now();
+      socket.emit('typing', { room: selectedConversation.id, typing: true });
+    }
+  };
+
   const fetchConversations = async () => {
     try {
       const response = await axios.get(`${API}/conversations`);
@@ -633,10 +734,21 @@ const ChatPage = () => {
     if (!newMessage.trim() || !selectedConversation) return;
 
     try {
-      await axios.post(`${API}/messages`, {
-        conversation_id: selectedConversation.id,
-        content: newMessage
-      });
+      if (socket && socket.connected) {
+        // Persisted and broadcast by the server; the ack carries the stored id
+        const ack = await socket.emitWithAck('send_message', {
+          room: selectedConversation.id,
+          content: newMessage
+        });
+        if (ack?.error) throw new Error(ack.error);
+        lastTypingSent.current = 0;
+        socket.emit('typing', { room: selectedConversation.id, typing: false });
+      } else {
+        await axios.post(`${API}/messages`, {
+          conversation_id: selectedConversation.id,
+          content: newMessage
+        });
+      }
       setNewMessage('');
     } catch (error) {
       console.error('Error sending message:', error);
@@ -661,8 +773,11 @@ const ChatPage = () => {
                     : 'bg-gray-700 text-gray-300 hover:bg-gray-600'
                 }`}
               >
-                <div className="font-medium">
+                <div className="font-medium flex items-center gap-2">
                   Conversation {conversation.id.slice(-8)}
+                  {isPartnerOnline(conversation) && (
+                    <span className="w-2 h-2 rounded-full bg-green-400" title="Online" />
+                  )}
                 </div>
                 <div className="text-sm opacity-75">
                   {new Date(conversation.updated_at).toLocaleDateString()}
@@ -682,6 +797,9 @@ const ChatPage = () => {
               <h3 className="text-lg font-medium text-white">
                 Chat - {selectedConversation.id.slice(-8)}
               </h3>
+              {Object.keys(typingUsers).length > 0 && (
+                <p className="text-sm text-gray-400">typing...</p>
+              )}
             </div>
 
             {/* Messages */}
@@ -715,7 +833,7 @@ const ChatPage = () => {
                 <input
                   type="text"
                   value={newMessage}
-                  onChange={(e) => setNewMessage(e.target.value)}
+                  onChange={handleMessageChange}
                   placeholder="Type your message..."
                   className="flex-1 px-3 py-2 border border-gray-700 rounded-md bg-gray-700 text-white placeholder-gray-400 focus:outline-none focus:ring-2 focus:ring-indigo-500"
                 />
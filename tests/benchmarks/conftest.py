@@ -0,0 +1,88 @@
+"""
+Micro-benchmarks for backend hot paths, compared against JSON baselines.
+
+They time wall-clock work, so they are opt-in: without ``BENCH=1`` every
+benchmark is skipped and a plain ``pytest`` run stays deterministic. Run
+them on a quiet machine with ``BENCH=1 pytest tests/benchmarks``.
+
+Each benchmark times a callable over several rounds and keeps the best
+per-call time, the figure least disturbed by noise. Results are compared
+with ``baselines.json``. The comparison is scaled by a calibration loop
+timed on both machines, so a baseline recorded on a faster or slower box
+still applies. A benchmark fails if it is more than ``BENCH_THRESHOLD``
+slower than its baseline (default 0.5, i.e. 50%).
+
+``BENCH_UPDATE=1`` writes the results of the run back as the new
+baselines. Benchmarks without a baseline are recorded but never fail.
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+BASELINES = Path(__file__).with_name("baselines.json")
+
+
+def calibrate(rounds: int = 5) -> float:
+    """Best time of a fixed pure-Python workload, the unit baselines scale by."""
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        json.loads(json.dumps([{"i": i, "s": str(i) * 3} for i in range(20000)]))
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+@pytest.fixture(scope="session")
+def bench_session():
+    if not os.environ.get("BENCH"):
+        pytest.skip("benchmarks run only with BENCH=1")
+    stored = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    session = {
+        "calibration": calibrate(),
+        "baseline_calibration": stored.get("calibration"),
+        "baselines": stored.get("results", {}),
+        "results": {},
+    }
+    yield session
+    if os.environ.get("BENCH_UPDATE") and session["results"]:
+        BASELINES.write_text(json.dumps({
+            "calibration": session["calibration"],
+            "results": {**session["baselines"], **session["results"]},
+        }, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture
+def benchmark(bench_session):
+    """``await benchmark(name, fn, iterations, rounds)`` times async ``fn``.
+
+    Returns the best seconds per call and fails on a regression.
+    """
+    threshold = float(os.environ.get("BENCH_THRESHOLD", "0.5"))
+
+    async def run(name, fn, iterations=20, rounds=5):
+        await fn()  # warm-up
+        best = float("inf")
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                await fn()
+            best = min(best, (time.perf_counter() - started) / iterations)
+        bench_session["results"][name] = best
+
+        baseline = bench_session["baselines"].get(name)
+        if baseline is None or not bench_session["baseline_calibration"]:
+            print(f"\n{name}: {best * 1e6:.1f} us (no baseline)")
+            return best
+        expected = baseline * bench_session["calibration"] / bench_session["baseline_calibration"]
+        print(f"\n{name}: {best * 1e6:.1f} us (expected {expected * 1e6:.1f} us)")
+        if best > expected * (1 + threshold):
+            pytest.fail(
+                f"{name} regressed: {best * 1e6:.1f} us per call, "
+                f"expected at most {expected * (1 + threshold) * 1e6:.1f} us"
+            )
+        return best
+
+    return run
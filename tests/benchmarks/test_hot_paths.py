@@ -0,0 +1,146 @@
+import itertools
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.security import HTTPAuthorizationCredentials
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def mentor_text(i):
+    return f"Mentor {i} Engineer with {i % 15} years in Python, React and distributed systems {i % 97}"
+
+
+async def seed_mentors(db, count):
+    users, profiles = [], []
+    for i in range(count):
+        user_id = str(uuid.uuid4())
+        users.append({
+            "id": user_id, "email": f"mentor{i}@example.com", "name": f"Mentor {i}",
+            "role": "mentor", "is_verified": True, "is_active": True, "hashed_password": "",
+            "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(),
+        })
+        profiles.append({
+            "id": str(uuid.uuid4()), "user_id": user_id, "bio": mentor_text(i),
+            "skills": ["Python", "React"], "experience_years": i % 15, "hourly_rate": 50.0,
+            "available": True, "avatar_url": "", "version": 0,
+            "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(),
+        })
+    await db.users.insert_many(users)
+    await db.profiles.insert_many(profiles)
+
+
+async def test_create_access_token(benchmark):
+    async def create():
+        server.create_access_token({"sub": "someone@example.com"}, timedelta(minutes=30))
+
+    await benchmark("create_access_token", create, iterations=200)
+
+
+async def test_get_current_user(benchmark, make_user):
+    _, headers = await make_user()
+    credentials = HTTPAuthorizationCredentials(
+        scheme="Bearer", credentials=headers["Authorization"].split()[1]
+    )
+
+    async def resolve():
+        await server.get_current_user(credentials)
+
+    await benchmark("get_current_user", resolve, iterations=50)
+
+
+async def test_users_me_request(benchmark, client, make_user):
+    _, headers = await make_user()
+
+    async def fetch():
+        assert (await client.get("/api/users/me", headers=headers)).status_code == 200
+
+    await benchmark("users_me_request", fetch, iterations=20)
+
+
+@pytest.mark.parametrize("count", [1000, 10000, 100000])
+async def test_fuzzy_scoring(benchmark, count):
+    texts = [mentor_text(i).lower() for i in range(count)]
+
+    async def score_all():
+        for text in texts:
+            server.fuzzy_score("python", text)
+
+    await benchmark(f"fuzzy_scoring_{count}", score_all, iterations=1, rounds=3)
+
+
+async def test_search_mentors_request(benchmark, client, db, make_user):
+    await seed_mentors(db, 1000)
+    _, headers = await make_user()
+
+    async def search():
+        # Time the search itself, not the result cache
+        server.mentor_search_cache.clear()
+        response = await client.get("/api/search/mentors", params={"q": "python"}, headers=headers)
+        assert response.status_code == 200
+
+    await benchmark("search_mentors_request_1000", search, iterations=1, rounds=2)
+
+
+async def test_get_messages_request(benchmark, client, db, make_user):
+    user, headers = await make_user()
+    conversation_id = str(uuid.uuid4())
+    await db.conversations.insert_one({
+        "id": conversation_id, "members": [user["id"], "other"],
+        "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(),
+    })
+    start = datetime.utcnow() - timedelta(days=1)
+    await db.messages.insert_many([
+        {
+            "id": str(uuid.uuid4()), "conversation_id": conversation_id, "sender_id": user["id"],
+            "content": f"Message number {i} about the next session", "message_type": "text",
+            "created_at": start + timedelta(seconds=i),
+        }
+        for i in range(500)
+    ])
+
+    async def fetch():
+        response = await client.get(
+            f"/api/conversations/{conversation_id}/messages", params={"limit": 500}, headers=headers
+        )
+        assert len(response.json()) == 500
+
+    await benchmark("get_messages_request_500", fetch, iterations=3)
+
+
+async def test_create_schedule_request(benchmark, client, db, make_user):
+    mentor, _ = await make_user("mentor", is_verified=True)
+    _, headers = await make_user()
+    start = datetime(2030, 1, 1, 9)
+    await db.schedules.insert_many([
+        {
+            "id": str(uuid.uuid4()), "mentor_id": mentor["id"], "seeker_id": "someone",
+            "start_time": start + timedelta(hours=i), "end_time": start + timedelta(hours=i, minutes=45),
+            "status": "scheduled", "title": "Session", "description": "", "meeting_link": "",
+            "version": 0, "created_at": start, "updated_at": start,
+        }
+        for i in range(1000)
+    ])
+    free_slots = itertools.count(2000)
+
+    async def book():
+        slot = start + timedelta(hours=next(free_slots))
+        response = await client.post("/api/schedules", headers=headers, json={
+            "mentor_id": mentor["id"], "title": "Session",
+            "start_time": slot.isoformat(), "end_time": (slot + timedelta(minutes=45)).isoformat(),
+        })
+        assert response.status_code == 200
+
+    async def conflict():
+        response = await client.post("/api/schedules", headers=headers, json={
+            "mentor_id": mentor["id"], "title": "Session",
+            "start_time": (start + timedelta(hours=500)).isoformat(),
+            "end_time": (start + timedelta(hours=500, minutes=30)).isoformat(),
+        })
+        assert response.status_code == 400
+
+    await benchmark("create_schedule_request", book, iterations=5)
+    await benchmark("create_schedule_conflict_request", conflict, iterations=5)
@@ -0,0 +1,72 @@
+import asyncio
+import random
+import subprocess
+import sys
+
+import pytest
+import socketio
+
+from presence import PresenceTracker, presence_room
+from tests.test_startup import BACKEND_DIR, PROBE
+from tests.test_wire_format import message_payload, room_server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_presence_flush_10k_clients(benchmark):
+    clients, contacts, churn = 10000, 20, 1000
+    rng = random.Random(39)
+    server = socketio.AsyncServer(async_mode="asgi")
+
+    async def drop(eio_sid, pkt):
+        pass
+
+    server._send_eio_packet = drop
+
+    async def emit(event, data, rooms):
+        await server.emit(event, data, room=rooms)
+
+    tracker = PresenceTracker(emit=emit)
+    users = [f"user-{i}" for i in range(clients)]
+    for i, user_id in enumerate(users):
+        sid = await server.manager.connect(f"eio-{i}", "/")
+        for watched in rng.sample(users, contacts):
+            server.manager.basic_enter_room(sid, "/", presence_room(watched), eio_sid=f"eio-{i}")
+        tracker.connect(f"s-{i}", user_id)
+    await tracker.flush()
+    churned = rng.sample(range(clients), churn)
+
+    async def window():
+        # The churning users leave in one window and come back in the next
+        for i in churned:
+            if tracker.is_online(users[i]):
+                tracker.disconnect(f"s-{i}")
+            else:
+                tracker.connect(f"s-{i}", users[i])
+        assert await tracker.flush() == churn
+
+    await benchmark("presence_flush_10k_clients", window, iterations=2, rounds=3)
+
+
+@pytest.mark.parametrize("serializer", ["json", "msgpack"])
+async def test_broadcast_to_500(benchmark, serializer):
+    server, _ = await room_server(serializer, 500)
+    payload = message_payload()
+
+    async def broadcast():
+        await server.emit("receive_message", payload, room="room")
+
+    await benchmark(f"broadcast_{serializer}_500", broadcast, iterations=20)
+
+
+async def test_cold_start(benchmark):
+    def start():
+        subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=BACKEND_DIR,
+            capture_output=True, timeout=120, check=True,
+        )
+
+    async def cold_start():
+        await asyncio.to_thread(start)
+
+    await benchmark("cold_start", cold_start, iterations=1, rounds=3)
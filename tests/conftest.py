@@ -0,0 +1,115 @@
+"""
+Shared fixtures for the in-process backend tests.
+
+The FastAPI app is driven over ASGI with httpx, and MongoDB is replaced by
+an in-memory mongomock-motor database, so no server or network is needed.
+The test-only packages are listed in backend/requirements-dev.txt.
+"""
+import os
+import sys
+import uuid
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+import httpx  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+class FakeClock:
+    """Stands in for ``time.monotonic``; tests move ``now`` by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    # Every read route shares the fake client, as on a single-node deployment
+    server.database.use_client(AsyncMongoMockClient())
+    for cache in server.local_caches.values():
+        cache.clear()
+    database = server.database.db
+    monkeypatch.setattr(server, "db", database)
+    await server.create_indexes()
+    return database
+
+
+@pytest.fixture
+async def client(db):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+        yield http
+
+
+@pytest.fixture
+def make_user(db):
+    """Insert a user directly and return ``(user_doc, auth_headers)``.
+
+    Skips the register endpoint so tests do not pay for bcrypt.
+    """
+    async def _make_user(role="seeker", **fields):
+        user = {
+            "id": str(uuid.uuid4()),
+            "email": f"{uuid.uuid4().hex[:12]}@example.com",
+            "name": "Test User",
+            "role": role,
+            "is_verified": role != "mentor",
+            "is_active": True,
+            "hashed_password": "",
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+        }
+        user.update(fields)
+        await db.users.insert_one(dict(user))
+        token = server.create_access_token({"sub": user["email"]})
+        return user, {"Authorization": f"Bearer {token}"}
+
+    return _make_user
+
+
+@pytest.fixture
+async def open_socket(db):
+    """Connect in-process clients through the real ``connect`` handler.
+
+    Each gets a stand-in engine.io socket, which is all the Socket.IO
+    server needs to keep a session for it.
+    """
+    sids = []
+
+    async def _open_socket(headers=None):
+        eio_sid = uuid.uuid4().hex
+        server.sio.eio.sockets[eio_sid] = SimpleNamespace(session={}, closed=False)
+        sid = await server.sio.manager.connect(eio_sid, "/")
+        token = headers["Authorization"].split()[1] if headers else None
+        await server.connect(sid, {}, {"token": token})
+        sids.append((sid, eio_sid))
+        return sid
+
+    yield _open_socket
+    for sid, eio_sid in sids:
+        await server.disconnect(sid)
+        await server.sio.manager.disconnect(sid, "/")
+        server.sio.eio.sockets.pop(eio_sid, None)
@@ -0,0 +1,45 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_duplicate_email_is_rejected(client, db):
+    account = {"email": "same@example.com", "name": "First", "password": "secret"}
+    first = await client.post("/api/auth/register", json=account)
+    assert first.status_code == 200
+    assert first.json()["token_type"] == "bearer"
+
+    second = await client.post("/api/auth/register", json={**account, "name": "Second"})
+    assert second.status_code == 400
+    assert second.json()["detail"] == "Email already registered"
+    assert await db.users.count_documents({"email": "same@example.com"}) == 1
+
+
+async def test_profile_is_created_on_first_read(client, db):
+    response = await client.post("/api/auth/register", json={
+        "email": "lazy@example.com", "name": "Lazy", "password": "secret", "role": "mentor",
+    })
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    user = await db.users.find_one({"email": "lazy@example.com"})
+    assert "password" not in user
+    assert await db.profiles.count_documents({}) == 0
+
+    profile = await client.get("/api/users/me/profile", headers=headers)
+    assert profile.status_code == 200
+    assert profile.json()["user_id"] == user["id"]
+    assert profile.json()["available"] is True
+    # A second read returns the same profile instead of creating another
+    again = await client.get("/api/users/me/profile", headers=headers)
+    assert again.json()["id"] == profile.json()["id"]
+    assert await db.profiles.count_documents({"user_id": user["id"]}) == 1
+
+
+async def test_verified_mentor_without_profile_is_searchable(client, db, make_user):
+    mentor, _ = await make_user("mentor", name="Ada Lovelace", is_verified=True)
+    _, headers = await make_user()
+
+    response = await client.get("/api/search/mentors", params={"q": "ada"}, headers=headers)
+    assert response.status_code == 200
+    assert [result["user"]["id"] for result in response.json()] == [mentor["id"]]
+    # Searching does not create the profile
+    assert await db.profiles.count_documents({}) == 0
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import server
+from admission import AdmissionController, RouteClass, Shed
+
+pytestmark = pytest.mark.anyio
+
+
+def controller(**overrides):
+    classes = [
+        RouteClass("chat", limit=1, max_queue=10),
+        RouteClass("search", limit=1, max_queue=1, shed_at=2, retry_after=5),
+    ]
+    routes = {"/api/messages": "chat", "/api/search": "search"}
+    return AdmissionController(classes, routes, **overrides)
+
+
+async def test_queue_hands_off_slots_and_sheds_when_full():
+    admission = controller()
+    search = admission.classify("/api/search/mentors")
+    assert admission.classify("/healthz") is None
+
+    await admission.acquire(search)
+    queued = asyncio.ensure_future(admission.acquire(search))
+    await asyncio.sleep(0)
+    with pytest.raises(Shed) as shed:
+        await admission.acquire(search)
+    assert (shed.value.status_code, shed.value.retry_after) == (429, 5)
+
+    admission.release(search)
+    await queued
+    assert search.stats() == {
+        "limit": 1, "max_queue": 1, "active": 1, "queue_depth": 0,
+        "admitted": 2, "queued": 1, "shed": 1, "timed_out": 0,
+    }
+
+
+async def test_low_priority_routes_give_way_to_chat():
+    admission = controller(queue_timeout=0.05)
+    chat, search = admission.classes["chat"], admission.classes["search"]
+    await admission.acquire(chat)
+    backlog = [asyncio.ensure_future(admission.acquire(chat)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    # Two requests already queue for chat, so search is refused even with a free slot
+    with pytest.raises(Shed) as shed:
+        await admission.acquire(search)
+    assert shed.value.status_code == 503
+    assert search.active == 0
+
+    # Chat keeps queueing; waiters that outlast the timeout are shed
+    results = await asyncio.gather(*backlog, return_exceptions=True)
+    assert all(isinstance(result, Shed) for result in results)
+    assert chat.counters["timed_out"] == 2
+
+
+async def test_shed_response_keeps_cors_headers(client, make_user, monkeypatch):
+    _, headers = await make_user()
+    search = server.admission.classes["search"]
+    monkeypatch.setattr(search, "limit", 0)
+    monkeypatch.setattr(search, "max_queue", 0)
+
+    response = await client.get(
+        "/api/search/mentors", params={"q": "python"},
+        headers={**headers, "Origin": "http://localhost:3000"},
+    )
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "5"
+    assert "access-control-allow-origin" in response.headers
+
+    assert (await client.get("/api/users/me", headers=headers)).status_code == 200
@@ -0,0 +1,167 @@
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import server
+from analytics import Rollups
+from analytics_backfill import backfill
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def fresh_rollups(monkeypatch):
+    monkeypatch.setattr(server.rollups, "_pending", Counter())
+    monkeypatch.setattr(server.rollups, "_unsettled", [])
+
+
+async def test_writes_roll_up_and_backfill_agrees(client, db, make_user):
+    seeker, headers = await make_user()
+    mentor, _ = await make_user("mentor", is_verified=True)
+    admin, admin_headers = await make_user("admin")
+    conversation_id = str(uuid.uuid4())
+    await db.conversations.insert_one({"id": conversation_id, "members": [seeker["id"], mentor["id"]]})
+
+    for i in range(3):
+        await client.post("/api/messages", headers=headers, json={"conversation_id": conversation_id, "content": f"hi {i}"})
+    start = datetime(2030, 1, 1, 9)
+    await client.post("/api/schedules/bulk", headers=headers, json={"sessions": [
+        {
+            "mentor_id": mentor["id"], "title": "Session",
+            "start_time": (start + timedelta(days=i)).isoformat(),
+            "end_time": (start + timedelta(days=i, hours=1)).isoformat(),
+        }
+        for i in range(2)
+    ]})
+    response = await client.post("/api/auth/register", json={
+        "email": "new@example.com", "name": "New", "password": "secret", "role": "mentor",
+    })
+    assert response.status_code == 200
+
+    # Nothing is written until the flush
+    assert await db.analytics_rollups.count_documents({}) == 0
+    await server.rollups.flush()
+
+    async def report(**params):
+        response = await client.get("/api/admin/analytics", params=params, headers=admin_headers)
+        assert response.status_code == 200
+        return response.json()
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    messages = await report(metric="messages")
+    assert [(point["bucket"], point["count"]) for point in messages["series"]] == [(today.isoformat(), 3)]
+    assert (await report(metric="bookings", granularity="week"))["totals"] == {mentor["id"]: 2}
+    assert (await report(metric="signups", granularity="hour"))["totals"] == {"mentor": 1}
+    # Offset times are read as the UTC instant they name
+    offset = await report(
+        metric="messages",
+        start=(today - timedelta(days=1)).isoformat() + "+02:00",
+        end=(today + timedelta(days=1)).isoformat() + "Z",
+    )
+    assert offset["start"] == (today - timedelta(days=1, hours=2)).isoformat()
+    assert offset["totals"] == {"": 3}
+
+    # A backfill from the source collections reproduces the live counters
+    live = await db.analytics_rollups.find({}, {"_id": 0}).to_list(None)
+    await db.analytics_rollups.delete_many({})
+    before = datetime.utcnow() + timedelta(days=2)
+    for metric in ("messages", "bookings", "signups"):
+        await backfill(db, metric, before, batch_size=2)
+    rebuilt = await db.analytics_rollups.find({}, {"_id": 0}).to_list(None)
+
+    def counts(counters):
+        return {
+            (c["metric"], c["granularity"], c["bucket"], c["key"]): c["count"]
+            for c in counters if c["metric"] != "signups"
+        }
+    assert counts(rebuilt) == counts(live)
+    # make_user inserts users directly, so only the backfill counts them
+    signups = {c["key"]: c["count"] for c in rebuilt if c["metric"] == "signups" and c["granularity"] == "day"}
+    assert signups == {"seeker": 1, "mentor": 2, "admin": 1}
+
+
+async def test_analytics_rejects_bad_requests(client, make_user):
+    _, headers = await make_user("admin")
+    _, seeker_headers = await make_user()
+    assert (await client.get("/api/admin/analytics", params={"metric": "messages"}, headers=seeker_headers)).status_code == 403
+    assert (await client.get("/api/admin/analytics", params={"metric": "logins"}, headers=headers)).status_code == 400
+    response = await client.get("/api/admin/analytics", headers=headers, params={
+        "metric": "messages", "granularity": "hour",
+        "start": "2030-01-01T00:00:00", "end": "2030-06-01T00:00:00",
+    })
+    assert response.status_code == 400
+
+
+class FlakyCollection:
+    """``analytics_rollups`` whose next ``bulk_write`` fails after applying some updates."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.fail = None  # indexes of requests that fail, or "after" to lose the reply
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, requests, ordered=True):
+        fail, self.fail = self.fail, None
+        if fail is None:
+            return await self._collection.bulk_write(requests, ordered=ordered)
+        applied = [request for i, request in enumerate(requests) if fail == "after" or i not in fail]
+        await self._collection.bulk_write(applied, ordered=ordered)
+        if fail == "after":
+            raise AutoReconnect("connection closed before the reply")
+        raise BulkWriteError({
+            "writeErrors": [{"index": i, "code": 2, "errmsg": "failed"} for i in fail],
+            "writeConcernErrors": [],
+            "nUpserted": len(applied),
+        })
+
+
+@pytest.fixture
+async def flaky(db):
+    collection = FlakyCollection(db.analytics_rollups)
+    await collection.create_index([("metric", 1), ("granularity", 1), ("bucket", 1), ("key", 1)], unique=True)
+    return collection
+
+
+async def stored_counts(db):
+    return {
+        (c["granularity"], c["bucket"]): c["count"]
+        async for c in db.analytics_rollups.find({"metric": "messages"})
+    }
+
+
+AT = datetime(2030, 1, 1, 9)
+
+
+async def test_partially_failed_flush_retries_only_the_failures(db, flaky):
+    rollups = Rollups(get_db=lambda: SimpleNamespace(analytics_rollups=flaky))
+    rollups.record_many("messages", [(AT, None), (AT + timedelta(hours=1), None), (AT, None)])
+    # Counters are (hour 9, day, hour 10); the day fails
+    flaky.fail = [1]
+    assert await rollups.flush() == 2
+    assert await stored_counts(db) == {("hour", AT): 2, ("hour", AT + timedelta(hours=1)): 1}
+
+    assert await rollups.flush() == 1
+    assert await stored_counts(db) == {
+        ("hour", AT): 2, ("hour", AT + timedelta(hours=1)): 1, ("day", datetime(2030, 1, 1)): 3,
+    }
+
+
+async def test_flush_with_unknown_outcome_is_not_counted_twice(db, flaky):
+    rollups = Rollups(get_db=lambda: SimpleNamespace(analytics_rollups=flaky))
+    rollups.record("messages", AT)
+    flaky.fail = "after"
+    with pytest.raises(AutoReconnect):
+        await rollups.flush()
+    assert await stored_counts(db) == {("hour", AT): 1, ("day", datetime(2030, 1, 1)): 1}
+
+    # The retry goes out under the same flush id; the new increment is separate
+    rollups.record("messages", AT)
+    await rollups.flush()
+    assert await stored_counts(db) == {("hour", AT): 2, ("day", datetime(2030, 1, 1)): 2}
+    assert await rollups.flush() == 0
@@ -0,0 +1,64 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_schedule(db, mentor, seeker):
+    start = datetime(2030, 1, 1, 9)
+    schedule = {
+        "id": str(uuid.uuid4()),
+        "mentor_id": mentor["id"],
+        "seeker_id": seeker["id"],
+        "start_time": start,
+        "end_time": start + timedelta(hours=1),
+        "status": "scheduled",
+        "created_at": start,
+        "updated_at": start,
+    }
+    await db.schedules.insert_one(dict(schedule))
+    return schedule
+
+
+async def test_schedule_writes_explain_misses(client, db, make_user):
+    mentor, mentor_headers = await make_user("mentor")
+    seeker, _ = await make_user()
+    _, outsider_headers = await make_user()
+    schedule = await add_schedule(db, mentor, seeker)
+    path = f"/api/schedules/{schedule['id']}"
+
+    assert (await client.put("/api/schedules/missing", json={"status": "confirmed"}, headers=mentor_headers)).status_code == 404
+    assert (await client.delete("/api/schedules/missing", headers=mentor_headers)).status_code == 404
+
+    denied = await client.put(path, json={"status": "cancelled"}, headers=outsider_headers)
+    assert denied.status_code == 403
+    assert (await client.delete(path, headers=outsider_headers)).status_code == 403
+    assert (await db.schedules.find_one({"id": schedule["id"]}))["status"] == "scheduled"
+
+    updated = await client.put(path, json={"status": "confirmed"}, headers=mentor_headers)
+    assert updated.status_code == 200
+    assert updated.json()["status"] == "confirmed"
+    assert (await client.delete(path, headers=mentor_headers)).status_code == 200
+    # Once gone, the participant gets 404 rather than 403
+    assert (await client.delete(path, headers=mentor_headers)).status_code == 404
+
+
+async def test_verify_mentor_misses(client, make_user):
+    seeker, _ = await make_user()
+    _, admin_headers = await make_user("admin")
+
+    assert (await client.put("/api/admin/mentors/missing/verify", headers=admin_headers)).status_code == 404
+    # Only mentors match the filter
+    assert (await client.put(f"/api/admin/mentors/{seeker['id']}/verify", headers=admin_headers)).status_code == 404
+
+
+async def test_profile_update_creates_missing_profile(client, db, make_user):
+    user, headers = await make_user()
+
+    response = await client.put("/api/users/me/profile", json={"bio": "Hello", "skills": ["go"]}, headers=headers)
+    assert response.status_code == 200
+    profile = await db.profiles.find_one({"user_id": user["id"]})
+    assert (profile["bio"], profile["skills"]) == ("Hello", ["go"])
+    assert response.json()["id"] == profile["id"]
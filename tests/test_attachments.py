@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import uuid
+
+import pytest
+from botocore.exceptions import ClientError
+
+import server
+from attachments import AttachmentService, LocalBlobStore, OffsetMismatch, S3BlobStore, parse_range
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LocalBlobStore(tmp_path)
+    monkeypatch.setattr(server.attachment_service, "store", store)
+    return store
+
+
+@pytest.fixture
+async def conversation(db, make_user):
+    user, headers = await make_user()
+    conversation_id = str(uuid.uuid4())
+    await db.conversations.insert_one({"id": conversation_id, "members": [user["id"], "friend"]})
+    return conversation_id, headers
+
+
+async def upload(client, conversation_id, headers, data, chunk_size=None):
+    response = await client.post("/api/attachments", headers=headers, json={
+        "conversation_id": conversation_id, "filename": "notes.txt",
+        "content_type": "text/plain", "size": len(data),
+    })
+    upload_id = response.json()["id"]
+    chunk_size = chunk_size or len(data)
+    for offset in range(0, len(data), chunk_size):
+        response = await client.patch(
+            f"/api/attachments/{upload_id}", content=data[offset:offset + chunk_size],
+            headers={**headers, "Upload-Offset": str(offset)},
+        )
+        assert response.status_code == 200
+    return response.json()
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+
+async def test_resumable_upload_dedup_and_range_download(client, conversation, store):
+    conversation_id, headers = conversation
+    data = bytes(range(256)) * 40
+
+    created = await client.post("/api/attachments", headers=headers, json={
+        "conversation_id": conversation_id, "filename": "notes.txt", "size": len(data),
+    })
+    upload_id = created.json()["id"]
+    first = await client.patch(
+        f"/api/attachments/{upload_id}", content=data[:4000], headers={**headers, "Upload-Offset": "0"}
+    )
+    assert (first.json()["received"], first.json()["status"]) == (4000, "uploading")
+
+    # A retried chunk learns where to resume
+    retry = await client.patch(
+        f"/api/attachments/{upload_id}", content=data[:4000], headers={**headers, "Upload-Offset": "0"}
+    )
+    assert retry.status_code == 409
+    assert retry.headers["upload-offset"] == "4000"
+    progress = await client.get(f"/api/attachments/{upload_id}/upload", headers=headers)
+    rest = await client.patch(
+        f"/api/attachments/{upload_id}", content=data[progress.json()["received"]:],
+        headers={**headers, "Upload-Offset": str(progress.json()["received"])},
+    )
+    ready = rest.json()
+    assert ready["status"] == "ready"
+    assert ready["sha256"] == hashlib.sha256(data).hexdigest()
+
+    duplicate = await upload(client, conversation_id, headers, data, chunk_size=3000)
+    assert duplicate["sha256"] == ready["sha256"]
+    assert [path.name for path in store.root.rglob("*") if path.is_file()] == [ready["sha256"]]
+
+    response = await client.get(f"/api/attachments/{upload_id}", headers=headers)
+    assert response.content == data
+    assert response.headers["accept-ranges"] == "bytes"
+    response = await client.get(f"/api/attachments/{upload_id}", headers={**headers, "Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(data)}"
+    assert response.content == data[100:200]
+    response = await client.get(f"/api/attachments/{upload_id}", headers={**headers, "Range": "bytes=99999-"})
+    assert response.status_code == 416
+
+
+async def test_message_carries_attachment_metadata(client, conversation, store, make_user):
+    conversation_id, headers = conversation
+    attachment = await upload(client, conversation_id, headers, b"hello")
+    unfinished = (await client.post("/api/attachments", headers=headers, json={
+        "conversation_id": conversation_id, "filename": "big.bin", "size": 10,
+    })).json()
+
+    response = await client.post("/api/messages", headers=headers, json={
+        "conversation_id": conversation_id, "content": "", "attachment_ids": [unfinished["id"]],
+    })
+    assert response.status_code == 400
+    response = await client.post("/api/messages", headers=headers, json={
+        "conversation_id": conversation_id, "content": "", "attachment_ids": [attachment["id"]],
+    })
+    assert response.json()["attachments"] == [{
+        "id": attachment["id"], "filename": "notes.txt", "content_type": "text/plain",
+        "size": 5, "sha256": hashlib.sha256(b"hello").hexdigest(),
+    }]
+
+    _, outsider = await make_user()
+    response = await client.get(f"/api/attachments/{attachment['id']}", headers=outsider)
+    assert response.status_code == 404
+
+
+async def body(data, size=100):
+    for i in range(0, len(data), size):
+        await asyncio.sleep(0)  # lets the other request write in between
+        yield data[i:i + size]
+
+
+async def test_chunks_racing_for_one_offset(db, store):
+    service = server.attachment_service
+    upload = await service.create_upload("owner", "conversation", "race.bin", "application/octet-stream", 1000)
+    first, second = b"a" * 1000, b"b" * 1000
+
+    results = await asyncio.gather(
+        service.write_chunk(dict(upload), 0, body(first)),
+        service.write_chunk(dict(upload), 0, body(second)),
+        return_exceptions=True,
+    )
+    [ready] = [result for result in results if isinstance(result, dict)]
+    assert sum(isinstance(result, OffsetMismatch) for result in results) == 1
+    # The blob holds one request's bytes, never a mix of both
+    assert ready["status"] == "ready"
+    assert ready["sha256"] in (hashlib.sha256(first).hexdigest(), hashlib.sha256(second).hexdigest())
+    assert store.path(ready["sha256"]).read_bytes() in (first, second)
+    assert list(store.staging_dir.iterdir()) == []
+
+
+class StubS3:
+    """The parts of a boto3 S3 client the store uses, over a dict."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = 0
+        self.head_error = None
+
+    def head_object(self, Bucket, Key):
+        if self.head_error:
+            raise ClientError({"Error": {"Code": self.head_error}}, "HeadObject")
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    def upload_file(self, filename, bucket, key):
+        self.uploads += 1
+        with open(filename, "rb") as file:
+            self.objects[(bucket, key)] = file.read()
+
+    def download_file(self, bucket, key, filename):
+        with open(filename, "wb") as file:
+            file.write(self.objects[(bucket, key)])
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?op={operation}&ttl={ExpiresIn}"
+
+
+@pytest.fixture
+def s3_store(tmp_path):
+    return S3BlobStore("bucket", tmp_path / ".staging", prefix="files/", url_ttl=60, client=StubS3())
+
+
+async def test_s3_store_put_dedups_and_fetches(s3_store, tmp_path):
+    s3_store.staging_dir.mkdir()
+    digest = hashlib.sha256(b"hello").hexdigest()
+    for _ in range(2):
+        staged = s3_store.staging_dir / "upload"
+        staged.write_bytes(b"hello")
+        await s3_store.put(digest, staged)
+        assert not staged.exists()
+    assert s3_store.client.uploads == 1
+    assert s3_store.client.objects == {("bucket", f"files/{digest}"): b"hello"}
+    assert await s3_store.exists(digest)
+    assert not await s3_store.exists("missing")
+
+    target = tmp_path / "fetched"
+    await s3_store.fetch(digest, target)
+    assert target.read_bytes() == b"hello"
+
+    s3_store.client.head_error = "403"
+    with pytest.raises(ClientError):
+        await s3_store.exists(digest)
+
+
+async def test_s3_download_redirects_to_a_presigned_url(db, s3_store):
+    service = AttachmentService(get_db=lambda: db, store=s3_store)
+    response = await service.download({
+        "sha256": "abc", "size": 5, "filename": "notes.txt", "content_type": "text/plain",
+    })
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://s3.test/bucket/files/abc?op=get_object&ttl=60"
+    assert s3_store.local_path("abc") is None
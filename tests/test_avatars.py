@@ -0,0 +1,159 @@
+import io
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+
+import server
+from attachments import LocalBlobStore
+from avatars import VARIANTS, AvatarPipeline
+
+pytestmark = pytest.mark.anyio
+
+
+def png(width, height, color="teal"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    pipeline = AvatarPipeline(
+        get_db=lambda: server.db, root=tmp_path / "avatars", store=LocalBlobStore(tmp_path / "blobs"),
+        profile_defaults=server.profile_defaults,
+    )
+    monkeypatch.setattr(server, "avatar_pipeline", pipeline)
+    return pipeline
+
+
+async def test_upload_renders_thumbnails_once(client, make_user, pipeline, monkeypatch):
+    mentor, headers = await make_user("mentor", is_verified=True)
+    _, other_headers = await make_user()
+    image = png(900, 600)
+
+    response = await client.post("/api/users/me/avatar", headers=headers, files={"file": ("me.png", image)})
+    assert response.status_code == 202
+    assert response.json()["status"] == "pending"
+    assert await pipeline.run_pending() == 1
+
+    job = (await client.get("/api/users/me/avatar", headers=headers)).json()
+    assert job["status"] == "completed"
+    small = job["thumbnails"]["small"]
+    for variant, edge in VARIANTS.items():
+        response = await client.get(job["thumbnails"][variant])
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert Image.open(io.BytesIO(response.content)).size == (edge, edge)
+
+    profile = (await client.get("/api/users/me/profile", headers=headers)).json()
+    assert profile["avatar_url"] == job["thumbnails"]["large"]
+
+    # The same picture from someone else reuses the rendered thumbnails
+    def no_render(*args):
+        raise AssertionError("rendered twice")
+    monkeypatch.setattr("avatars.render_thumbnails", no_render)
+    await client.post("/api/users/me/avatar", headers=other_headers, files={"file": ("me.png", image)})
+    assert await pipeline.run_pending() == 1
+
+    results = (await client.get("/api/search/mentors", params={"q": "test"}, headers=headers)).json()
+    assert [result["profile"]["avatar_url"] for result in results] == [small]
+
+
+async def test_new_avatar_reaches_cached_search_results(client, make_user, pipeline):
+    pipeline._publish = server.invalidation.publish
+    _, headers = await make_user("mentor", is_verified=True)
+    search = {"params": {"q": "test"}, "headers": headers}
+    assert [r["profile"]["avatar_url"] for r in (await client.get("/api/search/mentors", **search)).json()] == [""]
+
+    job_id = await upload(client, headers, png(300, 300))
+    await pipeline.run_pending()
+    job = (await client.get("/api/users/me/avatar", headers=headers)).json()
+    assert job["id"] == job_id
+    results = (await client.get("/api/search/mentors", **search)).json()
+    assert [r["profile"]["avatar_url"] for r in results] == [job["thumbnails"]["small"]]
+
+
+async def test_upload_rejects_non_images(client, make_user, pipeline):
+    _, headers = await make_user()
+    response = await client.post(
+        "/api/users/me/avatar", headers=headers, files={"file": ("me.png", b"not an image")}
+    )
+    assert response.status_code == 400
+    assert (await client.get("/api/users/me/avatar", headers=headers)).status_code == 404
+    assert (await client.get("/api/avatars/" + "0" * 64 + "/huge.webp")).status_code == 404
+
+
+class RemoteStore(LocalBlobStore):
+    """A store whose blobs are not on this worker's disk, like S3."""
+
+    def local_path(self, digest):
+        return None
+
+    async def fetch(self, digest, target):
+        shutil.copyfile(self.path(digest), target)
+
+
+async def upload(client, headers, image):
+    response = await client.post("/api/users/me/avatar", headers=headers, files={"file": ("me.png", image)})
+    assert response.status_code == 202
+    return response.json()["id"]
+
+
+async def test_another_worker_renders_from_the_blob_store(client, db, make_user, pipeline, tmp_path):
+    _, headers = await make_user()
+    job_id = await upload(client, headers, png(300, 300))
+    # Another worker, with its own disk, claims the job
+    worker = AvatarPipeline(
+        get_db=lambda: db, root=tmp_path / "avatars", store=RemoteStore(tmp_path / "blobs"),
+        profile_defaults=server.profile_defaults,
+    )
+    assert await worker.run_pending() == 1
+    assert (await db.avatar_jobs.find_one({"id": job_id}))["status"] == "completed"
+    assert list((tmp_path / "blobs" / ".staging").iterdir()) == []
+
+
+async def test_render_errors_fail_the_job(client, db, make_user, pipeline, monkeypatch):
+    _, headers = await make_user()
+
+    def broken(*args):
+        raise RuntimeError("decoder crashed")
+    monkeypatch.setattr("avatars.render_thumbnails", broken)
+    job_id = await upload(client, headers, png(300, 300))
+    assert await pipeline.run_pending() == 1
+
+    job = await db.avatar_jobs.find_one({"id": job_id})
+    assert (job["status"], job["error"], job["attempts"]) == ("failed", "decoder crashed", 1)
+    assert (await client.get("/api/users/me/profile", headers=headers)).json()["avatar_url"] == ""
+
+
+async def test_jobs_that_keep_dying_are_failed(client, db, make_user, pipeline):
+    _, headers = await make_user()
+    job_id = await upload(client, headers, png(300, 300))
+    # Every earlier claim died while rendering and its lease ran out
+    await db.avatar_jobs.update_one({"id": job_id}, {"$set": {
+        "status": "running", "attempts": pipeline.max_attempts, "lease_until": datetime.utcnow() - timedelta(seconds=1),
+    }})
+    assert await pipeline.run_pending() == 1
+    job = await db.avatar_jobs.find_one({"id": job_id})
+    assert (job["status"], job["attempts"]) == ("failed", pipeline.max_attempts + 1)
+
+
+async def test_an_older_job_never_replaces_a_newer_avatar(client, db, make_user, pipeline, monkeypatch):
+    _, headers = await make_user()
+    older_id = await upload(client, headers, png(300, 300, "red"))
+    older = await pipeline._claim()  # rendering while the user uploads again
+    newer_id = await upload(client, headers, png(300, 300, "blue"))
+    assert await pipeline.run_pending() == 1
+
+    published = []
+
+    async def publish(entity, keys):
+        published.append((entity, keys))
+    monkeypatch.setattr(pipeline, "_publish", publish)
+    await pipeline.process(older)
+    assert (await db.avatar_jobs.find_one({"id": older_id}))["status"] == "superseded"
+    assert published == []  # nothing changed
+    newer = await db.avatar_jobs.find_one({"id": newer_id})
+    profile = (await client.get("/api/users/me/profile", headers=headers)).json()
+    assert profile["avatar_url"] == f"/api/avatars/{newer['digest']}/large.webp"
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from cascade_cleanup import CascadeCleanup, LeaseLost
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def cleanup(db):
+    return CascadeCleanup(get_db=lambda: db, batch_size=2, batch_pause=0)
+
+
+async def add_conversation(db, conversation_id, members, messages=3):
+    await db.conversations.insert_one({"id": conversation_id, "members": members})
+    start = datetime(2030, 1, 1)
+    await db.messages.insert_many([
+        {
+            "id": f"{conversation_id}-{i}",
+            "conversation_id": conversation_id,
+            "sender_id": members[0],
+            "content": "hi",
+            "created_at": start + timedelta(minutes=i),
+        }
+        for i in range(messages)
+    ])
+
+
+async def test_cleanup_keeps_history_shared_with_others(db, cleanup):
+    await db.schedules.insert_many([
+        {"id": f"s{i}", "mentor_id": "gone", "seeker_id": "seeker"} for i in range(3)
+    ] + [{"id": "other", "mentor_id": "mentor", "seeker_id": "seeker"}])
+    await add_conversation(db, "shared", ["gone", "seeker"])
+    await add_conversation(db, "alone", ["gone"])
+    await db.message_archive.insert_one({"id": "segment", "conversation_id": "alone"})
+
+    [job_id] = await cleanup.enqueue(["gone"])
+    assert await cleanup.run_pending() == 1
+
+    job = await db.cleanup_jobs.find_one({"id": job_id})
+    assert (job["status"], job["phase"], job["lease_until"]) == ("completed", "done", None)
+    assert job["removed"] == {"schedules": 3, "conversations": 1, "messages": 3, "archive_segments": 1}
+    assert job["conversations_left"] == 1
+
+    assert [s["id"] for s in await db.schedules.find().to_list(None)] == ["other"]
+    shared = await db.conversations.find_one({"id": "shared"})
+    assert (shared["members"], shared["former_members"]) == (["seeker"], ["gone"])
+    assert await db.messages.count_documents({"conversation_id": "shared"}) == 3
+    assert await db.conversations.find_one({"id": "alone"}) is None
+    assert await db.messages.count_documents({"conversation_id": "alone"}) == 0
+    assert await db.message_archive.count_documents({}) == 0
+
+
+async def test_resume_finds_an_emptied_conversation(db, cleanup):
+    # A previous run left the conversation but died before deleting it
+    await add_conversation(db, "emptied", ["gone"])
+    await db.conversations.update_one({"id": "emptied"}, {"$set": {"members": [], "former_members": ["gone"]}})
+    [job_id] = await cleanup.enqueue(["gone"])
+    await db.cleanup_jobs.update_one({"id": job_id}, {"$set": {"phase": "conversations"}})
+
+    await cleanup.run_pending()
+    assert await db.conversations.count_documents({}) == 0
+    assert await db.messages.count_documents({}) == 0
+
+
+async def test_checkpoint_requires_the_lease(db, cleanup):
+    await cleanup.enqueue(["gone"])
+    stale = await cleanup._claim()
+    # The lease runs out and another worker takes the job over
+    await db.cleanup_jobs.update_one({"id": stale["id"]}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}})
+    owner = await CascadeCleanup(get_db=lambda: db)._claim()
+    assert owner["id"] == stale["id"] and owner["lease_owner"] != stale["lease_owner"]
+
+    with pytest.raises(LeaseLost):
+        await cleanup._checkpoint(stale, phase="conversations")
+    job = await db.cleanup_jobs.find_one({"id": stale["id"]})
+    assert (job["phase"], job["lease_owner"]) == ("schedules", owner["lease_owner"])
+    assert stale["phase"] == "schedules"
+
+
+async def test_deleting_a_mentor_runs_the_cascade(client, db, make_user):
+    mentor, _ = await make_user("mentor")
+    seeker, _ = await make_user()
+    _, admin_headers = await make_user("admin")
+    await add_conversation(db, "chat", [seeker["id"], mentor["id"]])
+
+    response = await client.delete(f"/api/admin/mentors/{mentor['id']}", headers=admin_headers)
+    job_id = response.json()["cleanup_job_id"]
+    await server.cascade_cleanup.run_pending()
+
+    job = (await client.get(f"/api/admin/cleanup-jobs/{job_id}", headers=admin_headers)).json()
+    assert (job["status"], job["conversations_left"]) == ("completed", 1)
+    assert (await db.conversations.find_one({"id": "chat"}))["members"] == [seeker["id"]]
+    assert (await client.get("/api/admin/cleanup-jobs/missing", headers=admin_headers)).status_code == 404
+
+
+async def test_cleanup_publishes_conversation_changes(db):
+    published = []
+
+    async def publish(entity, keys):
+        published.append((entity, keys))
+
+    cleanup = CascadeCleanup(get_db=lambda: db, publish=publish, batch_pause=0)
+    await add_conversation(db, "shared", ["gone", "seeker"])
+    await add_conversation(db, "alone", ["gone"])
+    await cleanup.enqueue(["gone"])
+    await cleanup.run_pending()
+    assert sorted(published) == [
+        ("conversations", ["alone"]), ("conversations", ["alone"]), ("conversations", ["shared"]),
+    ]
+
+
+async def test_shared_conversations_are_left_in_batches(db):
+    published = []
+
+    async def publish(entity, keys):
+        published.append(sorted(keys))
+
+    cleanup = CascadeCleanup(get_db=lambda: db, publish=publish, batch_size=2, batch_pause=0)
+    for i in range(5):
+        await add_conversation(db, f"shared-{i}", ["gone", "seeker"])
+    [job_id] = await cleanup.enqueue(["gone"])
+    await cleanup.run_pending()
+
+    assert sorted(len(batch) for batch in published) == [1, 2, 2]
+    assert sorted(sum(published, [])) == [f"shared-{i}" for i in range(5)]
+    assert (await db.cleanup_jobs.find_one({"id": job_id}))["conversations_left"] == 5
+    assert await db.conversations.count_documents({"members": "gone"}) == 0
+    assert await db.conversations.count_documents({"former_members": "gone"}) == 5
+
+
+async def test_cascade_evicts_cached_membership(db):
+    await add_conversation(db, "chat", ["gone", "seeker"])
+    assert await server.is_conversation_member("chat", "gone")  # now cached
+    await server.cascade_cleanup.enqueue(["gone"])
+    await server.cascade_cleanup.run_pending()
+    assert not await server.is_conversation_member("chat", "gone")
@@ -0,0 +1,89 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from chat_delivery import DeliveryMarks, RoomHistory
+
+pytestmark = pytest.mark.anyio
+
+SENT = datetime(2030, 1, 1)
+
+
+def test_marks_only_move_forward():
+    marks = DeliveryMarks(max_users=2)
+    assert marks.get("alice", "room") is None
+    assert marks.advance("alice", "room", "m2", SENT + timedelta(seconds=2))
+    # A late ack for an older message, or a repeat, leaves the mark alone
+    assert not marks.advance("alice", "room", "m1", SENT + timedelta(seconds=1))
+    assert not marks.advance("alice", "room", "m2", SENT + timedelta(seconds=2))
+    assert marks.get("alice", "room") == "m2"
+    # Same timestamp: the id breaks the tie, as in message order
+    assert marks.advance("alice", "room", "m3", SENT + timedelta(seconds=2))
+    assert marks.get("alice", "room") == "m3"
+
+    marks.advance("bob", "room", "m1", SENT)
+    marks.advance("carol", "room", "m1", SENT)
+    assert marks.get("alice", "room") is None  # evicted
+
+
+def test_room_history_find_and_since():
+    history = RoomHistory(per_room=3)
+    for i in range(4):
+        history.append("room", {"id": f"m{i}", "created_at": SENT})
+    assert history.find("room", "m0") is None  # fell out of the buffer
+    assert history.find("room", "m2")["id"] == "m2"
+    assert [m["id"] for m in history.since("room", "m1")] == ["m2", "m3"]
+    assert history.since("room", "m0") is None
+    assert history.since("other", "m1") is None
+
+
+def message(conversation_id, i):
+    return {
+        "id": f"{conversation_id}-{i}",
+        "conversation_id": conversation_id,
+        "sender_id": "sender",
+        "content": str(i),
+        "attachments": [],
+        "created_at": SENT + timedelta(seconds=i),
+    }
+
+
+async def test_replay_falls_back_when_another_worker_wrote(db):
+    conversation_id = str(uuid.uuid4())
+    first, *buffered = [message(conversation_id, i) for i in (0, 2, 3)]
+    # Stored and broadcast by this process, as store_message does
+    for sent in [first] + buffered:
+        await db.messages.insert_one(dict(sent))
+        server.room_history.append(conversation_id, sent)
+
+    # Everything after ``first`` went through this process: served from memory
+    missed = await server.missed_messages(conversation_id, first["id"])
+    assert all(a is b for a, b in zip(missed, buffered)) and len(missed) == 2
+
+    # Another worker stores a message this process never saw
+    await db.messages.insert_one(message(conversation_id, 1))
+    missed = await server.missed_messages(conversation_id, first["id"])
+    assert [m["id"] for m in missed] == [f"{conversation_id}-{i}" for i in (1, 2, 3)]
+
+    assert await server.missed_messages(conversation_id, "unknown") is None
+
+
+async def test_acks_never_rewind_the_resume_point(db, make_user, open_socket):
+    user, headers = await make_user()
+    conversation_id = str(uuid.uuid4())
+    await db.conversations.insert_one({"id": conversation_id, "members": [user["id"]]})
+    messages = [message(conversation_id, i) for i in range(3)]
+    await db.messages.insert_many([dict(m) for m in messages])
+    sid = await open_socket(headers)
+    await server.join_room(sid, {"room": conversation_id})
+
+    await server.message_ack(sid, {"room": conversation_id, "message_id": messages[1]["id"]})
+    await server.message_ack(sid, {"room": conversation_id, "message_id": messages[0]["id"]})
+    await server.message_ack(sid, {"room": conversation_id, "message_id": "unknown"})
+    assert server.delivery_marks.get(user["id"], conversation_id) == messages[1]["id"]
+
+    resumed = await open_socket(headers)
+    ack = await server.join_room(resumed, {"room": conversation_id, "resume": True})
+    assert [m["id"] for m in ack["missed"]] == [messages[2]["id"]]
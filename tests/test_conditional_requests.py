@@ -0,0 +1,174 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_schedules(db, mentor, seeker, count):
+    start = datetime(2030, 1, 1, 9)
+    docs = []
+    for i in range(count):
+        docs.append({
+            "id": f"schedule-{i}",
+            "mentor_id": mentor["id"],
+            "seeker_id": seeker["id"],
+            "start_time": start + timedelta(hours=i),
+            "end_time": start + timedelta(hours=i, minutes=45),
+            "status": "scheduled",
+            "title": f"Session {i}",
+            "description": "Weekly mentoring session " * 4,
+            "meeting_link": "",
+            "created_at": start,
+            "updated_at": start,
+        })
+    await db.schedules.insert_many(docs)
+
+
+async def test_profile_etag_round_trip(client, make_user):
+    _, headers = await make_user()
+
+    first = await client.get("/api/users/me/profile", headers=headers)
+    etag = first.headers["etag"]
+    assert first.status_code == 200
+
+    cached = await client.get("/api/users/me/profile", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    updated = await client.put(
+        "/api/users/me/profile", json={"bio": "Hello"}, headers={**headers, "If-Match": etag}
+    )
+    assert updated.status_code == 200
+    assert updated.headers["etag"] != etag
+
+    stale = await client.put(
+        "/api/users/me/profile", json={"bio": "Lost update"}, headers={**headers, "If-Match": etag}
+    )
+    assert stale.status_code == 412
+
+    fresh = await client.get("/api/users/me/profile", headers={**headers, "If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.json()["bio"] == "Hello"
+
+
+async def test_profile_if_match_is_bound_to_the_profile(client, make_user):
+    _, headers = await make_user()
+    _, other_headers = await make_user()
+    other_etag = (await client.get("/api/users/me/profile", headers=other_headers)).headers["etag"]
+    own_etag = (await client.get("/api/users/me/profile", headers=headers)).headers["etag"]
+    # Both profiles are at version 0; only the tag's id tells them apart
+    assert other_etag.rpartition(".")[2] == own_etag.rpartition(".")[2]
+
+    foreign = await client.put(
+        "/api/users/me/profile", json={"bio": "Hijacked"}, headers={**headers, "If-Match": other_etag}
+    )
+    assert foreign.status_code == 412
+    own = await client.put(
+        "/api/users/me/profile", json={"bio": "Mine"}, headers={**headers, "If-Match": own_etag}
+    )
+    assert own.status_code == 200
+
+
+async def test_schedule_if_match(client, db, make_user):
+    mentor, mentor_headers = await make_user("mentor")
+    seeker, seeker_headers = await make_user()
+    _, outsider_headers = await make_user()
+    await seed_schedules(db, mentor, seeker, 1)
+
+    etag = (await client.get("/api/schedules/schedule-0", headers=seeker_headers)).headers["etag"]
+
+    denied = await client.put(
+        "/api/schedules/schedule-0", json={"status": "confirmed"},
+        headers={**outsider_headers, "If-Match": etag},
+    )
+    assert denied.status_code == 403
+
+    ok = await client.put(
+        "/api/schedules/schedule-0", json={"status": "confirmed"},
+        headers={**mentor_headers, "If-Match": etag},
+    )
+    assert ok.status_code == 200
+
+    stale = await client.put(
+        "/api/schedules/schedule-0", json={"status": "cancelled"},
+        headers={**seeker_headers, "If-Match": etag},
+    )
+    assert stale.status_code == 412
+
+
+@pytest.fixture
+def built(monkeypatch):
+    """Count the response models built per model name."""
+    counts = {}
+    for name in ("Schedule", "Conversation", "Message"):
+        def build(*args, _model=getattr(server, name), _name=name, **kwargs):
+            counts[_name] = counts.get(_name, 0) + 1
+            return _model(*args, **kwargs)
+        monkeypatch.setattr(server, name, build)
+    return counts
+
+
+async def revalidate(client, url, headers, **params):
+    """Fetch ``url``, then again with its ETag; returns both responses."""
+    full = await client.get(url, params=params, headers=headers)
+    assert full.status_code == 200
+    cached = await client.get(url, params=params, headers={**headers, "If-None-Match": full.headers["etag"]})
+    return full, cached
+
+
+async def test_schedules_not_modified_skips_serialization(client, db, make_user, built):
+    mentor, _ = await make_user("mentor")
+    seeker, headers = await make_user()
+    await seed_schedules(db, mentor, seeker, 100)
+
+    full, cached = await revalidate(client, "/api/schedules", headers, limit=50)
+    assert full.content
+    assert (cached.status_code, cached.content) == (304, b"")
+    assert cached.headers["etag"] == full.headers["etag"]
+    assert cached.headers["x-next-cursor"] == full.headers["x-next-cursor"]
+    # Only the full response built its models
+    assert built == {"Schedule": 50}
+
+
+async def test_conversations_not_modified(client, db, make_user, built):
+    user, headers = await make_user()
+    await db.conversations.insert_one({"id": str(uuid.uuid4()), "members": [user["id"], "other"]})
+
+    full, cached = await revalidate(client, "/api/conversations", headers)
+    assert (cached.status_code, cached.content) == (304, b"")
+    assert cached.headers["etag"] == full.headers["etag"]
+    assert built == {"Conversation": 1}
+
+
+async def test_messages_not_modified_keeps_the_cursor(client, db, make_user, built):
+    user, headers = await make_user()
+    conversation_id = str(uuid.uuid4())
+    await db.conversations.insert_one({"id": conversation_id, "members": [user["id"]]})
+    start = datetime(2030, 1, 1)
+    await db.messages.insert_many([
+        {
+            "id": f"m{i}", "conversation_id": conversation_id, "sender_id": user["id"],
+            "content": "hi", "attachments": [], "created_at": start + timedelta(minutes=i),
+        }
+        for i in range(5)
+    ])
+    url = f"/api/conversations/{conversation_id}/messages"
+
+    full, cached = await revalidate(client, url, headers, limit=3)
+    assert (cached.status_code, cached.content) == (304, b"")
+    assert cached.headers["etag"] == full.headers["etag"]
+    assert cached.headers["x-next-cursor"] == full.headers["x-next-cursor"]
+    assert built == {"Message": 3}
+
+    # A new message changes the newest page
+    await db.messages.insert_one({
+        "id": "m5", "conversation_id": conversation_id, "sender_id": user["id"],
+        "content": "new", "attachments": [], "created_at": start + timedelta(minutes=5),
+    })
+    fresh = await client.get(url, params={"limit": 3}, headers={**headers, "If-None-Match": full.headers["etag"]})
+    assert fresh.status_code == 200
+    assert [m["id"] for m in fresh.json()] == ["m3", "m4", "m5"]
@@ -0,0 +1,38 @@
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from database import Database, parse_read_routes
+
+
+def test_read_routes_pick_preference_and_concern():
+    database = Database(
+        "mongodb://localhost:27017", "test_database",
+        read_routes=parse_read_routes("search=nearest:local,reports=primary:majority"),
+    )
+    try:
+        history = database.reader("history")
+        assert history.read_preference == SecondaryPreferred(max_staleness=90)
+        assert history.read_concern.level == "majority"
+        assert database.reader("search").read_preference.mongos_mode == "nearest"
+        assert database.reader("reports").read_preference == Primary()
+        assert database.db.read_preference == Primary()
+        assert database.reader("history") is history
+    finally:
+        database.close()
+
+
+def test_pool_stats_track_checkouts():
+    database = Database("mongodb://localhost:27017", "test_database", max_pool_size=4)
+    address = ("db1", 27017)
+    monitor = database.monitor
+    for connection_id in (1, 2):
+        monitor.connection_created(monitoring.ConnectionCreatedEvent(address, connection_id))
+        monitor.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        monitor.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, connection_id))
+    monitor.connection_checked_in(monitoring.ConnectionCheckedInEvent(address, 1))
+
+    stats = database.pool_stats()["servers"]["db1:27017"]
+    assert stats["open"] == 2
+    assert stats["in_use"] == 1
+    assert stats["waiting"] == 0
+    assert stats["utilization"] == 0.25
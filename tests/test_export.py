@@ -0,0 +1,108 @@
+import base64
+import json
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from message_archive import pack_segment
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2030, 1, 1)
+
+
+def make_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def parse(text):
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def record_ids(lines):
+    return [(line["type"], line["data"]["id"]) for line in lines if "data" in line]
+
+
+@pytest.fixture
+async def history(db, make_user):
+    user, headers = await make_user()
+    await db.schedules.insert_many([
+        {"id": f"s{i}", "mentor_id": "mentor", "seeker_id": user["id"], "start_time": START} for i in range(3)
+    ] + [{"id": "other", "mentor_id": "mentor", "seeker_id": "someone"}])
+    messages = {
+        conversation_id: [
+            {
+                "id": f"{conversation_id}-m{i}",
+                "conversation_id": conversation_id,
+                "sender_id": user["id"],
+                "content": "hi",
+                "created_at": START + timedelta(minutes=i),
+            }
+            for i in range(4)
+        ]
+        for conversation_id in ("c1", "c2")
+    }
+    for conversation_id, conversation_messages in messages.items():
+        await db.conversations.insert_one({"id": conversation_id, "members": [user["id"], "other"]})
+        # The oldest two are archived, the rest still hot
+        await db.message_archive.insert_one({
+            "id": f"{conversation_id}-segment",
+            "conversation_id": conversation_id,
+            "first_created_at": conversation_messages[0]["created_at"],
+            "last_created_at": conversation_messages[1]["created_at"],
+            "count": 2,
+            "data": pack_segment(conversation_messages[:2]),
+        })
+        await db.messages.insert_many(conversation_messages[2:])
+    return headers
+
+
+EXPECTED = [("schedule", f"s{i}") for i in range(3)] + [
+    record
+    for conversation_id in ("c1", "c2")
+    for record in [("conversation", conversation_id)] + [("message", f"{conversation_id}-m{i}") for i in range(4)]
+]
+
+
+async def test_export_resumes_from_every_checkpoint(client, history, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_CHECKPOINT_EVERY", 2)
+    response = await client.get("/api/users/me/export", headers=history)
+    assert response.status_code == 200
+    lines = parse(response.text)
+    assert record_ids(lines) == EXPECTED
+    assert lines[-1] == {"type": "end"}
+
+    checkpoints = [i for i, line in enumerate(lines) if line["type"] == "checkpoint"]
+    assert len(checkpoints) == len(EXPECTED) // 2
+    for i in checkpoints:
+        resumed = await client.get("/api/users/me/export", params={"cursor": lines[i]["cursor"]}, headers=history)
+        assert record_ids(parse(resumed.text)) == record_ids(lines[i:])
+
+
+async def test_compressed_export(client, history):
+    response = await client.get("/api/users/me/export", params={"compress": True}, headers=history)
+    assert response.headers["content-type"] == "application/gzip"
+    text = zlib.decompress(response.content, 31).decode()
+    assert record_ids(parse(text)) == EXPECTED
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-base64!",
+    make_cursor("schedules"),
+    make_cursor(["messages", None]),
+    make_cursor(["schedules", 5]),
+    make_cursor(["schedules", ["s1"]]),
+    make_cursor(["conversations", None]),
+    make_cursor(["conversations", "c1"]),
+    make_cursor(["conversations", [1, None]]),
+    make_cursor(["conversations", ["c1", "2030-01-01T00:00:00"]]),
+    make_cursor(["conversations", ["c1", ["not a date", "m1"]]]),
+    make_cursor(["conversations", ["c1", ["2030-01-01T00:00:00", None]]]),
+    make_cursor(["conversations", ["c1", ["2030-01-01T00:00:00", "m1", "extra"]]]),
+])
+async def test_invalid_cursor_is_rejected(client, make_user, cursor):
+    _, headers = await make_user()
+    response = await client.get("/api/users/me/export", params={"cursor": cursor}, headers=headers)
+    assert response.status_code == 400
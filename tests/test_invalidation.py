@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from invalidation import InvalidationBus, LocalCache, LocalTransport, MongoTransport
+
+pytestmark = pytest.mark.anyio
+
+
+def test_cache_expires_and_evicts_least_recent():
+    now = [0.0]
+    cache = LocalCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert (cache.get("b"), cache.get("a")) == (None, 1)
+    now[0] = 10
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 2
+
+
+def worker(transport):
+    bus = InvalidationBus(transport)
+    users = LocalCache()
+    bus.subscribe("users", users.evict)
+    users.set("u1", {"is_verified": False})
+    users.set("u2", {"is_verified": False})
+    return bus, users
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "event never arrived"
+        await asyncio.sleep(0.01)
+
+
+async def test_local_transport_evicts_on_other_workers():
+    hub = []
+    (bus_a, users_a), (bus_b, users_b) = worker(LocalTransport(hub)), worker(LocalTransport(hub))
+    bus_a.start()
+    bus_b.start()
+
+    await bus_a.publish("users", ["u1"])
+    assert users_a.get("u1") is None  # applied locally at once
+    await wait_for(lambda: users_b.get("u1") is None)
+    assert users_b.get("u2") is not None
+    assert bus_b.stats()["received"] == 1
+    assert bus_b.stats()["lag_ms"]["max"] >= 0
+
+
+async def test_outbox_fallback_reaches_other_workers():
+    db = AsyncMongoMockClient().invalidation_test
+    workers = [worker(MongoTransport(lambda: db, mode="outbox", poll_interval=0.01)) for _ in range(2)]
+    for bus, _ in workers:
+        bus.start()
+    (bus_a, _), (bus_b, users_b) = workers
+    try:
+        await asyncio.sleep(0.05)
+        await bus_a.publish("users", ["u1", "u2"])
+        await wait_for(lambda: users_b.stats()["size"] == 0)
+        await asyncio.sleep(0.05)
+        # A worker skips its own events, and re-read events apply once
+        assert bus_a.stats()["received"] == 0
+        assert bus_b.stats()["received"] == 2
+        assert bus_b.stats()["transport"] == "outbox"
+    finally:
+        for bus, _ in workers:
+            await bus.stop()
+
+
+async def test_verification_is_visible_to_the_cached_user(client, make_user):
+    mentor, headers = await make_user("mentor")
+    _, admin_headers = await make_user("admin")
+    assert (await client.get("/api/users/me", headers=headers)).json()["is_verified"] is False
+
+    response = await client.put(f"/api/admin/mentors/{mentor['id']}/verify", headers=admin_headers)
+    assert response.status_code == 200
+    assert (await client.get("/api/users/me", headers=headers)).json()["is_verified"] is True
+
+    stats = (await client.get("/api/admin/cache-stats", headers=admin_headers)).json()
+    assert stats["caches"]["users"]["evictions"] >= 1
+    assert stats["invalidation"]["published"] >= 1
@@ -0,0 +1,160 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from message_archive import MessageArchiver, pack_segment, unpack_segment
+
+pytestmark = pytest.mark.anyio
+
+OLD = datetime(2020, 1, 1)
+
+
+def message(conversation_id, i, sender_id="sender"):
+    return {
+        "id": f"{conversation_id}-{i:03d}",
+        "conversation_id": conversation_id,
+        "sender_id": sender_id,
+        "content": f"message {i}",
+        "attachments": [],
+        # Pairs share a timestamp, so ordering needs the id as tie-breaker
+        "created_at": OLD + timedelta(minutes=i // 2),
+    }
+
+
+@pytest.fixture
+def archiver(db):
+    return MessageArchiver(get_db=lambda: db, max_age=timedelta(days=1), segment_size=4, batch_pause=0)
+
+
+async def archived_ids(db):
+    ids = []
+    async for segment in db.message_archive.find({}, {"_id": 0, "data": 1}):
+        ids += [m["id"] for m in unpack_segment(segment["data"])]
+    return ids
+
+
+def test_pack_round_trip():
+    messages = [message("c", i) for i in range(3)]
+    messages[0]["content"] = "ünïcode\nand newlines"
+    data = pack_segment(messages)
+    assert data[:2] == b"\x1f\x8b"
+    assert unpack_segment(data) == messages
+
+
+async def test_archive_once_moves_old_messages(db, archiver):
+    recent = {**message("a", 99), "created_at": datetime.utcnow()}
+    await db.messages.insert_many([message("a", i) for i in range(6)] + [message("b", i) for i in range(3)] + [recent])
+
+    assert await archiver.archive_once() == 9
+    assert [m["id"] for m in await db.messages.find().to_list(None)] == [recent["id"]]
+    assert sorted(await archived_ids(db)) == sorted([f"a-{i:03d}" for i in range(6)] + [f"b-{i:03d}" for i in range(3)])
+    for segment in await db.message_archive.find().to_list(None):
+        assert segment["count"] == len(unpack_segment(segment["data"]))
+    assert await archiver.archive_once() == 0
+
+
+async def test_archive_is_idempotent_per_message(db, archiver):
+    messages = [message("a", i) for i in range(6)]
+    await db.messages.insert_many([dict(m) for m in messages])
+    # A run with a batch size of 3 died after inserting its first segment,
+    # before deleting the messages in it
+    await db.message_archive.insert_one({
+        "id": "crashed", "conversation_id": "a", "count": 3,
+        "first_created_at": messages[0]["created_at"], "last_created_at": messages[2]["created_at"],
+        "data": pack_segment(messages[:3]),
+    })
+
+    assert await archiver.archive_once() == 6
+    ids = await archived_ids(db)
+    assert sorted(ids) == [m["id"] for m in messages]
+    assert await db.messages.count_documents({}) == 0
+
+
+async def test_read_before_and_iter_after(db, archiver):
+    await db.messages.insert_many([message("a", i) for i in range(10)])
+    await archiver.archive_once()
+
+    newest = await archiver.read_before("a", None, 3)
+    assert [m["id"] for m in newest] == ["a-009", "a-008", "a-007"]
+    older = await archiver.read_before("a", (newest[-1]["created_at"], newest[-1]["id"]), 5)
+    assert [m["id"] for m in older] == ["a-006", "a-005", "a-004", "a-003", "a-002"]
+    assert await archiver.read_before("a", None, 0) == []
+    assert await archiver.read_before("other", None, 5) == []
+
+    after = [m["id"] async for m in archiver.iter_after("a", (older[0]["created_at"], older[0]["id"]))]
+    assert after == ["a-007", "a-008", "a-009"]
+
+
+async def test_message_history_pages_into_the_archive(client, db, make_user, monkeypatch):
+    user, headers = await make_user()
+    conversation_id = str(uuid.uuid4())
+    await db.conversations.insert_one({"id": conversation_id, "members": [user["id"]]})
+    await db.messages.insert_many([message(conversation_id, i, user["id"]) for i in range(7)])
+    monkeypatch.setattr(server.message_archiver, "batch_pause", 0)
+    await server.message_archiver.archive_once()
+    hot = [
+        {**message(conversation_id, i, user["id"]), "created_at": datetime.utcnow() + timedelta(seconds=i)}
+        for i in range(7, 10)
+    ]
+    await db.messages.insert_many(hot)
+
+    pages, before = [], None
+    while True:
+        params = {"limit": 4, **({"before": before} if before else {})}
+        response = await client.get(f"/api/conversations/{conversation_id}/messages", params=params, headers=headers)
+        assert response.status_code == 200
+        pages.append([m["id"].rsplit("-", 1)[1] for m in response.json()])
+        before = response.headers.get("x-next-cursor")
+        if not before:
+            break
+    # Each page is oldest first; the first crosses from hot into the archive
+    assert pages == [["006", "007", "008", "009"], ["002", "003", "004", "005"], ["000", "001"]]
+
+
+async def test_concurrent_archivers_archive_each_message_once(db):
+    await db.messages.insert_many([message(c, i) for c in ("a", "b") for i in range(9)])
+    workers = [
+        MessageArchiver(get_db=lambda: db, max_age=timedelta(days=1), segment_size=4, batch_pause=0.001)
+        for _ in range(2)
+    ]
+    ran = []
+    for worker in workers:
+        async def archive(*args, _archive=worker._archive, _worker=worker):
+            ran.append(_worker)
+            await asyncio.sleep(0.01)  # both runs are in flight together
+            return await _archive(*args)
+        worker._archive = archive
+
+    counts = await asyncio.gather(*(worker.archive_once() for worker in workers))
+    assert sorted(counts) == [0, 18]
+    assert len(ran) == 1  # the second run found the lease held
+    ids = await archived_ids(db)
+    assert sorted(ids) == sorted(m["id"] for m in [message(c, i) for c in ("a", "b") for i in range(9)])
+
+    # The lease is released, so the next run goes ahead
+    await db.messages.insert_one(message("c", 0))
+    assert await workers[0].archive_once() == 1
+
+
+async def test_a_run_stops_once_its_lease_is_taken_over(db, archiver):
+    await db.messages.insert_many([message("a", i) for i in range(12)])
+    taken_over = []
+    successor = MessageArchiver(get_db=lambda: db, max_age=timedelta(days=1), batch_pause=0)
+    original_renew = archiver._renew
+
+    async def renew(db, owner):
+        if await db.messages.count_documents({}) <= 8 and not taken_over:
+            # The lease ran out after the first batch and another worker claimed it
+            await db.leases.update_one({"id": "message_archive"}, {"$set": {"lease_until": datetime(2000, 1, 1)}})
+            taken_over.append(await successor._claim(db))
+        return await original_renew(db, owner)
+
+    archiver._renew = renew
+    assert await archiver.archive_once() == 4
+    assert taken_over[0] is not None
+    lease = await db.leases.find_one({"id": "message_archive"})
+    assert (lease["owner"], lease["lease_until"] is not None) == (taken_over[0], True)
+    assert await db.messages.count_documents({}) == 8
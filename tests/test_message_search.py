@@ -0,0 +1,189 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from message_search import decode_position, encode_position, query_stems, search_pipeline, snippet
+
+pytestmark = pytest.mark.anyio
+
+
+def test_snippet_highlights_stemmed_matches():
+    text, highlights = snippet("We talked about testing plans", query_stems("tested -plans"))
+    assert text == "We talked about testing plans"
+    assert [text[s:e] for s, e in highlights] == ["testing"]
+
+    content = "filler " * 40 + "the deploy broke" + " filler" * 40
+    text, highlights = snippet(content, query_stems("deploy"), width=60)
+    assert text.startswith("…") and text.endswith("…")
+    assert [text[s:e] for s, e in highlights] == ["deploy"]
+
+
+def test_cursor_round_trip():
+    position = (1.5, datetime(2030, 1, 1, 12), "m1")
+    assert decode_position(encode_position(position)) == position
+    with pytest.raises(ValueError):
+        decode_position("not-a-cursor")
+
+
+def test_pipeline_is_prefixed_by_one_conversation():
+    after = (1.5, datetime(2030, 1, 1), "m1")
+    pipeline = search_pipeline("c1", "resume", after, 11)
+    # Equality on the index prefix: only c1's postings are read
+    assert pipeline[0] == {"$match": {"conversation_id": "c1", "$text": {"$search": "resume"}}}
+    assert pipeline[1] == {"$addFields": {"score": {"$meta": "textScore"}}}
+    assert pipeline[2]["$match"]["$or"][2] == {"score": 1.5, "created_at": datetime(2030, 1, 1), "id": {"$lt": "m1"}}
+    assert pipeline[3:] == [
+        {"$sort": {"score": -1, "created_at": -1, "id": -1}}, {"$limit": 11}, {"$project": {"_id": 0}},
+    ]
+    assert search_pipeline("c1", "resume", None, 5)[2] == {"$sort": {"score": -1, "created_at": -1, "id": -1}}
+
+
+class TextSearchDb:
+    """Runs search pipelines against mongomock, which has no ``$text``.
+
+    The text match and score are computed here, scoring a message by how
+    often query words occur in it; every later stage runs in mongomock.
+    Also records each pipeline and the most queries in flight at once.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pipelines = []
+        self.running = 0
+        self.most_running = 0
+
+    @property
+    def messages(self):
+        return self
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return TextSearchCursor(self, pipeline)
+
+
+class TextSearchCursor:
+    def __init__(self, search_db, pipeline):
+        self.search_db = search_db
+        self.pipeline = pipeline
+
+    async def to_list(self, length):
+        search_db, db = self.search_db, self.search_db.db
+        search_db.running += 1
+        search_db.most_running = max(search_db.most_running, search_db.running)
+        try:
+            await asyncio.sleep(0.001)  # a round trip, so other queries start
+            match, add_fields, *rest = self.pipeline
+            assert add_fields == {"$addFields": {"score": {"$meta": "textScore"}}}
+            match = dict(match["$match"])
+            words = match.pop("$text")["$search"].lower().split()
+            scored = []
+            async for message in db.messages.find(match):
+                score = float(sum(message["content"].lower().split().count(word) for word in words))
+                if score:
+                    scored.append({**message, "score": score})
+            scratch = db[f"search_scratch_{uuid.uuid4().hex}"]
+            if scored:
+                await scratch.insert_many(scored)
+            return await scratch.aggregate(rest).to_list(length)
+        finally:
+            search_db.running -= 1
+
+
+async def test_search_pages_only_member_conversations(client, db, make_user, monkeypatch):
+    search_db = TextSearchDb(db)
+    monkeypatch.setattr(server.message_search, "_get_db", lambda: search_db)
+    user, headers = await make_user()
+    mine, other = str(uuid.uuid4()), str(uuid.uuid4())
+    await db.conversations.insert_many([
+        {"id": mine, "members": [user["id"], "friend"]},
+        {"id": other, "members": ["a", "b"]},
+    ])
+    start = datetime.utcnow() - timedelta(hours=1)
+    await db.messages.insert_many([
+        {
+            "id": str(uuid.uuid4()), "conversation_id": conversation_id, "sender_id": "friend",
+            "content": content, "created_at": start + timedelta(minutes=i),
+        }
+        for i, (conversation_id, content) in enumerate([
+            (mine, "resume review tomorrow"),
+            (mine, "resume review notes and resume tips"),
+            (mine, "unrelated chatter"),
+            (mine, "send your resume"),
+            (other, "resume from someone else"),
+        ])
+    ])
+
+    response = await client.get("/api/messages/search", params={"q": "resume review", "limit": 2}, headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert [hit["message"]["content"] for hit in page] == [
+        "resume review notes and resume tips", "resume review tomorrow",
+    ]
+    assert page[1]["snippet"][slice(*page[1]["highlights"][0])] == "resume"
+
+    response = await client.get(
+        "/api/messages/search",
+        params={"q": "resume review", "limit": 2, "cursor": response.headers["X-Next-Cursor"]},
+        headers=headers,
+    )
+    assert [hit["message"]["content"] for hit in response.json()] == ["send your resume"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = await client.get(
+        "/api/messages/search", params={"q": "resume", "conversation_id": other}, headers=headers
+    )
+    assert response.status_code == 404
+    response = await client.get(
+        "/api/messages/search", params={"q": "resume", "cursor": "garbage"}, headers=headers
+    )
+    assert response.status_code == 400
+
+    # One query per page, restricted to the caller's conversation
+    assert [pipeline[0]["$match"]["conversation_id"] for pipeline in search_db.pipelines] == [mine, mine]
+
+
+async def test_pages_merge_across_conversations_with_bounded_parallelism(db, monkeypatch):
+    search_db = TextSearchDb(db)
+    search = server.message_search
+    monkeypatch.setattr(search, "_get_db", lambda: search_db)
+    monkeypatch.setattr(search, "max_parallel", 3)
+    conversation_ids = [f"c{i}" for i in range(10)]
+    start = datetime(2030, 1, 1)
+    await db.messages.insert_many([
+        {
+            "id": f"{conversation_id}-{j}", "conversation_id": conversation_id, "sender_id": "friend",
+            "content": "resume " * (j + 1), "created_at": start + timedelta(minutes=i * 10 + j),
+        }
+        for i, conversation_id in enumerate(conversation_ids)
+        for j in range(3)
+    ])
+
+    seen, cursor = [], None
+    while True:
+        hits, cursor = await search.search(conversation_ids, "resume", 4, cursor)
+        seen += [hit["id"] for hit in hits]
+        if cursor is None:
+            break
+    # Best score first, newest first within a score
+    assert seen == [f"c{i}-{j}" for j in (2, 1, 0) for i in reversed(range(10))]
+    assert search_db.most_running == 3
+
+
+async def test_search_without_conversations(client, make_user, monkeypatch):
+    search_db = TextSearchDb(None)
+    monkeypatch.setattr(server.message_search, "_get_db", lambda: search_db)
+    _, headers = await make_user()
+    response = await client.get("/api/messages/search", params={"q": "resume"}, headers=headers)
+    assert response.json() == [] and search_db.pipelines == []
+
+
+async def test_create_indexes_replaces_the_suffix_text_index(db):
+    await db.messages.drop_index("conversation_text")
+    await db.messages.create_index([("content", "text"), ("conversation_id", 1)], name="content_text")
+    await server.create_indexes()
+    indexes = await db.messages.index_information()
+    assert "content_text" not in indexes
+    assert indexes["conversation_text"]["key"][0] == ("conversation_id", 1)
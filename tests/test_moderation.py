@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+APPLIED = datetime(2030, 1, 1)
+
+
+async def add_mentors(make_user, count, **fields):
+    mentors = []
+    for i in range(count):
+        mentor, _ = await make_user("mentor", created_at=APPLIED + timedelta(minutes=i), **fields)
+        mentors.append(mentor)
+    return mentors
+
+
+async def test_queue_pages_and_counts(client, db, make_user):
+    _, headers = await make_user("admin")
+    pending = await add_mentors(make_user, 5)
+    await add_mentors(make_user, 2, is_verified=True)
+    await make_user()  # seekers are never counted
+    await db.profiles.insert_one({"user_id": pending[0]["id"], "bio": "First", "avatar_url": ""})
+
+    first = await client.get("/api/admin/mentors/queue", params={"limit": 3}, headers=headers)
+    assert first.status_code == 200
+    page = first.json()
+    assert (page["total"], page["pending"]) == (7, 5)
+    assert [item["user"]["id"] for item in page["items"]] == [mentor["id"] for mentor in pending[:3]]
+    assert page["items"][0]["profile"]["bio"] == "First"
+    assert page["items"][1]["profile"] is None
+    assert "hashed_password" not in page["items"][0]["user"]
+
+    rest = await client.get("/api/admin/mentors/queue", params={"limit": 3, "cursor": page["next_cursor"]}, headers=headers)
+    assert [item["user"]["id"] for item in rest.json()["items"]] == [mentor["id"] for mentor in pending[3:]]
+    assert rest.json()["next_cursor"] is None
+
+    verified = await client.get("/api/admin/mentors/queue", params={"verified": True}, headers=headers)
+    assert len(verified.json()["items"]) == 2
+    assert verified.json()["pending"] == 5
+
+
+async def test_mentor_list_defaults_to_pending(client, make_user):
+    _, headers = await make_user("admin")
+    pending = await add_mentors(make_user, 2)
+    await add_mentors(make_user, 1, is_verified=True)
+
+    response = await client.get("/api/admin/mentors", headers=headers)
+    assert [entry["user"]["id"] for entry in response.json()] == [mentor["id"] for mentor in pending]
+    response = await client.get("/api/admin/mentors", params={"verified": True}, headers=headers)
+    assert len(response.json()) == 1
+
+
+async def test_admin_routes_reject_other_roles(client, make_user):
+    mentor, mentor_headers = await make_user("mentor")
+    _, seeker_headers = await make_user()
+    for headers in (mentor_headers, seeker_headers):
+        assert (await client.get("/api/admin/mentors", headers=headers)).status_code == 403
+        assert (await client.put(f"/api/admin/mentors/{mentor['id']}/verify", headers=headers)).status_code == 403
+        assert (await client.delete(f"/api/admin/mentors/{mentor['id']}", headers=headers)).status_code == 403
+        assert (await client.post("/api/admin/seed-data", headers=headers)).status_code == 403
+
+
+async def test_queue_without_mentors(client, make_user):
+    _, headers = await make_user("admin")
+    _, seeker_headers = await make_user()
+
+    response = await client.get("/api/admin/mentors/queue", headers=headers)
+    assert response.json() == {"items": [], "next_cursor": None, "total": 0, "pending": 0}
+    assert (await client.get("/api/admin/mentors/queue", headers=seeker_headers)).status_code == 403
+    assert (await client.get("/api/admin/mentors/queue", params={"cursor": "bad"}, headers=headers)).status_code == 400
+
+
+class RacingUsers:
+    """``users`` collection that runs ``race`` once, right after the first ``find``."""
+
+    def __init__(self, users, race):
+        self._users = users
+        self._race = race
+
+    def __getattr__(self, name):
+        return getattr(self._users, name)
+
+    def find(self, *args, **kwargs):
+        return RacingCursor(self, self._users.find(*args, **kwargs))
+
+
+class RacingCursor:
+    def __init__(self, users, cursor):
+        self._users = users
+        self._cursor = cursor
+
+    async def to_list(self, length):
+        docs = await self._cursor.to_list(length)
+        race, self._users._race = self._users._race, None
+        if race:
+            await race()
+        return docs
+
+
+class RacingDb:
+    def __init__(self, db, race):
+        self._db = db
+        self.users = RacingUsers(db.users, race)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+@pytest.mark.parametrize("action,outcome", [("verify", "verified"), ("reject", "rejected"), ("delete", "deleted")])
+async def test_bulk_moderation(client, db, make_user, action, outcome):
+    _, headers = await make_user("admin")
+    seeker, _ = await make_user()
+    mentors = await add_mentors(make_user, 3)
+    await db.profiles.insert_one({"user_id": mentors[0]["id"], "bio": ""})
+    ids = [mentors[0]["id"], "missing", seeker["id"], mentors[1]["id"], mentors[0]["id"]]
+
+    response = await client.post("/api/admin/mentors/bulk", json={"action": action, "ids": ids}, headers=headers)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["processed"] == 2
+    assert [(item["id"], item["status"]) for item in result["results"]] == [
+        (mentors[0]["id"], outcome), ("missing", "not_found"), (seeker["id"], "not_found"), (mentors[1]["id"], outcome),
+    ]
+    untouched = await db.users.find_one({"id": mentors[2]["id"]})
+    assert (untouched["role"], untouched["is_verified"]) == ("mentor", False)
+    assert (await db.users.find_one({"id": seeker["id"]}))["role"] == "seeker"
+
+    first = await db.users.find_one({"id": mentors[0]["id"]})
+    if action == "verify":
+        assert (first["role"], first["is_verified"]) == ("mentor", True)
+    elif action == "reject":
+        assert (first["role"], first["is_verified"]) == ("seeker", False)
+    else:
+        assert first is None
+        assert await db.profiles.count_documents({}) == 0
+        assert await db.cleanup_jobs.count_documents({}) == 2
+
+
+@pytest.mark.parametrize("action", ["verify", "delete"])
+async def test_bulk_moderation_reports_what_the_write_did(client, db, make_user, monkeypatch, action):
+    _, headers = await make_user("admin")
+    mentors = await add_mentors(make_user, 3)
+
+    async def race():
+        # Between the read and the write, another admin deletes one mentor
+        # and rejects another
+        await db.users.delete_one({"id": mentors[0]["id"]})
+        await db.users.update_one({"id": mentors[1]["id"]}, {"$set": {"role": "seeker"}})
+
+    monkeypatch.setattr("server.db", RacingDb(db, race))
+    response = await client.post(
+        "/api/admin/mentors/bulk", json={"action": action, "ids": [m["id"] for m in mentors]}, headers=headers
+    )
+    statuses = [item["status"] for item in response.json()["results"]]
+    if action == "verify":
+        assert statuses == ["not_found", "not_found", "verified"]
+    else:
+        # Gone either way; the cascade cleanup is idempotent
+        assert statuses == ["deleted", "not_found", "deleted"]
+        assert (await db.users.find_one({"id": mentors[1]["id"]}))["role"] == "seeker"
+    assert response.json()["processed"] == len(statuses) - statuses.count("not_found")
+
+
+async def test_bulk_moderation_rejects_bad_requests(client, make_user):
+    _, headers = await make_user("admin")
+    assert (await client.post("/api/admin/mentors/bulk", json={"action": "ban", "ids": ["x"]}, headers=headers)).status_code == 400
+    too_many = {"action": "verify", "ids": [str(i) for i in range(1001)]}
+    assert (await client.post("/api/admin/mentors/bulk", json=too_many, headers=headers)).status_code == 400
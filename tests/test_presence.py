@@ -0,0 +1,130 @@
+import random
+
+import pytest
+import socketio
+
+import server as server_module
+from presence import PresenceTracker, presence_room
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_changes_are_coalesced_and_expired(clock):
+    sent = []
+
+    async def emit(event, data, rooms):
+        sent.append((event, data, sorted(rooms)))
+
+    tracker = PresenceTracker(emit=emit, ttl=90, clock=clock)
+    tracker.connect("s1", "alice")
+    tracker.connect("s2", "bob")
+    # bob flaps within the window and is reported once, as online
+    tracker.disconnect("s2")
+    tracker.connect("s3", "bob")
+    assert await tracker.flush() == 2
+    assert sent == [("presence", {"users": {"alice": True, "bob": True}},
+                     [presence_room("alice"), presence_room("bob")])]
+
+    # A second socket keeps alice online when the first goes away
+    tracker.connect("s4", "alice")
+    tracker.disconnect("s1")
+    assert await tracker.flush() == 0
+
+    clock.now = 60
+    tracker.heartbeat("s3")
+    clock.now = 120
+    assert await tracker.flush() == 1
+    assert sent[-1][1] == {"users": {"alice": False}}
+    assert tracker.snapshot(["alice", "bob", "carol"]) == {
+        "alice": False, "bob": True, "carol": False
+    }
+
+
+async def test_heartbeat_brings_back_an_expired_socket(clock):
+    sent = []
+
+    async def emit(event, data, rooms):
+        sent.append(data["users"])
+
+    tracker = PresenceTracker(emit=emit, ttl=90, clock=clock)
+    tracker.connect("s1", "alice")
+    await tracker.flush()
+    clock.now = 100
+    await tracker.flush()
+    assert not tracker.is_online("alice")
+
+    # Without the owner an unknown sid stays unknown
+    tracker.heartbeat("s1")
+    assert not tracker.is_online("alice")
+    tracker.heartbeat("s1", "alice")
+    assert tracker.is_online("alice")
+    await tracker.flush()
+    assert sent == [{"alice": True}, {"alice": False}, {"alice": True}]
+
+    tracker.disconnect("s1")
+    assert not tracker.is_online("alice")
+
+
+async def test_heartbeat_handler_reregisters_the_session_user(make_user, open_socket):
+    user, headers = await make_user()
+    sid = await open_socket(headers)
+    anonymous = await open_socket()
+    assert server_module.presence.is_online(user["id"])
+
+    server_module.presence.disconnect(sid)  # as expire() does
+    assert not server_module.presence.is_online(user["id"])
+    await server_module.heartbeat(sid)
+    assert server_module.presence.is_online(user["id"])
+    server_module.presence.drain_changes()
+    # An anonymous socket has no user to bring online
+    await server_module.heartbeat(anonymous)
+    assert not server_module.presence.is_online(None)
+    assert server_module.presence.drain_changes() == {}
+
+
+async def test_batched_broadcast_with_10k_clients():
+    """One churn window over 10k connected, watching clients."""
+    clients, contacts, churn = 10000, 20, 1000
+    rng = random.Random(39)
+    server = socketio.AsyncServer(async_mode="asgi")
+    deliveries = 0
+
+    async def count_delivery(eio_sid, pkt):
+        nonlocal deliveries
+        deliveries += 1
+
+    server._send_eio_packet = count_delivery
+
+    async def emit(event, data, rooms):
+        await server.emit(event, data, room=rooms)
+
+    tracker = PresenceTracker(emit=emit)
+    users = [f"user-{i}" for i in range(clients)]
+    for i, user_id in enumerate(users):
+        sid = await server.manager.connect(f"eio-{i}", "/")
+        for watched in rng.sample(users, contacts):
+            server.manager.basic_enter_room(sid, "/", presence_room(watched), eio_sid=f"eio-{i}")
+        tracker.connect(f"s-{i}", user_id)
+    await tracker.flush()
+
+    # Half of the churning users reconnect within the window, half leave
+    churned = rng.sample(range(clients), churn)
+    events = []
+    for n, i in enumerate(churned):
+        tracker.disconnect(f"s-{i}")
+        events.append((users[i], False))
+        if n % 2:
+            tracker.connect(f"r-{i}", users[i])
+            events.append((users[i], True))
+
+    deliveries = 0
+    for user_id, online in events:
+        await emit("presence", {"users": {user_id: online}}, [presence_room(user_id)])
+    naive_deliveries = deliveries
+
+    deliveries = 0
+    changed = await tracker.flush()
+    assert changed == churn // 2
+    # Each watcher gets at most one packet per window
+    assert deliveries <= clients
+    assert deliveries < naive_deliveries / 2
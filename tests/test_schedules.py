@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2030, 1, 1, 9)
+
+
+async def add_schedules(db, mentor, seeker, count, **fields):
+    docs = []
+    for i in range(count):
+        docs.append({
+            "id": f"schedule-{i:03d}",
+            "mentor_id": mentor["id"],
+            "seeker_id": seeker["id"],
+            # Pairs share a start time, so paging must break ties by id
+            "start_time": START + timedelta(hours=i // 2),
+            "end_time": START + timedelta(hours=i // 2, minutes=45),
+            "status": "scheduled",
+            "title": f"Session {i}",
+            "description": "",
+            "meeting_link": "",
+            "created_at": START,
+            "updated_at": START,
+            **fields,
+        })
+    await db.schedules.insert_many(docs)
+    return docs
+
+
+def test_cursor_round_trip_and_filter():
+    cursor = server.encode_cursor(START, "schedule-1")
+    assert server.decode_cursor(cursor) == (START, "schedule-1")
+    assert server.after_cursor("start_time", None) == {}
+    assert server.after_cursor("start_time", cursor) == {"$or": [
+        {"start_time": {"$gt": START}},
+        {"start_time": START, "id": {"$gt": "schedule-1"}},
+    ]}
+    assert server.after_cursor("created_at", cursor, descending=True)["$or"][0] == {"created_at": {"$lt": START}}
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "bm8tc2VwYXJhdG9y", "%%%"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as raised:
+        server.after_cursor("start_time", cursor)
+    assert raised.value.status_code == 400
+
+
+async def test_schedule_pages_cover_every_row_once(client, db, make_user):
+    mentor, _ = await make_user("mentor")
+    seeker, headers = await make_user()
+    docs = await add_schedules(db, mentor, seeker, 7)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/api/schedules", params=params, headers=headers)
+        assert response.status_code == 200
+        seen += [schedule["id"] for schedule in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == [doc["id"] for doc in docs]
+
+    window = await client.get("/api/schedules", headers=headers, params={
+        "from": (START + timedelta(hours=1)).isoformat(), "to": (START + timedelta(hours=2)).isoformat(),
+    })
+    assert [schedule["id"] for schedule in window.json()] == ["schedule-002", "schedule-003"]
+
+    bad = await client.get("/api/schedules", params={"cursor": "garbage"}, headers=headers)
+    assert bad.status_code == 400
+
+
+async def test_ics_export(client, db, make_user):
+    mentor, _ = await make_user("mentor")
+    seeker, headers = await make_user()
+    await add_schedules(db, mentor, seeker, 2, description="Notes; line one\nline two")
+    await db.schedules.update_one({"id": "schedule-001"}, {"$set": {"status": "cancelled"}})
+
+    response = await client.get("/api/schedules/export.ics", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/calendar")
+    body = response.text
+    assert body.startswith("BEGIN:VCALENDAR\r\n") and body.endswith("END:VCALENDAR\r\n")
+    assert body.count("BEGIN:VEVENT") == 2
+    assert "UID:schedule-000@testnet\r\n" in body
+    assert "DTSTART:20300101T090000Z\r\nDTEND:20300101T094500Z\r\n" in body
+    assert "DESCRIPTION:Notes\\; line one\\nline two\r\n" in body
+    assert body.count("STATUS:CANCELLED") == 1
+
+    scheduled = await client.get("/api/schedules/export.ics", params={"status": "scheduled"}, headers=headers)
+    assert scheduled.text.count("BEGIN:VEVENT") == 1
+
+
+def session(mentor_id, start, hours=1):
+    return server.ScheduleCreate(mentor_id=mentor_id, start_time=start, end_time=start + timedelta(hours=hours))
+
+
+def test_expand_recurrence():
+    weekly = server.expand_recurrence(session("m", START), server.Recurrence(count=3))
+    assert [occurrence.start_time for occurrence in weekly] == [START + timedelta(weeks=i) for i in range(3)]
+    assert all(occurrence.end_time - occurrence.start_time == timedelta(hours=1) for occurrence in weekly)
+
+    until = server.Recurrence(frequency="biweekly", until=START + timedelta(weeks=4))
+    assert len(server.expand_recurrence(session("m", START), until)) == 3
+    # One past the limit, so that book_sessions rejects the series
+    endless = server.Recurrence(until=START + timedelta(weeks=1000))
+    assert len(server.expand_recurrence(session("m", START), endless)) == server.MAX_BOOKINGS_PER_REQUEST + 1
+
+    for recurrence in (server.Recurrence(frequency="daily", count=2), server.Recurrence(), server.Recurrence(count=2, until=START)):
+        with pytest.raises(HTTPException) as raised:
+            server.expand_recurrence(session("m", START), recurrence)
+        assert raised.value.status_code == 400
+
+
+async def test_bulk_booking_reports_conflicts(client, db, make_user):
+    mentor, _ = await make_user("mentor")
+    other, _ = await make_user("mentor")
+    seeker, headers = await make_user()
+    await add_schedules(db, mentor, seeker, 1)  # 09:00-09:45 on START's day
+
+    def slot(mentor_id, start, minutes=60):
+        return {
+            "mentor_id": mentor_id, "title": "Session",
+            "start_time": start.isoformat(), "end_time": (start + timedelta(minutes=minutes)).isoformat(),
+        }
+
+    response = await client.post("/api/schedules/bulk", headers=headers, json={"sessions": [
+        slot(mentor["id"], START + timedelta(hours=3)),
+        slot(mentor["id"], START + timedelta(minutes=30)),  # overlaps the stored booking
+        slot(mentor["id"], START + timedelta(hours=3, minutes=30)),  # overlaps the first one
+        slot(other["id"], START + timedelta(minutes=30)),  # another mentor is free
+        slot("missing", START),
+    ]})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["booked"], result["conflicts"]) == (2, 3)
+    outcomes = result["results"]
+    assert [outcome["booked"] for outcome in outcomes] == [True, False, False, True, False]
+    assert outcomes[1]["conflict_with"] == "schedule-000"
+    assert outcomes[2]["conflict_with"] == outcomes[0]["schedule"]["id"]
+    assert outcomes[4]["detail"] == "Mentor not found"
+    assert await db.schedules.count_documents({}) == 3
+
+    invalid = await client.post("/api/schedules/bulk", headers=headers, json={"sessions": [slot(mentor["id"], START, minutes=0)]})
+    assert invalid.status_code == 400
+
+
+async def test_offset_times_are_stored_as_utc(client, db, make_user):
+    mentor, _ = await make_user("mentor")
+    seeker, headers = await make_user()
+    await add_schedules(db, mentor, seeker, 1)
+
+    response = await client.post("/api/schedules/bulk", headers=headers, json={"sessions": [
+        # 09:15 UTC, inside the stored 09:00-09:45 booking
+        {"mentor_id": mentor["id"], "start_time": "2030-01-01T11:15:00+02:00", "end_time": "2030-01-01T12:00:00+02:00"},
+        {"mentor_id": mentor["id"], "start_time": "2030-01-01T12:00:00Z", "end_time": "2030-01-01T13:00:00Z"},
+    ]})
+    assert response.status_code == 200
+    assert [outcome["booked"] for outcome in response.json()["results"]] == [False, True]
+    stored = await db.schedules.find_one({"id": response.json()["results"][1]["schedule"]["id"]})
+    assert stored["start_time"] == datetime(2030, 1, 1, 12)
+
+
+async def test_recurring_booking(client, db, make_user):
+    mentor, _ = await make_user("mentor")
+    seeker, headers = await make_user()
+    # Blocks the third week of the series
+    await add_schedules(db, mentor, seeker, 1, start_time=START + timedelta(weeks=2), end_time=START + timedelta(weeks=2, hours=1))
+
+    response = await client.post("/api/schedules/recurring", headers=headers, json={
+        "mentor_id": mentor["id"], "title": "Weekly",
+        "start_time": "2030-01-01T09:00:00Z", "end_time": "2030-01-01T10:00:00Z",
+        "recurrence": {"frequency": "weekly", "count": 4},
+    })
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["booked"], result["conflicts"]) == (3, 1)
+    assert [outcome["start_time"] for outcome in result["results"]] == [
+        (START + timedelta(weeks=i)).isoformat() for i in range(4)
+    ]
+    assert result["results"][2]["conflict_with"] == "schedule-000"
+
+    too_long = await client.post("/api/schedules/recurring", headers=headers, json={
+        "mentor_id": mentor["id"],
+        "start_time": "2031-01-01T09:00:00", "end_time": "2031-01-01T10:00:00",
+        "recurrence": {"until": "2040-01-01T00:00:00"},
+    })
+    assert too_long.status_code == 400
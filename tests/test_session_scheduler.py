@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from session_scheduler import END, REMIND, START, SessionScheduler
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2030, 1, 1, 8)
+
+
+def make_schedule(schedule_id, start, status="scheduled", hours=1):
+    return {
+        "id": schedule_id,
+        "mentor_id": "mentor",
+        "seeker_id": "seeker",
+        "title": schedule_id,
+        "start_time": start,
+        "end_time": start + timedelta(hours=hours),
+        "status": status,
+    }
+
+
+@pytest.fixture
+def notifications():
+    return []
+
+
+@pytest.fixture
+def scheduler(db, notifications):
+    async def notify(user_id, event, data):
+        notifications.append((user_id, event, data["schedule_id"]))
+
+    return SessionScheduler(get_db=lambda: db, notify=notify, lookahead=timedelta(hours=6))
+
+
+def boundaries(scheduler):
+    return sorted((kind, schedule_id) for kind, schedule_id in scheduler._keys)
+
+
+async def status_of(db, schedule_id):
+    return (await db.schedules.find_one({"id": schedule_id}))["status"]
+
+
+async def test_window_load_and_transitions(db, scheduler, notifications):
+    await db.schedules.insert_many([
+        make_schedule("confirmed", NOW + timedelta(hours=1), "confirmed"),
+        make_schedule("unconfirmed", NOW + timedelta(hours=1)),
+        make_schedule("later", NOW + timedelta(hours=10), "confirmed"),
+        make_schedule("cancelled", NOW + timedelta(hours=1), "cancelled"),
+    ])
+
+    next_wake = await scheduler.run_once(NOW)
+    assert boundaries(scheduler) == [
+        (END, "confirmed"), (END, "unconfirmed"),
+        (REMIND, "confirmed"), (REMIND, "unconfirmed"),
+        (START, "confirmed"), (START, "unconfirmed"),
+    ]
+    assert next_wake == NOW + timedelta(minutes=45)
+
+    await scheduler.run_once(NOW + timedelta(minutes=45))
+    assert sorted(notifications) == [
+        ("mentor", "session_reminder", "confirmed"), ("mentor", "session_reminder", "unconfirmed"),
+        ("seeker", "session_reminder", "confirmed"), ("seeker", "session_reminder", "unconfirmed"),
+    ]
+    await scheduler.run_once(NOW + timedelta(hours=1))
+    assert await status_of(db, "confirmed") == "in_progress"
+    assert await status_of(db, "unconfirmed") == "scheduled"
+    await scheduler.run_once(NOW + timedelta(hours=2))
+    assert await status_of(db, "confirmed") == "completed"
+    assert await status_of(db, "unconfirmed") == "no_show"
+    assert await status_of(db, "later") == "confirmed"
+
+
+async def test_reload_extends_the_window_once(db, scheduler):
+    await db.schedules.insert_many([
+        make_schedule("early", NOW + timedelta(hours=1), "confirmed"),
+        make_schedule("next-window", NOW + timedelta(hours=7), "confirmed"),
+    ])
+    await scheduler.run_once(NOW)
+    assert (START, "next-window") not in scheduler._keys
+
+    # Past half the lookahead the next window is loaded; boundaries loaded
+    # before are neither duplicated nor re-read
+    await scheduler.run_once(NOW + timedelta(hours=3, minutes=1))
+    assert (START, "next-window") in scheduler._keys
+    assert scheduler._loaded_until == NOW + timedelta(hours=9, minutes=1)
+    assert len(scheduler._heap) == len(scheduler._keys)
+
+
+class QuerySpy:
+    """Records the filters of ``schedules.find`` calls."""
+
+    def __init__(self, db):
+        self.db = db
+        self.queries = []
+
+    @property
+    def schedules(self):
+        return self
+
+    def find(self, query, *args, **kwargs):
+        self.queries.append(query)
+        return self.db.schedules.find(query, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.db.schedules, name)
+
+
+async def test_reload_reads_only_sessions_not_over(db, scheduler):
+    spy = QuerySpy(db)
+    scheduler._get_db = lambda: spy
+    await db.schedules.insert_one(make_schedule("running", NOW - timedelta(hours=1), "in_progress", hours=8))
+
+    await scheduler.run_once(NOW)
+    # The first load catches up on everything still active
+    assert "end_time" not in spy.queries[0]
+    assert (END, "running") not in scheduler._keys  # ends after the window
+
+    # Later loads bound the scan by the end of the previous window, which
+    # still finds a session that started long before it
+    await scheduler.run_once(NOW + timedelta(hours=4))
+    assert spy.queries[1]["end_time"] == {"$gte": NOW + timedelta(hours=6)}
+    assert [key for key in scheduler._keys if key[1] == "running"] == [(END, "running")]
+
+
+async def test_track_and_untrack(db, scheduler, notifications):
+    schedule = make_schedule("booked", NOW + timedelta(hours=2), "confirmed")
+    scheduler.track(schedule)  # nothing is loaded yet
+    assert scheduler._heap == []
+
+    await scheduler.run_once(NOW)
+    await db.schedules.insert_one(dict(schedule))
+    scheduler.track(schedule)
+    scheduler.track(make_schedule("outside", NOW + timedelta(hours=8)))
+    assert boundaries(scheduler) == [(END, "booked"), (REMIND, "booked"), (START, "booked")]
+
+    scheduler.untrack("booked")
+    assert scheduler._keys == {} and scheduler._heap == []  # compacted
+    scheduler.track(schedule)
+    scheduler.untrack("missing")
+    await scheduler.run_once(NOW + timedelta(hours=1, minutes=45))
+    assert len(notifications) == 2
+    await scheduler.run_once(NOW + timedelta(hours=3))
+    assert await status_of(db, "booked") == "completed"
+
+    # A malformed document is logged, not raised
+    scheduler.track({"id": "broken", "start_time": None, "end_time": None})
+
+
+async def test_booking_with_offset_times_is_tracked(client, db, make_user):
+    mentor, _ = await make_user("mentor")
+    _, headers = await make_user()
+    start = (datetime.utcnow() + timedelta(hours=1)).replace(microsecond=0)
+    await server.session_scheduler.run_once()
+    try:
+        response = await client.post("/api/schedules", headers=headers, json={
+            "mentor_id": mentor["id"],
+            "start_time": start.isoformat() + "Z",
+            "end_time": (start + timedelta(hours=1)).isoformat() + "Z",
+        })
+        assert response.status_code == 200
+        schedule_id = response.json()["id"]
+        assert (START, schedule_id) in server.session_scheduler._keys
+        assert (await db.schedules.find_one({"id": schedule_id}))["start_time"] == start
+
+        cancelled = await client.put(f"/api/schedules/{schedule_id}", json={"status": "cancelled"}, headers=headers)
+        assert cancelled.status_code == 200
+        assert not any(key[1] == schedule_id for key in server.session_scheduler._keys)
+    finally:
+        await server.session_scheduler.stop()
@@ -0,0 +1,96 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """``(event, data, room)`` of every ``sio.emit``."""
+    sent = []
+
+    async def emit(event, data=None, room=None, **kwargs):
+        sent.append((event, data, room))
+
+    monkeypatch.setattr(server.sio, "emit", emit)
+    return sent
+
+
+async def add_conversation(db, *members):
+    conversation_id = str(uuid.uuid4())
+    await db.conversations.insert_one({"id": conversation_id, "members": [user["id"] for user in members]})
+    return conversation_id
+
+
+async def test_rooms_require_membership(db, make_user, open_socket, emitted):
+    _, headers = await make_user()
+    other, _ = await make_user()
+    theirs = await add_conversation(db, other)
+    sid = await open_socket(headers)
+
+    assert await server.join_room(sid, {"room": theirs}) == {"error": "Conversation not found"}
+    ack = await server.send_message(sid, {"room": theirs, "content": "hi"})
+    assert ack == {"error": "Join the conversation first"}
+    assert await server.send_message(sid, {"room": theirs, "content": "  "}) == {"error": "Message content is required"}
+
+    anonymous = await open_socket()
+    assert await server.join_room(anonymous, {"room": theirs}) == {"error": "Not authenticated"}
+    assert await server.send_message(anonymous, {"room": theirs, "content": "hi"}) == {"error": "Not authenticated"}
+
+    assert await db.messages.count_documents({}) == 0
+    assert emitted == []
+
+
+async def test_send_message_acks_and_broadcasts(db, make_user, open_socket, emitted):
+    user, headers = await make_user()
+    other, _ = await make_user()
+    conversation_id = await add_conversation(db, user, other)
+    sid = await open_socket(headers)
+
+    assert await server.join_room(sid, {"room": conversation_id}) == {"ok": True}
+    ack = await server.send_message(sid, {"room": conversation_id, "content": "hello"})
+
+    stored = await db.messages.find_one({"conversation_id": conversation_id}, {"_id": 0})
+    [(event, payload, room)] = emitted
+    assert (event, room) == ("receive_message", conversation_id)
+    assert ack == {"id": stored["id"], "created_at": payload["created_at"]}
+    assert (payload["id"], payload["sender_id"], payload["content"]) == (stored["id"], user["id"], "hello")
+
+    await server.leave_room(sid, {"room": conversation_id})
+    assert await server.send_message(sid, {"room": conversation_id, "content": "again"}) == {
+        "error": "Join the conversation first"
+    }
+
+
+async def test_http_and_socket_messages_use_the_same_event(client, db, make_user, open_socket, emitted):
+    user, headers = await make_user()
+    conversation_id = await add_conversation(db, user)
+    sid = await open_socket(headers)
+    await server.join_room(sid, {"room": conversation_id})
+
+    await server.send_message(sid, {"room": conversation_id, "content": "over the socket"})
+    response = await client.post(
+        "/api/messages", json={"conversation_id": conversation_id, "content": "over http"}, headers=headers
+    )
+    assert response.status_code == 200
+
+    assert [(event, room) for event, _, room in emitted] == [("receive_message", conversation_id)] * 2
+    socket_payload, http_payload = emitted[0][1], emitted[1][1]
+    assert socket_payload.keys() == http_payload.keys()
+    assert http_payload["id"] == response.json()["id"]
+
+
+@pytest.mark.parametrize("data", [None, "room", ["room"], {"room": ["room"]}, {"room": {"id": "x"}}])
+async def test_malformed_payloads_get_an_error_ack(db, make_user, open_socket, emitted, data):
+    _, headers = await make_user()
+    sid = await open_socket(headers)
+
+    for handler in (server.join_room, server.leave_room, server.message_ack, server.send_message):
+        ack = await handler(sid, data)
+        assert set(ack) == {"error"}, handler.__name__
+    assert set(await server.unwatch_presence(sid, data)) == {"error"}
+    assert await db.messages.count_documents({}) == 0
+    assert emitted == []
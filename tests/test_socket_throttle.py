@@ -0,0 +1,36 @@
+import pytest
+
+from socket_throttle import EphemeralCoalescer, EventThrottle
+
+pytestmark = pytest.mark.anyio
+
+
+def test_sid_and_room_buckets(clock):
+    throttle = EventThrottle(sid_rate=1, sid_burst=3, room_rate=1, room_burst=4, clock=clock)
+    assert [throttle.allow("send_message", "a", "room") for _ in range(4)] == [True, True, True, False]
+    # A second client gets only what is left of the room's budget
+    assert [throttle.allow("send_message", "b", "room") for _ in range(2)] == [True, False]
+    clock.now = 2
+    assert throttle.allow("send_message", "b", "room")
+    assert throttle.dropped == {"send_message": 2}
+
+
+async def test_coalescer_emits_once_per_room_per_window():
+    sent = []
+
+    async def emit(event, data, room):
+        sent.append((event, room, data["users"]))
+
+    coalescer = EphemeralCoalescer(emit=emit)
+    for _ in range(50):
+        coalescer.add("typing", "r1", "alice", True)
+    coalescer.add("typing", "r1", "bob", True)
+    coalescer.add("typing", "r1", "alice", False)
+    coalescer.add("typing", "r2", "carol", True)
+    assert await coalescer.flush() == 2
+    assert sent == [
+        ("typing", "r1", {"alice": False, "bob": True}),
+        ("typing", "r2", {"carol": True}),
+    ]
+    assert coalescer.coalesced["typing"] == 51
+    assert await coalescer.flush() == 0
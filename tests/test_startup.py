@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# Runs in a fresh interpreter so the import is really cold
+PROBE = """
+import asyncio, json, sys
+import server
+lazy = [name for name in ("motor", "jose", "passlib", "fuzzywuzzy") if name in sys.modules]
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+async def main():
+    server.database.use_client(AsyncMongoMockClient())
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.lifespan(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://probe") as http:
+            first = await http.get("/healthz")
+            while (await http.get("/readyz")).status_code != 200:
+                await asyncio.sleep(0.01)
+    return first.status_code
+
+status = asyncio.run(main())
+print(json.dumps({"healthz": status, "eager_heavy_modules": lazy}))
+"""
+
+
+def test_cold_start_defers_heavy_imports():
+    env = {"MONGO_URL": "mongodb://localhost:27017", "DB_NAME": "startup_probe", **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, timeout=120, check=True,
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    assert probe["healthz"] == 200
+    assert probe["eager_heavy_modules"] == []
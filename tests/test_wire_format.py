@@ -0,0 +1,57 @@
+import uuid
+from datetime import datetime
+
+import msgpack
+import pytest
+import socketio
+
+from wire_format import packet_class
+
+pytestmark = pytest.mark.anyio
+
+
+def message_payload():
+    return {
+        "id": str(uuid.uuid4()),
+        "conversation_id": str(uuid.uuid4()),
+        "sender_id": str(uuid.uuid4()),
+        "content": "See you at the session tomorrow, I'll bring the notes.",
+        "message_type": "text",
+        "created_at": datetime(2026, 10, 19, 8, 30, 15, 123456),
+    }
+
+
+def test_datetimes_on_the_wire():
+    payload = message_payload()
+    text = packet_class("json")(data=["receive_message", payload]).encode()
+    assert '"created_at":"2026-10-19T08:30:15.123456"' in text
+
+    binary = packet_class("msgpack")(data=["receive_message", payload]).encode()
+    decoded = msgpack.loads(binary, timestamp=3)
+    assert decoded["data"][1]["created_at"].replace(tzinfo=None) == payload["created_at"]
+
+
+async def room_server(serializer, room_size):
+    """A server with ``room_size`` clients in ``"room"``; returns it and the bytes sent to them."""
+    server = socketio.AsyncServer(async_mode="asgi", serializer=packet_class(serializer))
+    sent = []
+
+    async def deliver(eio_sid, pkt):
+        sent.append(len(pkt.data))
+
+    server._send_eio_packet = deliver
+    for i in range(room_size):
+        sid = await server.manager.connect(f"eio-{i}", "/")
+        server.manager.basic_enter_room(sid, "/", "room", eio_sid=f"eio-{i}")
+    return server, sent
+
+
+async def test_msgpack_broadcasts_are_smaller():
+    payload = message_payload()
+    sizes = {}
+    for serializer in ("json", "msgpack"):
+        server, sent = await room_server(serializer, 50)
+        await server.emit("receive_message", payload, room="room")
+        assert len(sent) == 50
+        sizes[serializer] = sent[0]
+    assert sizes["msgpack"] < sizes["json"]